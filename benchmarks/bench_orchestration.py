@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Benchmark of the orchestration of backups and restores against the local stand-ins of HAWQ, PXF and HDFS (see
+standins.py). Every scale runs in a process of its own, a fresh interpreter state and its own peak memory:
+
+    python benchmarks/bench_orchestration.py --tables 10,1000,10000,100000 --jobs 4
+
+For every number of tables it measures the planning time of a backup (--plan: catalog snapshot, selection,
+fingerprints and scheduling), the wall clock time of a backup and of a restore of the backup, the orchestration
+overhead per table, the throughput and the peak memory. The stand-ins do next to no work, so the numbers are the
+cost of hawqbackup itself, which should grow linearly with the number of tables.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import Queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import standins
+
+
+def peak_memory():
+    """
+    Peak resident memory of the process
+    :return: megabytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_scale(tables, jobs, latency, workdir):
+    """
+    Plan, backup and restore a synthetic database of some number of tables. Must run in a process of its own, the
+    stand-ins replace pgdb and the environment of the process.
+    :param tables: number of tables of the database
+    :param jobs: number of jobs of the backup and the restore
+    :param latency: seconds every external table statement takes
+    :param workdir: directory of the run
+    :return: dictionary of measures
+    """
+    hdfs_root = workdir + '/hdfs'
+    os.makedirs(hdfs_root)
+    cluster = standins.FakeCluster(tables, hdfs_root, statement_latency=latency)
+    standins.install(cluster, workdir)
+
+    # The progress bars are written to the standard output captured when hawqbackup is imported
+    sys.stdout = open(os.devnull, 'w')
+    logger = logging.getLogger("hdb_logger")
+    logger.addHandler(logging.StreamHandler(sys.stderr))
+    logger.setLevel(logging.ERROR)
+
+    from hawqbackup import main, backup, restore
+    storage = lambda *args: standins.LocalStorage(hdfs_root, *args)
+    backup.HdfsStorage = storage
+    restore.HdfsStorage = storage
+
+    results = {'tables': tables, 'jobs': jobs, 'memory_start': peak_memory()}
+    common = ['-d', 'bench', '-y', '-j', str(jobs)]
+
+    start = time.time()
+    hdb_backup = backup.HdbBackup()
+    hdb_backup.set_vars(main.parseargs(['backup', '--plan'] + common))
+    hdb_backup.run_backup()
+    results['plan'] = time.time() - start
+    results['memory_plan'] = peak_memory()
+
+    start = time.time()
+    hdb_backup = backup.HdbBackup()
+    hdb_backup.set_vars(main.parseargs(['backup'] + common))
+    hdb_backup.run_backup()
+    results['backup'] = time.time() - start
+    results['memory_backup'] = peak_memory()
+    results['bytes_written'] = cluster.bytes_written
+
+    start = time.time()
+    hdb_restore = restore.HDBRestore()
+    hdb_restore.set_vars(main.parseargs(['restore', '-k', hdb_backup.backup_id] + common))
+    hdb_restore.run_restore()
+    results['restore'] = time.time() - start
+    results['memory_restore'] = peak_memory()
+    results['bytes_read'] = cluster.bytes_read
+
+    return results
+
+
+def run_child(queue, tables, jobs, latency, workdir):
+    try:
+        queue.put(run_scale(tables, jobs, latency, workdir))
+    except SystemExit, e:
+        queue.put({'tables': tables, 'error': 'exited with status {0}'.format(e.code)})
+    except Exception, e:
+        queue.put({'tables': tables, 'error': repr(e)})
+
+
+def measure(tables, jobs, latency, keep=False, timeout=3600):
+    """
+    Run one scale in a child process
+    :param timeout: seconds the run may take before the child is killed
+    :return: dictionary of measures, with an error if the run failed, timed out or the child died
+    """
+    workdir = tempfile.mkdtemp(prefix='hawqbackup_bench_')
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=run_child, args=(queue, tables, jobs, latency, workdir))
+    child.start()
+
+    # A child killed by the OOM killer or a crash never sends its result. Whatever a child sent before exiting is
+    # already in the queue, so it died without a result when the queue stays empty after it exited.
+    deadline = time.time() + timeout
+    result = None
+    while result is None:
+        alive = child.is_alive()
+        try:
+            result = queue.get(timeout=1)
+        except Queue.Empty:
+            if not alive:
+                child.join()
+                result = {'tables': tables, 'error': 'the run died with exit code {0}'.format(child.exitcode)}
+            elif time.time() > deadline:
+                child.terminate()
+                result = {'tables': tables, 'error': 'the run timed out after {0} seconds'.format(timeout)}
+    child.join()
+    if keep:
+        result['workdir'] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def print_report(results):
+    header = "{0:>8} {1:>9} {2:>10} {3:>10} {4:>11} {5:>11} {6:>10} {7:>10}".format(
+        'tables', 'plan (s)', 'backup (s)', 'ms/table', 'restore (s)', 'ms/table', 'tables/s', 'peak (MB)'
+    )
+    print header
+    print '-' * len(header)
+    for result in results:
+        if 'error' in result:
+            print "{0:>8} failed: {1}".format(result['tables'], result['error'])
+            continue
+        tables = result['tables']
+        print "{0:>8} {1:>9.2f} {2:>10.2f} {3:>10.2f} {4:>11.2f} {5:>11.2f} {6:>10.1f} {7:>10.1f}".format(
+            tables, result['plan'], result['backup'], result['backup'] * 1000 / tables, result['restore'],
+            result['restore'] * 1000 / tables, tables / result['backup'], result['memory_restore']
+        )
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Benchmark the orchestration of backups and restores against '
+                                                 'local stand-ins of HAWQ, PXF and HDFS')
+    parser.add_argument('--tables', default='10,1000,10000',
+                        help='Comma-separated list of numbers of tables to benchmark, up to 100000 and more')
+    parser.add_argument('-j', '--jobs', default=4, type=int, help='Jobs of the backups and restores')
+    parser.add_argument('--latency', default=0.0, type=float,
+                        help='Seconds every external table statement takes, 0 measures hawqbackup alone')
+    parser.add_argument('--output', help='Write the measures to this file as JSON, to compare runs')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directories of the runs')
+    parser.add_argument('--timeout', default=3600, type=int, help='Seconds a scale may take before it is killed')
+    options = parser.parse_args(args)
+
+    results = []
+    for tables in [int(value) for value in options.tables.split(',')]:
+        results.append(measure(tables, options.jobs, options.latency, options.keep, options.timeout))
+
+    print_report(results)
+    if options.output:
+        output = open(options.output, 'w')
+        try:
+            json.dump(results, output, indent=2)
+        finally:
+            output.close()
+
+    return len([result for result in results if 'error' in result]) and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,426 @@
+"""
+Local stand-ins for HAWQ, PXF and HDFS, so the orchestration of backups and restores can be measured without a
+cluster. The database is an in-process pgdb module answering the statements hawqbackup runs from a synthetic
+catalog, PXF external tables read and write small text files, and HDFS is a directory of the local filesystem.
+"""
+import errno
+import itertools
+import os
+import random
+import re
+import shutil
+import stat
+import sys
+import threading
+import time
+import types
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class FakeCluster:
+    """
+    Synthetic HAWQ database. One out of ten tables is a partition of a partitioned table, most tables are
+    append-only and the sizes follow a log-normal distribution, so a few tables hold most of the data like in a real
+    warehouse. The data files hold a few rows per table, PXF statements cost the configured latency.
+    """
+
+    def __init__(self, tables, hdfs_root, seed=0, rows_per_table=20, statement_latency=0.0):
+        """
+        Create a FakeCluster object..
+        :param tables: number of tables holding data (plain tables and leaf partitions)
+        :param hdfs_root: local directory standing in for the root of HDFS
+        :param seed: seed of the synthetic catalog
+        :param rows_per_table: rows written by the external table of every table
+        :param statement_latency: seconds every external table statement takes
+        """
+        self.hdfs_root = hdfs_root
+        self.rows_per_table = rows_per_table
+        self.statement_latency = statement_latency
+        self.lock = threading.Lock()
+        self.schemas = set(['public'])
+        self.relations = []
+        self.by_name = {}
+        self.by_oid = {}
+        self.external_tables = {}
+        self.staging_schemas = set()
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.files_written = 0
+
+        rng = random.Random(seed)
+        oid = 16384
+        index = 0
+        while index < tables:
+            schema = 'schema_{0}'.format(index / 1000)
+            self.schemas.add(schema)
+            oid += 1
+            if index % 100 == 90 and tables - index >= 10:
+                # A partitioned table with ten leaves, the table itself holds no data
+                parent_oid = oid
+                parent = 'fact_{0}'.format(index)
+                self.__add(parent_oid, schema, parent, 'a', 0, None, True)
+                for leaf in range(10):
+                    oid += 1
+                    self.__add(oid, schema, '{0}_1_prt_{1}'.format(parent, leaf + 1), 'a',
+                               int(rng.lognormvariate(18, 1.5)), parent_oid, False)
+                index += 10
+                continue
+
+            storage = 'a'
+            if rng.random() < 0.2:
+                storage = 'h'
+            self.__add(oid, schema, 'table_{0}'.format(index), storage, int(rng.lognormvariate(16, 2.5)), None, False)
+            index += 1
+
+    def __add(self, oid, schema, relname, storage, size, root_oid, is_parent):
+        segrel = None
+        if storage == 'a':
+            segrel = 'pg_aoseg_{0}'.format(oid)
+        row = (oid, schema, relname, storage, size, segrel, oid, root_oid, is_parent)
+        self.relations.append(row)
+        self.by_name['"{0}"."{1}"'.format(schema, relname)] = row
+        self.by_oid[oid] = row
+
+    def wait(self):
+        if self.statement_latency:
+            time.sleep(self.statement_latency)
+
+    def account(self, written=0, read=0, files=0):
+        self.lock.acquire()
+        try:
+            self.bytes_written += written
+            self.bytes_read += read
+            self.files_written += files
+        finally:
+            self.lock.release()
+
+
+class FakeCursor:
+    """
+    Cursor answering the statements run by hawqbackup, anything else is rejected
+    """
+
+    catalog_cursor_re = re.compile(r'^DECLARE (\w+) NO SCROLL CURSOR FOR ', re.I)
+    fetch_re = re.compile(r'^FETCH (\d+) FROM (\w+)$', re.I)
+    fingerprint_re = re.compile(r"SELECT '((?:[^']|'')*)', '(\d+):'")
+    create_external_re = re.compile(r"^CREATE (WRITABLE )?EXTERNAL TABLE (\S+) \(.*LOCATION \('pxf://[^/]*(/[^?]*)\?",
+                                    re.I | re.S)
+    insert_re = re.compile(r"^INSERT INTO (\S+) SELECT \* FROM (\S+)"
+                           r"(?:\s+WHERE abs\(hashtext\(COALESCE\(\S+::text, ''\)\)::bigint\) % (\d+) = (\d+))?$",
+                           re.I | re.S)
+    slice_column_re = re.compile(r'FROM pg_attribute .* WHERE a.attrelid IN \( ([\d, ]+) \)', re.I)
+    ao_size_re = re.compile(r'SELECT (\d+), COALESCE\(SUM\(eof\), 0\) FROM pg_aoseg\.', re.I)
+    heap_size_re = re.compile(r'pg_relation_size\(oid\) FROM pg_class WHERE oid IN \( ([\d, ]+) \)', re.I)
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cluster = connection.cluster
+        self.rows = []
+        self.rowcount = -1
+        self.declared = {}
+
+    def execute(self, statement):
+        if self.connection.closed:
+            raise Error("The connection is closed")
+        statement = ' '.join(statement.split())
+        self.rows = []
+        self.rowcount = -1
+
+        upper = statement.upper()
+        if upper.startswith('SET ') or upper.startswith('TRUNCATE '):
+            return
+        if upper == 'SELECT 1':
+            self.rows = [(1,)]
+        elif upper == 'SELECT NSPNAME FROM PG_NAMESPACE':
+            self.rows = [(schema,) for schema in self.cluster.schemas]
+        elif self.catalog_cursor_re.match(statement):
+            # The snapshot does not read the sizes, they are read for the selected tables
+            relations = (row[:4] + (0,) + row[5:] for row in self.cluster.relations)
+            self.declared[self.catalog_cursor_re.match(statement).group(1)] = relations
+        elif self.fetch_re.match(statement):
+            count, name = self.fetch_re.match(statement).groups()
+            relations = self.declared[name]
+            self.rows = list(itertools.islice(relations, int(count)))
+        elif upper.startswith('CLOSE '):
+            del self.declared[statement.split()[1]]
+        elif self.ao_size_re.search(statement):
+            self.rows = [(int(oid), self.cluster.by_oid[int(oid)][4]) for oid in self.ao_size_re.findall(statement)]
+        elif self.heap_size_re.search(statement):
+            oids = self.heap_size_re.search(statement).group(1).split(',')
+            self.rows = [(int(oid), self.cluster.by_oid[int(oid)][4]) for oid in oids]
+        elif 'FROM PG_AOSEG.' in upper:
+            self.__fingerprints(statement)
+        elif self.slice_column_re.search(statement):
+            oids = self.slice_column_re.search(statement).group(1).split(',')
+            self.rows = [(int(oid), 'id') for oid in oids]
+        elif upper.startswith('DROP SCHEMA'):
+            self.cluster.staging_schemas.discard(statement.split()[-2])
+        elif upper.startswith('CREATE SCHEMA'):
+            schema = statement.split()[-1]
+            if schema in self.cluster.staging_schemas:
+                raise DatabaseError('schema "{0}" already exists'.format(schema))
+            self.cluster.staging_schemas.add(schema)
+        elif self.create_external_re.match(statement):
+            writable, name, location = self.create_external_re.match(statement).groups()
+            self.cluster.wait()
+            self.cluster.external_tables[name] = (bool(writable), location)
+        elif self.insert_re.match(statement):
+            self.__insert(*self.insert_re.match(statement).groups())
+        else:
+            raise DatabaseError('Statement not supported by the stand-in: {0}'.format(statement[:200]))
+
+    def __fingerprints(self, statement):
+        for name, relfilenode in self.fingerprint_re.findall(statement):
+            row = self.cluster.by_name[name.replace("''", "'")]
+            self.rows.append((name, '{0}:{1}:{2}'.format(relfilenode, row[4], self.cluster.rows_per_table)))
+
+    def __insert(self, target, source, slices, slice_index):
+        self.cluster.wait()
+        if target in self.cluster.external_tables:
+            # PXF export: every segment writes its own file in the directory of the external table
+            writable, location = self.cluster.external_tables[target]
+            if not writable:
+                raise DatabaseError('cannot write to a readable external table')
+            rows = self.cluster.rows_per_table
+            if slices is not None:
+                rows = rows / int(slices) + (int(slice_index) < rows % int(slices) and 1 or 0)
+            directory = self.cluster.hdfs_root + location
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            content = ''.join(['{0}\t{1}\tvalue_{0}\n'.format(row, source) for row in range(rows)])
+            data_file = open('{0}/0_{1}'.format(directory, threading.current_thread().ident), 'w')
+            try:
+                data_file.write(content)
+            finally:
+                data_file.close()
+            self.cluster.account(written=len(content), files=1)
+            self.rowcount = rows
+            return
+
+        # PXF import: read all the files of the directory of the external table
+        writable, location = self.cluster.external_tables[source]
+        directory = self.cluster.hdfs_root + location
+        rows = 0
+        for name in os.listdir(directory):
+            path = directory + '/' + name
+            if os.path.isfile(path):
+                data_file = open(path)
+                try:
+                    content = data_file.read()
+                finally:
+                    data_file.close()
+                rows += content.count('\n')
+                self.cluster.account(read=len(content))
+        self.rowcount = rows
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        if not self.rows:
+            return None
+        return self.rows.pop(0)
+
+
+class FakeConnection:
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        if self.closed:
+            raise Error("The connection is closed")
+
+    def rollback(self):
+        if self.closed:
+            raise Error("The connection is closed")
+
+    def close(self):
+        self.closed = True
+
+
+def fake_pgdb(cluster):
+    """
+    pgdb module connecting to the stand-in database, to be installed in sys.modules before hawqbackup is imported
+    :param cluster: FakeCluster
+    :return: module
+    """
+    module = types.ModuleType('pgdb')
+    module.Error = Error
+    module.DatabaseError = DatabaseError
+    module.connect = lambda database=None, host=None, user=None, password=None: FakeConnection(cluster)
+    return module
+
+
+class LocalStorage:
+    """
+    HdfsStorage on a local directory standing in for the root of HDFS. Commands are streamed from/to the files like
+    the native client does.
+    """
+
+    def __init__(self, root, namenode=None, port=None, chunk_size=4 * 1024 * 1024, replication=0):
+        # Imported here, hawqbackup can only be imported once the stand-in pgdb is installed
+        from hawqbackup.lib import stream_cmd
+        self.stream_cmd = stream_cmd
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def __local(self, path):
+        return self.root + path
+
+    def __make_parent(self, path):
+        parent = os.path.dirname(self.__local(path))
+        try:
+            os.makedirs(parent)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def exists(self, path):
+        return os.path.exists(self.__local(path))
+
+    def read(self, path):
+        local_file = open(self.__local(path))
+        try:
+            return local_file.read()
+        finally:
+            local_file.close()
+
+    def read_if_exists(self, path):
+        try:
+            return self.read(path)
+        except IOError:
+            return None
+
+    def list_files(self, path):
+        local = self.__local(path)
+        return [(path + '/' + name, os.path.getsize(local + '/' + name)) for name in os.listdir(local)
+                if os.path.isfile(local + '/' + name)]
+
+    def list_directories(self, path):
+        local = self.__local(path)
+        if not os.path.isdir(local):
+            return []
+        return [path + '/' + name for name in os.listdir(local) if os.path.isdir(local + '/' + name)]
+
+    def rename(self, path, new_path):
+        self.__make_parent(new_path)
+        os.rename(self.__local(path), self.__local(new_path))
+
+    def delete(self, path):
+        local = self.__local(path)
+        if os.path.isdir(local):
+            shutil.rmtree(local)
+        elif os.path.exists(local):
+            os.remove(local)
+
+    def free_space(self):
+        usage = os.statvfs(self.root)
+        return usage.f_bavail * usage.f_frsize, usage.f_blocks * usage.f_frsize
+
+    def write(self, path, content):
+        self.__make_parent(path)
+        local_file = open(self.__local(path) + '.tmp', 'w')
+        try:
+            local_file.write(content)
+        finally:
+            local_file.close()
+        os.rename(self.__local(path) + '.tmp', self.__local(path))
+
+    def upload_from_cmd(self, path, cmd, timeout=None):
+        self.__make_parent(path)
+        local_file = open(self.__local(path), 'w')
+        try:
+            self.stream_cmd(cmd, local_file.write, timeout=timeout, chunk_size=self.chunk_size)
+        finally:
+            local_file.close()
+
+    def download(self, path, local_path):
+        shutil.copyfile(self.__local(path), local_path)
+
+    def download_to_cmd(self, path, cmd, ignore_error=None, stdout_consumer=None, timeout=None):
+        def produce(stdin):
+            local_file = open(self.__local(path))
+            try:
+                chunk = local_file.read(self.chunk_size)
+                while chunk:
+                    stdin.write(chunk)
+                    chunk = local_file.read(self.chunk_size)
+            finally:
+                local_file.close()
+
+        self.stream_cmd(cmd, stdout_consumer, produce, lines=True, timeout=timeout, ignore_error=ignore_error)
+
+
+# Stand-ins of the client tools. The dump is its own table of contents, pg_restore prints it with --list and
+# otherwise swallows it, from a file or from its standard input.
+TOOLS = {
+    'pg_dump': "printf '%s\\n' '; synthetic dump' '1; 2615 2200 SCHEMA - public gpadmin' "
+               "'2; 1259 16386 TABLE public sales gpadmin' '3; 1259 16390 TABLE public customers gpadmin' "
+               "'4; 1259 16395 VIEW public big_sales gpadmin' '5; 1259 16400 INDEX public sales_idx gpadmin' "
+               "'6; 0 0 ACL - public gpadmin'",
+    'pg_dumpall': "printf -- '-- synthetic globals\\n'",
+    'pg_restore': 'for last; do :; done\n'
+                  '[ -f "$last" ] || last=-\n'
+                  'case " $* " in *" --list "*) cat "$last";; *) cat "$last" > /dev/null;; esac',
+    'psql': 'cat > /dev/null',
+    'createdb': 'exit 0'
+}
+
+
+def install_tools(workdir):
+    """
+    Put the stand-ins of the client tools first on PATH and prepare an empty HAWQ installation
+    :param workdir: directory of the benchmark run
+    :return:
+    """
+    bin_dir = workdir + '/bin'
+    gphome = workdir + '/gphome'
+    os.makedirs(bin_dir)
+    os.makedirs(gphome)
+    open(gphome + '/greenplum_path.sh', 'w').close()
+
+    for tool, body in TOOLS.items():
+        path = bin_dir + '/' + tool
+        script = open(path, 'w')
+        try:
+            script.write('#!/bin/sh\n' + body + '\n')
+        finally:
+            script.close()
+        os.chmod(path, stat.S_IRWXU)
+
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['GPHOME'] = gphome
+
+
+def install(cluster, workdir):
+    """
+    Install all the stand-ins in this process: the pgdb module, the client tools and a home directory of its own so
+    the history of the runs does not mix with the real one. Meant for a process of its own, hawqbackup has to be
+    imported again afterwards.
+    :param cluster: FakeCluster
+    :param workdir: directory of the benchmark run
+    :return:
+    """
+    # A forked process inherits the modules of its parent, they would keep the real pgdb
+    for name in sys.modules.keys():
+        if name == 'hawqbackup' or name.startswith('hawqbackup.'):
+            del sys.modules[name]
+    sys.modules['pgdb'] = fake_pgdb(cluster)
+    install_tools(workdir)
+    os.environ['HOME'] = workdir
@@ -1,10 +1,21 @@
 import datetime
+import json
 import logging
 import sys
-from pgdb import DatabaseError
+import threading
+import time
+from pgdb import DatabaseError, Error
 
-from lib import check_executables, error_logger, set_connection, run_cmd, print_progress
-from lib import get_directory, ext_table_sql_generator, confirm
+from lib import check_executables, error_logger, ConnectionPool
+from lib import get_directory, ext_table_sql_generator, confirm, run_parallel, start_background, run_with_retries
+from lib import load_history, save_history, order_by_expected_runtime, estimate_runtimes, simulate_schedule
+from lib import get_manifest_file, get_journal_file, get_table_directory, COMPRESSION_CODECS, DATA_FORMATS
+from lib import get_object_directory, get_object_key, get_lock_file, count_slices, get_work_items
+from storage import HdfsStorage
+from catalog import CatalogSnapshot
+from journal import CheckpointJournal
+from progress import ProgressTracker, format_bytes, format_duration
+from metrics import run_metrics
 
 
 class HdbBackup:
@@ -45,35 +56,77 @@ class HdbBackup:
         self.no_prompt = False
         self.backup_base = "/hawq_backup"
         self.ext_schema_name = 'hawqbackup_schema'
+        self.jobs = 1
+        self.table_timings = {}
+        self.table_stats = {}
+        self.progress = None
+        self.incremental = None
+        self.compress = None
+        self.data_format = 'text'
+        self.storage = None
+        self.pool = None
+        self.resume = None
+        self.journal = None
+        self.manifest_tables = {}
+        self.dedup = False
+        self.objects = {}
+        self.slice_size = None
+        self.plan = False
+        self.table_slices = {}
+        self.slices_done = {}
+        self.slice_columns = {}
+        self.failed_tables = {}
+        self.retries = 2
+        self.retry_delay = 5
+        self.lock = threading.Lock()
+        self.hdfs_namenode = None
+        self.hdfs_port = None
+        self.hdfs_chunk_size = 4 * 1024 * 1024
+        self.hdfs_replication = 0
+        self.command_timeout = None
+        self.metrics_dir = None
+        self.fingerprint_batch_size = 500
 
         # Query Skeleton for backup
         self.drop_schema_skeleton = """ DROP SCHEMA IF EXISTS {0} CASCADE """
         self.create_schema_skeleton = """ CREATE SCHEMA {0} """
         self.create_external_table_skeleton = """ CREATE WRITABLE EXTERNAL TABLE {0}.{1} ( like {2} )
-                                              LOCATION ('pxf://localhost:{3}{4}/{5}/{6}?profile=HdfsTextSimple')
-                                              FORMAT 'TEXT' (DELIMITER = E'\\t') """
+                                              LOCATION ('pxf://localhost:{3}{4}/{5}/{6}?profile={8}{7}')
+                                              {9} """
         self.insert_external_table_skeleton = """ INSERT INTO {0}.{1} SELECT * FROM {2} """
-        self.schema_query_skeleton = """ SELECT COUNT(*) FROM pg_namespace WHERE nspname = '{0}' """
+        self.slice_condition_skeleton = """ WHERE abs(hashtext(COALESCE({0}::text, ''))::bigint) % {1} = {2} """
+        self.slice_column_query_skeleton = """ SELECT a.attrelid, a.attname
+                                               FROM   pg_attribute a
+                                                      LEFT JOIN gp_distribution_policy d
+                                                        ON ( d.localoid = a.attrelid )
+                                               WHERE  a.attrelid IN ( {0} )
+                                               AND    a.attnum > 0 AND NOT a.attisdropped
+                                               AND    a.attnum = COALESCE(d.attrnums[1], a.attnum)
+                                               ORDER BY a.attrelid, a.attnum """
+        self.fingerprint_query_skeleton = """ SELECT '{0}', '{1}:' || COALESCE(SUM(eof), 0) || ':'
+                                                         || COALESCE(SUM(tupcount), 0)
+                                              FROM pg_aoseg.{2} """
 
     def set_backup_id(self):
         """Set the backup ID to be used in this backup. The most common ID format is <year><month><day><hour><minute><seconds>
          For example, 20160101170000 will be the standard for January 1st, 2016 at 5 PM.
         :return: Backup ID
         """
+        # A resumed backup keeps the ID of the interrupted one
+        if self.resume:
+            self.backup_id = self.resume
+            return self.backup_id
+
         self.logger.debug("Generating the backup ID for the backup")
         self.backup_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
         return self.backup_id
 
     def __backup_metadata(self):
         """
-        Backup DDLs and metadata before dumping the data
+        Backup DDLs and metadata, the DDL and the global objects are dumped concurrently
         :return
         """
 
-        # Source the hawq executable path
-        self.logger.info("Source the hawq executable path")
-        run_cmd("source $GPHOME/greenplum_path.sh")
-
         # Backup file name
         ddl_file = self.metadata_backup_dir + '/hdb_dump_' + self.backup_id + '_ddl.dmp'
         global_file = self.metadata_backup_dir + '/hdb_dump_' + self.backup_id + '_global.dmp'
@@ -84,21 +137,26 @@ class HdbBackup:
             "--schema-only",
             "--format=c"
         )
-        pg_dump_cmd = ' '.join(pg_dump_cmd)
-        pg_dump_cmd += ' | hdfs dfs -put - {0}'.format(ddl_file)
-        pg_dump_cmd += ' ; exit $PIPESTATUS;'
         self.logger.info("Executing DDL backup, metadata backup file: \"{0}\"".format(
             ddl_file
         ))
-        run_cmd(pg_dump_cmd)
+        dumps = [(ddl_file, pg_dump_cmd)]
 
         if pg_dumpall_cmd:
-            pg_dumpall_cmd += ' | hdfs dfs -put - {0}'.format(global_file)
-            pg_dumpall_cmd += ' ; exit $PIPESTATUS;'
             self.logger.info("Executing global object backup, global backup file: \"{0}\"".format(
                 global_file
             ))
-            run_cmd(pg_dumpall_cmd)
+            dumps.append((global_file, pg_dumpall_cmd))
+
+        failed_dumps = run_parallel(
+            lambda worker_id, dump: self.storage.upload_from_cmd(dump[0], dump[1], self.command_timeout),
+            dumps,
+            len(dumps)
+        )
+        if failed_dumps:
+            error_logger("Backup of the metadata failed: {0}".format(
+                ', '.join([dump[0] for dump, error in failed_dumps])
+            ))
 
     def __get_args(self, executable, *args):
         """
@@ -107,7 +165,7 @@ class HdbBackup:
         :param:
             executable - type of command
             *args      - other Keyword argument parameters
-        :return: Argument List for pg_dump, pg_dumpall_cmd command
+        :return: Argument List for pg_dump, pg_dumpall_cmd command, both executed without a shell
         """
         args = list(args)
         args.insert(0, executable)
@@ -150,36 +208,33 @@ class HdbBackup:
 
         # If only table backup needed
         if self.table:
-            args.append(
-                    "--table={0}".format(
-                            ' --table='.join(self.table.split(','))
-                    )
+            args.extend(
+                    ["--table={0}".format(name) for name in self.table.split(',')]
             )
 
         # If only schema backup needed
         if self.schema:
-            args.append(
-                    "--schema={0}".format(
-                            ' --schema='.join(self.schema.split(','))
-                    )
+            args.extend(
+                    ["--schema={0}".format(name) for name in self.schema.split(',')]
             )
 
         # If any table needed to be excluded
         if self.exclude_table:
-            args.append(
-                    "--exclude-table={0}".format(
-                            ' --exclude-table='.join(self.exclude_table.split(','))
-                    )
+            args.extend(
+                    ["--exclude-table={0}".format(name) for name in self.exclude_table.split(',')]
             )
 
         # If any schema needed to be excluded
         if self.exclude_schema:
-            args.append(
-                    "--exclude-schema={0}".format(
-                            ' --exclude-schema='.join(self.exclude_schema.split(','))
-                    )
+            args.extend(
+                    ["--exclude-schema={0}".format(name) for name in self.exclude_schema.split(',')]
             )
 
+        # The staging schema of the external tables is created while pg_dump runs, it is never part of the dump
+        args.append(
+                "--exclude-schema={0}".format(self.ext_schema_name)
+        )
+
         # If database name
         if self.dbname:
             args.append(self.dbname)
@@ -188,98 +243,285 @@ class HdbBackup:
 
         # If global dump requested or If this is a full database backup, then get all the global object else ignore
         if self.global_dump or not (self.table or self.schema or self.exclude_table or self.exclude_schema):
-            pg_dumpall_cmd = "pg_dumpall --schema-only --globals-only"
+            pg_dumpall_cmd = ["pg_dumpall", "--schema-only", "--globals-only"]
         else:
             pg_dumpall_cmd = None
 
         return args, pg_dumpall_cmd
 
-    def __fetch_object_info(self):
-        """
-        This method is responsible for fetching all the table names (with schema) from a given database
-        and based on the option passed it dynamically alters its condition..
-        :return: Table data from the database
-        """
-
-        # Main query skeleton
-        query = """SELECT '"'
-                           || nspname
-                           || '"."'
-                           || relname
-                           || '"'
-                    FROM   pg_namespace n
-                           JOIN pg_class c
-                             ON ( n.oid = c.relnamespace )
-                    WHERE  n.nspname NOT IN ( 'pg_catalog', 'information_schema', 'pg_aoseg',
-                                              'pg_bitmapindex',
-                                              'pg_toast', 'gp_toolkit' )
-                    AND c.relkind = 'r' and c.relstorage != 'x'
-                    AND relname not in (SELECT partitiontablename FROM pg_partitions) """
-
-        # If only selected table then add table include condition
-        if self.table:
-            query += """ AND c.oid in ('{0}'""".format(
-                            '\'::regclass,\''.join(self.table.split(','))
-                    ) + """::regclass)"""
+    def __select_tables(self):
+        """
+        This method is responsible for selecting the tables to backup from a snapshot of the catalog, based on the
+        option passed. If the user provided tables / schema then we need to ensure that the user provided list is
+        available in the database, if something is missing then we will error out and ask user to fix the list.
+        Partitioned tables are returned as their leaf partitions, so every partition is a separate unit of work. The
+        table filters apply to the partitioned table.
+        :return: list of Relation
+        """
+        catalog = CatalogSnapshot()
+        catalog.load(self.conn, self.cursor)
 
-        # If omit few table then add table exclude condition
-        if self.exclude_table:
-            query += """ AND c.oid not in ('{0}'""".format(
-                            '\'::regclass,\''.join(self.exclude_table.split(','))
-                    ) + """::regclass)"""
+        tables = self.table and self.table.split(',')
+        schemas = self.schema and self.schema.split(',')
+        exclude_tables = self.exclude_table and self.exclude_table.split(',')
+        exclude_schemas = self.exclude_schema and self.exclude_schema.split(',')
 
-        # If only selected schema then add schema include condition
-        if self.schema:
-            query += """ AND n.nspname in ('{0}'""".format(
-                            '\',\''.join(self.schema.split(','))
-                    ) + """)"""
+        # If user provided a list of tables.
+        if tables:
+            self.logger.debug("Checking if the provided list of table is found on the database..")
+            missing_tables = catalog.missing_tables(tables)
+            if missing_tables:
+                error_logger("One or more tables cannot be found on the database \"{0}\": {1}".format(
+                    self.dbname, ', '.join(missing_tables)
+                ))
 
-        # If omit few schema then add schema exclude condition
-        if self.exclude_schema:
-            query += """ AND n.nspname not in ('{0}'""".format(
-                            '\',\''.join(self.exclude_schema.split(','))
-                    ) + """)"""
+        # If user provided a list of schemas.
+        elif schemas:
+            self.logger.debug("Checking if the provided list of schema is found on the database..")
+            for schema in catalog.missing_schemas(schemas):
+                error_logger("Found no schema \"{0}\" in the database \"{1}\"".format(
+                    schema, self.dbname
+                ))
+
+        if exclude_tables:
+            for table in catalog.missing_tables(exclude_tables):
+                self.logger.warn("Excluded table \"{0}\" cannot be found on the database \"{1}\"".format(
+                    table, self.dbname
+                ))
+
+        selected = catalog.select(tables, schemas, exclude_tables, exclude_schemas)
+        catalog.load_sizes(self.conn, self.cursor, selected)
+        return selected
+
+    def __fetch_fingerprints(self, tables):
+        """
+        Fingerprint the append-only tables from their AO segment catalog: relfilenode, total EOF and tuple count.
+        Any write moves the EOF of the segment files and a truncate or rewrite changes the relfilenode, so an
+        unchanged fingerprint means unchanged data. Heap tables do not get a fingerprint.
+        :param tables: list of Relation
+        :return: {table: fingerprint}
+        """
+        fingerprints = {}
+        ao_tables = [table for table in tables if table.segrel]
+
+        # Query the segment relations in batches instead of one query per table
+        for batch_start in range(0, len(ao_tables), self.fingerprint_batch_size):
+            batch = ao_tables[batch_start:batch_start + self.fingerprint_batch_size]
+            query = ' UNION ALL '.join([
+                self.fingerprint_query_skeleton.format(table.name.replace("'", "''"), table.relfilenode, table.segrel)
+                for table in batch
+            ])
+            try:
+                self.cursor.execute(query)
+            except DatabaseError, e:
+                error_logger(e)
 
+            for table, fingerprint in self.cursor.fetchall():
+                fingerprints[table] = fingerprint
+
+        return fingerprints
+
+    def __fetch_slice_columns(self, tables):
+        """
+        Column the rows of a table are split into slices on: the first distribution column, or the first column of
+        a randomly distributed table. gp_segment_id cannot be used, in HAWQ it is the virtual segment the planner
+        gave to the statement and not a property of the row.
+        :param tables: list of Relation
+        :return: {table: quoted column name}
+        """
+        if not tables:
+            return {}
+
+        names = dict([(table.oid, table.name) for table in tables])
         try:
-            self.cursor.execute(query)
+            self.cursor.execute(self.slice_column_query_skeleton.format(', '.join([str(oid) for oid in sorted(names)])))
         except DatabaseError, e:
             error_logger(e)
 
-        return self.cursor.fetchall()
+        columns = {}
+        for oid, column in self.cursor.fetchall():
+            if names[oid] not in columns:
+                columns[names[oid]] = '"' + column.replace('"', '""') + '"'
+        return columns
+
+    def __read_reference_manifest(self):
+        """
+        Read the tables recorded by the reference backup of an incremental backup
+        :return: {table: manifest entry of the table}
+        """
+        metadata_dir = get_directory(self.backup_base, self.incremental, self.dbname)[0]
+        manifest_file = get_manifest_file(metadata_dir, self.incremental)
+        manifest = self.storage.read_if_exists(manifest_file)
+        if manifest is None:
+            error_logger("Cannot find the manifest \"{0}\" of the reference backup {1}, "
+                         "an incremental backup needs a reference backup that includes data".format(
+                            manifest_file, self.incremental
+            ))
+
+        return json.loads(manifest)['tables']
 
-    def __verify_table_schema(self, tables):
+    def __find_changed_tables(self, tables, fingerprints, reference_tables, sizes, parents):
         """
-        If the user provided tables / schema then we need to ensure that the user provided list is available in
-        the database, if something is missing then we will error out and ask user to fix the list.
-        :param tables: list of tables found on the database.
+        Record the manifest entry of every table. The entry of a table whose fingerprint did not change since the
+        reference backup is the one of the reference backup, it points to the backup holding the data even when
+        that is an earlier backup the reference backup itself points to.
+        :param tables: tables to backup
+        :param fingerprints: {table: fingerprint}
+        :param reference_tables: {table: manifest entry of the reference backup}, empty for a full backup
+        :param sizes: {table: size in bytes}
+        :param parents: {table: parent table or None}
+        :return: tables whose data has to be dumped
+        """
+        changed_tables = []
+        for table in tables:
+            fingerprint = fingerprints.get(table)
+            reference = reference_tables.get(table)
+            if fingerprint and reference and reference['fingerprint'] == fingerprint:
+                # Same data files, and so same statistics, as the backup holding them
+                self.manifest_tables[table] = dict(reference)
+            else:
+                self.manifest_tables[table] = {'backup_id': self.backup_id, 'compression': self.compress,
+                                               'format': self.data_format}
+                changed_tables.append(table)
+            self.manifest_tables[table].update({
+                'fingerprint': fingerprint,
+                'size': sizes[table],
+                'parent': parents[table]
+            })
+        return changed_tables
+
+    def __lock_objects(self):
+        """
+        Hold the marker of this backup on the object store until the manifest records the objects it reuses, a prune
+        skips the collection of the objects meanwhile. The journal is written first so the backup directory exists:
+        a prune cleans up the marker of a backup it deletes.
         :return:
         """
+        self.journal.flush()
+        lock_file = get_lock_file(self.backup_base, self.dbname, 'backup_' + self.backup_id)
+        self.storage.write(lock_file, self.backup_id)
 
-        # If user provided a list of tables.
-        if self.table:
-            self.logger.debug("Checking if the provided list of table is found on the database..")
-            user_tables_list = self.table.split(',')
-            if len(user_tables_list) != len(tables):
-                    error_logger("One or more tables cannot be found on the database \"{0}\","
-                                 " provided total table: {1}, found: {2}".format(
-                            self.dbname, len(user_tables_list), len(tables)
-                    ))
+        prune_lock_file = get_lock_file(self.backup_base, self.dbname, 'prune')
+        if self.storage.exists(prune_lock_file):
+            self.storage.delete(lock_file)
+            error_logger("A prune of the backups of the database \"{0}\" is collecting the unreferenced objects, "
+                         "retry the backup once it is over. If no prune is running, delete \"{1}\"".format(
+                            self.dbname, prune_lock_file
+            ))
 
-        # If user provided a list of schemas.
-        elif self.schema:
-            user_schemas_list = self.schema.split(',')
-            self.logger.debug("Checking if the provided list of schema is found on the database..")
-            for schema in user_schemas_list:
-                schema_query = self.schema_query_skeleton.format(schema)
-                try:
-                    self.cursor.execute(schema_query)
-                except DatabaseError, e:
-                    error_logger(e)
-                result = self.cursor.fetchone()
-                if result[0] == 0L:
-                    error_logger("Found no schema \"{0}\" in the database \"{1}\"".format(
-                        schema, self.dbname
-                    ))
+    def __deduplicate(self, tables):
+        """
+        Send the data of the append-only tables to the object store shared by the backups of the database. The
+        object of a table is keyed by its fingerprint, so a table whose object already exists is not dumped again,
+        its manifest entry references the existing object. Heap tables have no fingerprint and are always dumped
+        into the backup.
+        :param tables: tables left to dump
+        :return: tables that still need to be dumped
+        """
+        objects_dir = get_object_directory(self.backup_base, self.dbname)
+        existing_objects = set([directory.rstrip('/').split('/')[-1]
+                                for directory in self.storage.list_directories(objects_dir)])
+
+        # The statistics of the objects, recorded when they were written
+        index = self.storage.read_if_exists(objects_dir + '/index.json')
+        if index is not None:
+            self.objects = json.loads(index)
+
+        to_dump = []
+        for table in tables:
+            entry = self.manifest_tables[table]
+            if not entry['fingerprint']:
+                to_dump.append(table)
+                continue
+
+            entry['object'] = get_object_key(self.dbname, table, entry['fingerprint'], self.compress)
+            if entry['object'] in existing_objects:
+                entry.update(self.objects.get(entry['object'], {}))
+            else:
+                to_dump.append(table)
+
+        self.logger.info("{0} out of {1} table(s) found in the object store".format(
+            len(tables) - len(to_dump), len(tables)
+        ))
+        return to_dump
+
+    def __prepare_journal(self):
+        """
+        Create the checkpoint journal of this backup, or read back the journal of the interrupted backup to resume
+        :return:
+        """
+        options = {
+            'table': self.table,
+            'schema': self.schema,
+            'exclude_table': self.exclude_table,
+            'exclude_schema': self.exclude_schema,
+            'incremental': self.incremental,
+            'compress': self.compress,
+            'format': self.data_format,
+            'dedup': self.dedup,
+            'schema_only': self.schema_only,
+            'data_only': self.data_only
+        }
+        self.journal = CheckpointJournal(self.storage, get_journal_file(self.metadata_backup_dir, self.backup_id))
+        if not self.resume:
+            self.journal.set_options(options)
+            return
+
+        # A backup that gave up tables can be resumed to dump them again
+        manifest = self.storage.read_if_exists(get_manifest_file(self.metadata_backup_dir, self.backup_id))
+        if manifest is not None and not json.loads(manifest).get('failed'):
+            error_logger("The backup {0} of the database \"{1}\" is already complete, nothing to resume".format(
+                self.backup_id, self.dbname
+            ))
+        if not self.journal.load():
+            error_logger("Cannot find the journal of the backup {0} of the database \"{1}\", it cannot be "
+                         "resumed".format(self.backup_id, self.dbname))
+        if self.journal.options() != options:
+            error_logger("The backup {0} was started with other options, resume it with the same options: {1}".format(
+                self.backup_id, self.journal.options()
+            ))
+
+        self.logger.info("Resuming the backup {0}, {1} table(s) were already dumped".format(
+            self.backup_id, len(self.journal.tables())
+        ))
+
+    def __resume_tables(self, tables):
+        """
+        Skip the tables already dumped by the interrupted backup, their manifest entry is the one recorded when they
+        were dumped, and remove what the interrupted backup wrote for the other ones
+        :param tables: tables to dump
+        :return: tables left to dump
+        """
+        done_tables = self.journal.tables()
+        for table in done_tables:
+            if table in self.manifest_tables:
+                self.manifest_tables[table] = done_tables[table]
+        tables = [table for table in tables if table not in done_tables]
+        if not self.plan:
+            self.__remove_partial_output(tables)
+            for table in tables:
+                if self.manifest_tables[table].get('object'):
+                    self.storage.delete(self.__table_data_directory(table))
+        return tables
+
+    def __remove_partial_output(self, tables):
+        """
+        Remove the data files written by the interrupted backup for tables it did not finish, PXF would otherwise
+        add the files of the new dump next to them. The data directory is listed once instead of checking every
+        table.
+        :param tables: tables left to dump
+        :return:
+        """
+        written = set()
+        for schema_dir in self.storage.list_directories(self.data_backup_dir):
+            for table_dir in self.storage.list_directories(schema_dir):
+                written.add(tuple(table_dir.rstrip('/').split('/')[-2:]))
+
+        for table in tables:
+            table_dir = get_table_directory(self.data_backup_dir, table)
+            if tuple(table_dir.split('/')[-2:]) in written:
+                self.logger.info("Removing the partial data of the table {0}".format(table))
+                self.storage.delete(table_dir)
 
     def print_display_info(self):
         """
@@ -326,10 +568,19 @@ class HdbBackup:
         self.logger.info("Force: {0}".format(self.force))
         self.logger.info("External Table Schema Name: {0}".format(self.ext_schema_name))
         self.logger.info("PXF Port: {0}".format(self.pxf_port))
+        self.logger.info("Parallel Jobs: {0}".format(self.jobs))
+        self.logger.info("Incremental From Backup ID: {0}".format(self.incremental))
+        self.logger.info("Compression Codec: {0}".format(self.compress))
+        self.logger.info("Data Format: {0}".format(self.data_format))
+        self.logger.info("Resume Backup: {0}".format(bool(self.resume)))
+        self.logger.info("Deduplicate Table Data: {0}".format(self.dedup))
+        self.logger.info("Slice Size: {0}".format(self.slice_size))
+        self.logger.info("Plan Only: {0}".format(self.plan))
+        self.logger.info("Retries Per Table: {0}".format(self.retries))
         self.logger.info("*******************************************************************************************")
 
-        # Ask for confirmation
-        if not self.no_prompt:
+        # Ask for confirmation, a plan does not change anything
+        if not self.no_prompt and not self.plan:
             choice = confirm("Is the above backup parameters correct and do you wish to continue")
             if choice.startswith('n') or choice.startswith('N'):
                 self.logger.info("Aborting due to user request....")
@@ -344,19 +595,48 @@ class HdbBackup:
         drop_schema = self.drop_schema_skeleton.format(self.ext_schema_name)
         create_schema = self.create_schema_skeleton.format(self.ext_schema_name)
 
-        # In case the previous hawqbackup schema was not cleaned up and user supplied force then drop it
-        if self.force:
+        # In case the previous hawqbackup schema was not cleaned up and user supplied force then drop it, an
+        # interrupted backup being resumed left it behind. A plan leaves the database untouched.
+        if (self.force or self.resume) and not self.plan:
             self.logger.debug("Attempting to drop the schema \"{0}\"".format(
                 self.ext_schema_name
             ))
             self.cursor.execute(drop_schema)
             self.conn.commit()
 
-        # Fetch all the tables in the database.
-        tables = self.__fetch_object_info()
+        # Select the tables to backup from a snapshot of the catalog, and verify the tables/schema provided.
+        tables = self.__select_tables()
+
+        # Schedule the tables expected to take longer first, using their size and the timings of previous backups
+        history = load_history()
+        sizes = dict([(table.name, table.size) for table in tables])
+        relations = dict([(table.name, table) for table in tables])
+        parents = dict([(table.name, table.parent) for table in tables])
+        timings = history.get(self.dbname, {}).get('backup', {})
+        fingerprints = self.__fetch_fingerprints(tables)
+        tables = order_by_expected_runtime(sizes.keys(), sizes, timings)
 
-        # Verify if the tables/schema provided matches the user provided.
-        self.__verify_table_schema(tables)
+        # An incremental backup only dumps the tables whose fingerprint changed since the reference backup, the
+        # manifest of the unchanged ones points to the backup holding their data
+        reference_tables = {}
+        if self.incremental:
+            reference_tables = self.__read_reference_manifest()
+
+        changed_tables = self.__find_changed_tables(tables, fingerprints, reference_tables, sizes, parents)
+
+        if self.incremental:
+            self.logger.info("{0} out of {1} table(s) changed since the backup {2}".format(
+                len(changed_tables), len(tables), self.incremental
+            ))
+        tables = changed_tables
+
+        if self.dedup:
+            if not self.plan:
+                self.__lock_objects()
+            tables = self.__deduplicate(tables)
+
+        if self.resume:
+            tables = self.__resume_tables(tables)
 
         # Total tables to backup
         total_tables = len(tables)
@@ -364,8 +644,22 @@ class HdbBackup:
             total_tables
         ))
 
-        # Ignore the client message ( like Notice ) on the psql prompt
-        self.cursor.execute("set client_min_messages = 'ERROR' ")
+        # Split the biggest tables into slices dumped concurrently by different workers, a table gets one slice per
+        # slice size, up to one slice per job. Slices of the same table come one after the other, as the tables are
+        # already ordered by expected runtime.
+        for table in tables:
+            self.table_slices[table] = count_slices(sizes[table], self.slice_size, self.jobs)
+        work_items = get_work_items(tables, self.table_slices)
+
+        if self.plan:
+            self.__print_plan(tables, work_items, sizes, timings)
+            self.pool.release((self.conn, self.cursor))
+            self.pool.close()
+            return
+
+        # Every slice selects its rows on a hash of a column of the table, all the slices scan the whole table
+        self.slice_columns = self.__fetch_slice_columns([relations[table] for table in tables
+                                                         if self.table_slices[table] > 1])
 
         # Create the schema
         try:
@@ -380,58 +674,306 @@ class HdbBackup:
                             self.ext_schema_name, self.dbname
             ))
 
-        # Loop through the table list to backup the data.
-        for table in tables:
-            position_dump = tables.index(table) + 1
-            print_progress(
-                    position_dump,
-                    total_tables,
-                    prefix='Dumping Table Data (current/total):',
-                    suffix='Done',
-                    bar_length=50
-            )
-            create, insert = ext_table_sql_generator(
-                self.create_external_table_skeleton,
-                self.insert_external_table_skeleton,
-                table[0],
-                self.ext_schema_name,
-                self.pxf_port,
-                self.data_backup_dir
-            )
-            try:
-                self.cursor.execute(create)
-                self.cursor.execute(insert)
-                self.conn.commit()
-            except DatabaseError, e:
-                error_logger(e)
+        # Workers borrow their connections from the pool, the main connection goes back to it meanwhile
+        self.pool.release((self.conn, self.cursor))
+
+        # Dump the tables, a table failing after all its retries is given up without stopping the other ones
+        self.progress = ProgressTracker('Dumping Table Data (current/total):',
+                                        dict([(table, sizes[table]) for table in tables]))
+        failed_slices = run_parallel(
+            lambda worker_id, item: self.__dump_table(item[0], item[1], sizes[item[0]]),
+            work_items,
+            self.jobs
+        )
+        self.progress.finish()
+
+        # The tables given up are left out of the backup, with what their other slices wrote
+        for (table, slice_index), error in failed_slices:
+            self.failed_tables.setdefault(table, str(error))
+        for table in self.failed_tables:
+            self.logger.error("Failed to backup the table {0}: {1}".format(table, self.failed_tables[table]))
+            run_metrics.record_table(table, error=self.failed_tables[table])
+            data_dir = self.__table_data_directory(table)
+            if not self.manifest_tables[table].get('object'):
+                data_dir = get_table_directory(data_dir, table)
+            self.storage.delete(data_dir)
+        self.journal.flush()
+        if self.dedup:
+            self.storage.write(get_object_directory(self.backup_base, self.dbname) + '/index.json',
+                               json.dumps(self.objects))
+        self.logger.info("Dumped {0} table(s), {1} rows, {2}".format(
+            self.progress.completed_tables, self.progress.rows, self.progress.summary()
+        ))
 
         # Drop the schema once done
         try:
+            self.conn, self.cursor = self.pool.acquire()
             self.logger.debug("Backup is done, drop the schema \"{0}\"".format(
                 self.ext_schema_name
             ))
             self.cursor.execute(drop_schema)
             self.conn.commit()
-            self.conn.close()
-        except DatabaseError, e:
+            self.pool.release((self.conn, self.cursor))
+            self.pool.close()
+        except Error, e:
             error_logger(e)
 
+        # Remember how long every table took, future backups use it to schedule the tables
+        timings.update(self.table_timings)
+        history.setdefault(self.dbname, {})['backup'] = timings
+        save_history(history)
+
+    def __write_manifest(self):
+        """
+        Record the tables of this backup with their statistics, restores and incremental backups rely on it. The
+        manifest marks the backup as complete, it is written once the metadata is dumped as well.
+        :return:
+        """
+        manifest_tables = self.manifest_tables
+        for table in self.table_stats:
+            manifest_tables[table].update(self.table_stats[table])
+        for table in self.failed_tables:
+            del manifest_tables[table]
+
+        manifest = {
+            'backup_id': self.backup_id,
+            'database': self.dbname,
+            'reference_backup_id': self.incremental,
+            'compression': self.compress,
+            'format': self.data_format,
+            'options': {
+                'table': self.table,
+                'schema': self.schema,
+                'exclude_table': self.exclude_table,
+                'exclude_schema': self.exclude_schema,
+                'incremental': self.incremental,
+                'compress': self.compress,
+                'format': self.data_format,
+                'dedup': self.dedup,
+                'slice_size': self.slice_size,
+                'jobs': self.jobs,
+                'pxf_port': self.pxf_port
+            },
+            'tables': manifest_tables,
+            'failed': self.failed_tables
+        }
+        self.storage.write(get_manifest_file(self.metadata_backup_dir, self.backup_id), json.dumps(manifest))
+
+    def __print_plan(self, tables, work_items, sizes, timings):
+        """
+        Print what the backup would dump: the size of every table, its expected duration from the throughput of
+        previous backups, the expected duration of the whole run with the chosen number of jobs, and whether HDFS has
+        enough space left. The catalog size of a table stands for the size of its data files.
+        :param tables: tables to dump, longest expected runtime first
+        :param work_items: list of (table, slice index) handed out to the workers
+        :param sizes: {table: size in bytes}
+        :param timings: {table: [seconds, bytes]} recorded by previous backups
+        :return:
+        """
+        runtimes = estimate_runtimes(tables, sizes, timings)
+        total_bytes = sum([sizes[table] for table in tables])
+
+        self.logger.info("*******************************************************************************************")
+        for table in tables:
+            duration = 'unknown'
+            if runtimes[table] is not None:
+                duration = format_duration(runtimes[table])
+            self.logger.info("{0}: {1}, {2}, {3} slice(s)".format(
+                table, format_bytes(sizes[table]), duration, self.table_slices[table]
+            ))
+
+        self.logger.info("Tables To Dump: {0}".format(len(tables)))
+        self.logger.info("Estimated Data Size: {0}".format(format_bytes(total_bytes)))
+        if tables and runtimes[tables[0]] is None:
+            self.logger.info("Estimated Duration: unknown, no previous backup of the database \"{0}\" to learn the "
+                             "throughput from".format(self.dbname))
+        else:
+            # The slices of a table share its runtime
+            item_runtimes = [runtimes[table] / self.table_slices[table] for table, slice_index in work_items]
+            self.logger.info("Estimated Duration With {0} Job(s): {1}".format(
+                self.jobs, format_duration(simulate_schedule(item_runtimes, self.jobs))
+            ))
+
+        # PXF writes the data files with the replication of the cluster, assumed to be the one given for the metadata
+        # files or else the HDFS default
+        replication = self.hdfs_replication or 3
+        remaining, capacity = self.storage.free_space()
+        self.logger.info("HDFS Space Needed: {0} with a replication of {1}, {2} left out of {3}".format(
+            format_bytes(total_bytes * replication), replication, format_bytes(remaining), format_bytes(capacity)
+        ))
+        self.logger.info("*******************************************************************************************")
+        if total_bytes * replication > remaining:
+            self.logger.warning("The backup does not fit in the space left on HDFS")
+
+    def __table_data_directory(self, table):
+        """
+        Data directory a table is dumped into. An object is written under a temporary name and renamed once
+        complete, a failed dump never leaves an object that later backups would reuse
+        :param table: table name
+        :return: HDFS path
+        """
+        key = self.manifest_tables[table].get('object')
+        if key:
+            return get_object_directory(self.backup_base, self.dbname, key) + '.' + self.backup_id + '.tmp'
+        return self.data_backup_dir
+
+    def __dump_table(self, table, slice_index, size):
+        """
+        Dump the data of one table, or of one slice of a table, through its writable external table, on a connection
+        borrowed from the pool. The table is recorded once all its slices are dumped.
+        :param table: table name (i.e in the format schema-name.table-name)
+        :param slice_index: slice to dump, None to dump the whole table
+        :param size: size of the table in bytes
+        :return:
+        """
+        slices = self.table_slices[table]
+
+        # Let PXF compress the data files while writing them
+        location_options = ''
+        if self.compress:
+            location_options = '&COMPRESSION_CODEC=' + COMPRESSION_CODECS[self.compress]
+
+        data_dir = self.__table_data_directory(table)
+        create, insert = ext_table_sql_generator(
+            self.create_external_table_skeleton,
+            self.insert_external_table_skeleton,
+            table,
+            self.ext_schema_name,
+            self.pxf_port,
+            data_dir,
+            location_options,
+            slice_index,
+            DATA_FORMATS[self.data_format]['profile'],
+            DATA_FORMATS[self.data_format]['export']
+        )
+        if slice_index is not None:
+            insert += self.slice_condition_skeleton.format(self.slice_columns[table], slices, slice_index)
+
+        def dump():
+            # A failed statement is rolled back when the connection goes back to the pool, with the external table
+            start = time.time()
+            with self.pool.connection() as (conn, cursor):
+                cursor.execute(create)
+                create_done = time.time()
+                cursor.execute(insert)
+                rows = cursor.rowcount
+                insert_done = time.time()
+                conn.commit()
+            return rows, create_done - start, insert_done - create_done, time.time() - insert_done
+
+        # The files PXF wrote before the failure are not rolled back, a retry starts from an empty directory
+        slice_done = run_with_retries(
+            dump,
+            self.retries,
+            self.retry_delay,
+            lambda: self.storage.delete(get_table_directory(data_dir, table, slice_index)),
+            'Backup of the table {0}'.format(table)
+        )
+
+        # Wait for the last slice of the table
+        self.lock.acquire()
+        try:
+            done = self.slices_done.setdefault(table, [])
+            done.append(slice_done)
+            if len(done) < slices:
+                return
+        finally:
+            self.lock.release()
+
+        # The time spent on all the slices, which is the time of the table when it is not split
+        duration = sum([create + insert + commit for slice_rows, create, insert, commit in done])
+        self.table_timings[table] = [duration, size]
+        run_metrics.record_table(table, create=sum([slice_done[1] for slice_done in done]),
+                                 insert=sum([slice_done[2] for slice_done in done]),
+                                 commit=sum([slice_done[3] for slice_done in done]))
+
+        key = self.manifest_tables[table].get('object')
+        if key:
+            object_dir = get_object_directory(self.backup_base, self.dbname, key)
+            if self.storage.exists(object_dir):
+                # Another backup wrote the same object meanwhile
+                self.storage.delete(data_dir)
+            else:
+                self.storage.rename(data_dir, object_dir)
+            data_dir = object_dir
+
+        # The statistics of the data files written, recorded in the manifest
+        rows = None
+        if min([slice_done[0] for slice_done in done]) >= 0:
+            rows = sum([slice_done[0] for slice_done in done])
+        if slices == 1:
+            files = self.storage.list_files(get_table_directory(data_dir, table))
+        else:
+            files = []
+            for slice_index in range(slices):
+                files.extend(self.storage.list_files(get_table_directory(data_dir, table, slice_index)))
+        self.table_stats[table] = {
+            'rows': rows,
+            'bytes': sum([file_size for file_path, file_size in files]),
+            'files': [file_path for file_path, file_size in files],
+            'slices': slices,
+            'duration': duration
+        }
+        if key:
+            self.objects[key] = self.table_stats[table]
+        self.journal.table_done(table, dict(self.manifest_tables[table], **self.table_stats[table]))
+        self.progress.table_done(table, rows, self.table_stats[table]['bytes'])
+        run_metrics.record_table(table, rows=rows, bytes=self.table_stats[table]['bytes'])
+
     def run_backup(self):
         """
-        Run the actual backup
+        Run the actual backup, and export the metrics of the run if requested, even if the backup failed
+        :return
+        """
+        run_metrics.set_labels(command='backup', database=self.dbname)
+        status = 'failed'
+        try:
+            self.__run_backup()
+            status = 'success'
+        finally:
+            if self.metrics_dir:
+                run_metrics.set_labels(backup_id=self.backup_id)
+                run_metrics.write(self.metrics_dir, status)
+
+    def __connect_storage(self):
+        """
+        Prepare the access to HDFS
+        :return
+        """
+        self.storage = HdfsStorage(self.hdfs_namenode, self.hdfs_port, self.hdfs_chunk_size, self.hdfs_replication)
+
+    def __run_backup(self):
+        """
+        Run the backup steps
         :return
         """
 
         # Start time
         self.logger.info("Starting Backup at: {0}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
 
-        # Check for all executable and environment before running backup commands
-        self.logger.info("Checking for all the executables that is needed by the program")
-        check_executables()
+        with run_metrics.phase('preflight'):
+            # The executables, the database and HDFS are checked concurrently, each of them mostly waits
+            self.logger.info("Checking for all the executables that is needed by the program")
+            wait_executables = start_background(check_executables, 'hdb-executables')
 
-        # Prepare and check connection to the database.
-        self.logger.info("Checking the database connectivity")
-        self.conn, self.cursor = set_connection(self.dbname, self.host, self.port, self.username, self.password)
+            # Prepare the access to HDFS
+            self.logger.info("Checking the HDFS connectivity")
+            wait_storage = start_background(self.__connect_storage, 'hdb-storage')
+
+            # Prepare and check connection to the database.
+            self.logger.info("Checking the database connectivity")
+            # The main connection is the first one of the pool shared with the workers
+            self.pool = ConnectionPool(self.dbname, self.host, self.port, self.username, self.password, self.jobs,
+                                       ["set client_min_messages = 'ERROR'"])
+            try:
+                self.conn, self.cursor = self.pool.acquire()
+            except Error, e:
+                error_logger(e)
+
+            for wait in (wait_executables, wait_storage):
+                error = wait()
+                if error is not None:
+                    error_logger(error)
 
         # Set backup id
         self.logger.info("Setting up the database backup ID for this backup")
@@ -440,19 +982,45 @@ class HdbBackup:
         # Prepare the folder and get location where the backup will be stored.
         self.logger.info("Preparing all the directories where the backup will be stored")
         self.metadata_backup_dir, self.data_backup_dir = get_directory(self.backup_base, self.backup_id, self.dbname)
+        self.__prepare_journal()
 
         # Display the backup information
         self.print_display_info()
 
-        # Unless explicitly requested not to dump metadata, backup the metadata of objects
-        if not self.data_only:
+        # Unless explicitly requested not to dump metadata, backup the metadata of objects. It is dumped in the
+        # background while the data is exported, both mostly wait on other processes.
+        wait_metadata = None
+        if not self.data_only and not self.plan and not self.journal.is_step_done('metadata'):
             self.logger.info("Backing up the DDL")
-            self.__backup_metadata()
+            wait_metadata = start_background(self.__run_metadata_phase, 'hdb-metadata')
 
         # Unless explicitly requested not to dump data, dump the data of the objects.
         if not self.schema_only:
             self.logger.info("Backing up the data")
-            self.__backup_data()
+            with run_metrics.phase('data'):
+                self.__backup_data()
+
+        if wait_metadata:
+            error = wait_metadata()
+            if error is not None:
+                error_logger("Backup of the DDL of the database \"{0}\" failed: {1}".format(self.dbname, error))
+
+        if self.plan:
+            self.logger.info("Plan finished at: {0}, nothing was backed up".format(
+                datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ))
+            return
+
+        if not self.schema_only:
+            self.__write_manifest()
+            if self.dedup:
+                self.storage.delete(get_lock_file(self.backup_base, self.dbname, 'backup_' + self.backup_id))
+
+        if self.failed_tables:
+            error_logger("Backup of {0} table(s) failed on the database \"{1}\", they are recorded as failed in the "
+                         "manifest. Resume the backup {2} to dump them again".format(
+                            len(self.failed_tables), self.dbname, self.backup_id
+            ))
 
         # End completion message & time
         self.logger.info("Backup of the database \"{0}\" and of the backup type \"{1}\" has completed".format(
@@ -460,6 +1028,11 @@ class HdbBackup:
         ))
         self.logger.info("Backup finished at: {0}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
 
+    def __run_metadata_phase(self):
+        with run_metrics.phase('metadata'):
+            self.__backup_metadata()
+        self.journal.step_done('metadata')
+
     def set_vars(self, options_obj):
         self.dbname = options_obj.database
         self.username = options_obj.username
@@ -473,5 +1046,24 @@ class HdbBackup:
         self.exclude_schema = options_obj.exclude_schema
         self.exclude_table = options_obj.exclude_table
         self.force = options_obj.force
+        self.no_prompt = options_obj.yes
         self.global_dump = options_obj.include_roles
+        self.jobs = options_obj.jobs
+        self.compress = options_obj.compress
+        self.data_format = options_obj.data_format
+        self.hdfs_namenode = options_obj.hdfs_namenode
+        self.hdfs_port = options_obj.hdfs_port
+        self.hdfs_chunk_size = options_obj.hdfs_chunk_size
+        self.hdfs_replication = options_obj.hdfs_replication
+        self.command_timeout = options_obj.command_timeout
+        self.metrics_dir = options_obj.metrics_dir
+        self.dedup = options_obj.dedup
+        self.slice_size = options_obj.slice_size
+        self.plan = options_obj.plan
+        self.retries = options_obj.retries
+        self.retry_delay = options_obj.retry_delay
+        if options_obj.incremental:
+            self.incremental = str(options_obj.incremental)
+        if options_obj.resume:
+            self.resume = str(options_obj.resume)
 
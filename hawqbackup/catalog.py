@@ -0,0 +1,270 @@
+import logging
+
+from pgdb import DatabaseError
+
+from lib import error_logger
+
+
+def split_name(name):
+    """
+    Split a schema qualified name following the SQL identifier rules: unquoted parts are folded to lower case, quoted
+    parts are kept as they are and may contain dots
+    :param name: name like schema.table or "Schema"."ta.ble"
+    :return: (schema, relation), schema is None if the name is not schema qualified
+    """
+    parts = []
+    current = ''
+    quoted = False
+    position = 0
+    while position < len(name):
+        char = name[position]
+        if char == '"' and quoted and name[position + 1:position + 2] == '"':
+            current += '"'
+            position += 1
+        elif char == '"':
+            quoted = not quoted
+        elif char == '.' and not quoted:
+            parts.append(current)
+            current = ''
+        elif quoted:
+            current += char
+        elif not char.isspace():
+            current += char.lower()
+        position += 1
+    parts.append(current)
+
+    if len(parts) == 1:
+        return None, parts[0]
+    return parts[-2], parts[-1]
+
+
+def quote_name(schema, relation):
+    """
+    Build the quoted name used all along the backup (i.e in the format "schema-name"."table-name")
+    :param schema: schema name
+    :param relation: relation name
+    :return: quoted name
+    """
+    return '"' + schema + '"."' + relation + '"'
+
+
+class Relation:
+    """
+    A table of the catalog snapshot
+    """
+
+    def __init__(self, oid, schema, relname, storage, size, segrel, relfilenode, root_oid, is_parent):
+        self.oid = oid
+        self.schema = schema
+        self.relname = relname
+        self.name = quote_name(schema, relname)
+        self.storage = storage
+        self.size = size or 0
+        self.segrel = segrel
+        self.relfilenode = relfilenode
+        self.root_oid = root_oid
+        self.is_parent = is_parent
+        self.parent = None
+
+
+class CatalogSnapshot:
+    """
+    Snapshot of the namespaces and tables of a database read in two queries. The relations are streamed through a
+    server side cursor and indexed in memory, so selecting and validating the tables to backup never goes back to
+    the database, whatever the number of relations or of names given by the user.
+    """
+
+    logger = logging.getLogger("hdb_logger")
+
+    def __init__(self, fetch_size=10000, size_batch_size=500):
+        """
+        Create a CatalogSnapshot object..
+        :param fetch_size: rows fetched from the server side cursor at once
+        :param size_batch_size: relations whose size is read by one query
+        """
+        self.fetch_size = fetch_size
+        self.size_batch_size = size_batch_size
+        self.namespaces = set()
+        self.relations = {}
+        self.by_oid = {}
+        self.unlinked = []
+
+        self.namespace_query = """ SELECT nspname FROM pg_namespace """
+        self.relation_query = """SELECT c.oid,
+                                        n.nspname,
+                                        c.relname,
+                                        c.relstorage,
+                                        0,
+                                        seg.relname,
+                                        c.relfilenode,
+                                        leaf.parrelid,
+                                        parent.inhparent IS NOT NULL
+                                 FROM   pg_namespace n
+                                        JOIN pg_class c
+                                          ON ( n.oid = c.relnamespace )
+                                        LEFT JOIN pg_appendonly a
+                                          ON ( a.relid = c.oid )
+                                        LEFT JOIN pg_class seg
+                                          ON ( seg.oid = a.segrelid )
+                                        LEFT JOIN ( SELECT pr.parchildrelid, p.parrelid
+                                                    FROM   pg_partition_rule pr
+                                                           JOIN pg_partition p
+                                                             ON ( p.oid = pr.paroid ) ) leaf
+                                          ON ( leaf.parchildrelid = c.oid )
+                                        LEFT JOIN ( SELECT DISTINCT i.inhparent
+                                                    FROM   pg_inherits i
+                                                           JOIN pg_partition_rule pr
+                                                             ON ( pr.parchildrelid = i.inhrelid ) ) parent
+                                          ON ( parent.inhparent = c.oid )
+                                 WHERE  n.nspname NOT IN ( 'pg_catalog', 'information_schema', 'pg_aoseg',
+                                                           'pg_bitmapindex',
+                                                           'pg_toast', 'gp_toolkit' )
+                                 AND c.relkind = 'r' AND c.relstorage != 'x' """
+
+        # The size of every relation would cost a stat of its files on the master, sizes are only read for the
+        # selected tables. The size of an append-only table is the EOF of its segment files, as recorded by its
+        # segment relation.
+        self.ao_size_query_skeleton = """ SELECT {0}, COALESCE(SUM(eof), 0) FROM pg_aoseg.{1} """
+        self.heap_size_query_skeleton = """ SELECT oid, pg_relation_size(oid) FROM pg_class WHERE oid IN ( {0} ) """
+
+    def load(self, conn, cursor):
+        """
+        Read the snapshot from the database
+        :param conn: connection to the database
+        :param cursor: cursor of the connection
+        :return:
+        """
+        self.logger.debug("Reading the catalog snapshot")
+        try:
+            cursor.execute(self.namespace_query)
+            self.namespaces = set([row[0] for row in cursor.fetchall()])
+
+            cursor.execute("DECLARE hdb_catalog NO SCROLL CURSOR FOR " + self.relation_query)
+            while True:
+                cursor.execute("FETCH {0} FROM hdb_catalog".format(self.fetch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                self.index_rows(rows)
+            cursor.execute("CLOSE hdb_catalog")
+            conn.commit()
+        except DatabaseError, e:
+            error_logger(e)
+
+        self.logger.debug("Catalog snapshot has {0} relations in {1} namespaces".format(
+            len(self.relations), len(self.namespaces)
+        ))
+
+    def load_sizes(self, conn, cursor, relations):
+        """
+        Read the size of some relations of the snapshot, in batches
+        :param conn: connection to the database
+        :param cursor: cursor of the connection
+        :param relations: list of Relation, their size is set
+        :return:
+        """
+        queries = []
+        ao_relations = [relation for relation in relations if relation.segrel]
+        for batch_start in range(0, len(ao_relations), self.size_batch_size):
+            queries.append(' UNION ALL '.join([
+                self.ao_size_query_skeleton.format(relation.oid, relation.segrel)
+                for relation in ao_relations[batch_start:batch_start + self.size_batch_size]
+            ]))
+        heap_oids = [str(relation.oid) for relation in relations if not relation.segrel]
+        for batch_start in range(0, len(heap_oids), self.size_batch_size):
+            queries.append(self.heap_size_query_skeleton.format(
+                ', '.join(heap_oids[batch_start:batch_start + self.size_batch_size])
+            ))
+
+        try:
+            for query in queries:
+                cursor.execute(query)
+                for oid, size in cursor.fetchall():
+                    self.by_oid[oid].size = long(size or 0)
+            conn.commit()
+        except DatabaseError, e:
+            error_logger(e)
+
+    def index_rows(self, rows):
+        """
+        Add relation rows, as returned by the relation query, to the in-memory indexes
+        :param rows: list of rows
+        :return:
+        """
+        for row in rows:
+            relation = Relation(*row)
+            self.relations[relation.name] = relation
+            self.by_oid[relation.oid] = relation
+            if relation.root_oid is not None:
+                self.unlinked.append(relation)
+
+        # Partitions point to their partitioned table, which can come in a later batch
+        unlinked = []
+        for relation in self.unlinked:
+            if relation.root_oid in self.by_oid:
+                relation.parent = self.by_oid[relation.root_oid].name
+            else:
+                unlinked.append(relation)
+        self.unlinked = unlinked
+
+    def lookup(self, name):
+        """
+        Find a relation from a name given by the user
+        :param name: schema qualified name, quoted or not. Unqualified names are looked up in public
+        :return: Relation or None
+        """
+        schema, relname = split_name(name)
+        return self.relations.get(quote_name(schema or 'public', relname))
+
+    def missing_tables(self, names):
+        """
+        Names given by the user that are not tables of the database
+        :param names: list of names
+        :return: list of the names not found
+        """
+        return [name for name in names if self.lookup(name) is None]
+
+    def missing_schemas(self, names):
+        """
+        Schemas given by the user that do not exist in the database
+        :param names: list of schema names
+        :return: list of the schemas not found
+        """
+        return [name for name in names if name not in self.namespaces]
+
+    def select(self, tables=None, schemas=None, exclude_tables=None, exclude_schemas=None):
+        """
+        Units of work of a backup. Partitioned tables are replaced by their leaf partitions, the filters on tables
+        apply to the partitioned table or to a leaf partition named on its own.
+        :param tables: only these tables
+        :param schemas: only the tables in these schemas
+        :param exclude_tables: skip these tables
+        :param exclude_schemas: skip the tables in these schemas
+        :return: list of Relation
+        """
+        def oids(names):
+            return set([relation.oid for relation in [self.lookup(name) for name in names] if relation])
+
+        table_oids = tables and oids(tables)
+        excluded_oids = oids(exclude_tables or [])
+        schemas = schemas and set(schemas)
+        excluded_schemas = set(exclude_schemas or [])
+
+        selected = []
+        for relation in self.relations.values():
+            # Partitioned tables and intermediate levels hold no data, their leaves do
+            if relation.is_parent:
+                continue
+
+            table_oid = relation.root_oid or relation.oid
+            if table_oids and table_oid not in table_oids and relation.oid not in table_oids:
+                continue
+            if table_oid in excluded_oids or relation.oid in excluded_oids:
+                continue
+            if schemas and relation.schema not in schemas:
+                continue
+            if relation.schema in excluded_schemas:
+                continue
+            selected.append(relation)
+
+        return selected
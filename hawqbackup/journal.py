@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+
+class CheckpointJournal:
+    """
+    Journal of the tables finished by a run, stored in HDFS with the backup so an interrupted run can resume where it
+    stopped. It is written every few seconds rather than after every table: a table finished after the last write is
+    simply done again on resume.
+    """
+
+    logger = logging.getLogger("hdb_logger")
+
+    def __init__(self, storage, path, interval=30):
+        """
+        Create a CheckpointJournal object..
+        :param storage: HdfsStorage holding the journal
+        :param path: HDFS path of the journal
+        :param interval: minimum seconds between two writes of the journal
+        """
+        self.storage = storage
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_write = 0
+        self.dirty = False
+        self.content = {'options': {}, 'steps': [], 'tables': {}}
+
+    def load(self):
+        """
+        Read the journal of a previous run
+        :return: True if the journal exists
+        """
+        content = self.storage.read_if_exists(self.path)
+        if content is None:
+            return False
+
+        self.content = json.loads(content)
+        self.logger.debug("Journal \"{0}\" has {1} finished table(s)".format(self.path, len(self.content['tables'])))
+        return True
+
+    def set_options(self, options):
+        """
+        Options of the run, a resumed run must use the same ones
+        :param options: dictionary of options
+        :return:
+        """
+        self.content['options'] = options
+        self.dirty = True
+
+    def options(self):
+        return self.content['options']
+
+    def step_done(self, step):
+        """
+        Record a finished step of the run (i.e metadata) and write the journal
+        :param step: name of the step
+        :return:
+        """
+        self.lock.acquire()
+        try:
+            self.content['steps'].append(step)
+            self.dirty = True
+        finally:
+            self.lock.release()
+        self.flush()
+
+    def is_step_done(self, step):
+        return step in self.content['steps']
+
+    def table_done(self, table, entry):
+        """
+        Record a finished table, the journal is written if the last write is old enough
+        :param table: table name
+        :param entry: what the run needs to know about the table when resuming (i.e its manifest entry)
+        :return:
+        """
+        self.lock.acquire()
+        try:
+            self.content['tables'][table] = entry
+            self.dirty = True
+        finally:
+            self.lock.release()
+
+        if time.time() - self.last_write >= self.interval:
+            self.flush()
+
+    def table_started(self, table):
+        """
+        Record a table whose rows may be committed before the table is recorded as finished. It is written at once,
+        as a small file of its own so the journal is not rewritten for every table.
+        :param table: table name
+        :return:
+        """
+        self.storage.write(self.__started_directory() + '/' + hashlib.sha1(table).hexdigest(), table)
+
+    def started_tables(self, tables):
+        """
+        Tables recorded as started by the previous runs
+        :param tables: table names to look for
+        :return: list of the tables recorded as started
+        """
+        directory = self.__started_directory()
+        if not self.storage.exists(directory):
+            return []
+        started = set([path.rstrip('/').split('/')[-1] for path, size in self.storage.list_files(directory)])
+        return [table for table in tables if hashlib.sha1(table).hexdigest() in started]
+
+    def clear_started(self):
+        """
+        Forget the tables recorded as started by the previous runs
+        :return:
+        """
+        self.storage.delete(self.__started_directory())
+
+    def __started_directory(self):
+        return self.path.rsplit('.', 1)[0] + '_started'
+
+    def tables(self):
+        """
+        Tables finished by the previous runs
+        :return: {table: entry}
+        """
+        return self.content['tables']
+
+    def flush(self):
+        """
+        Write the journal if something changed since the last write
+        :return:
+        """
+        self.lock.acquire()
+        try:
+            if not self.dirty:
+                return
+            content = json.dumps(self.content)
+            self.dirty = False
+            self.last_write = time.time()
+
+            # Writes are serialized so an older content never replaces a newer one
+            self.storage.write(self.path, content)
+        finally:
+            self.lock.release()
@@ -1,17 +1,75 @@
-import sys, os, subprocess, logging
-from pgdb import connect, DatabaseError
+import sys, os, re, math, fcntl, subprocess, logging, threading, Queue, json, collections, time, hashlib, pipes
+from contextlib import contextmanager
+from pgdb import connect, Error
+
+from metrics import timed
 
 logger = logging.getLogger("hdb_logger")
 
+# Hadoop codecs PXF can use to compress the data files, the files get the codec extension (.gz, .snappy, .bz2)
+# and readable external tables decompress them transparently
+COMPRESSION_CODECS = {
+    'gzip': 'org.apache.hadoop.io.compress.GzipCodec',
+    'snappy': 'org.apache.hadoop.io.compress.SnappyCodec',
+    'bzip2': 'org.apache.hadoop.io.compress.BZip2Codec'
+}
+
+# PXF profile and FORMAT clauses of the writable (export) and readable (import) external tables of every data
+# format. The PXF of HDB 2.x only writes through the HdfsTextSimple and SequenceWritable profiles, the Parquet and
+# Avro profiles are read only, so the data files are written as text.
+DATA_FORMATS = {
+    'text': {
+        'profile': 'HdfsTextSimple',
+        'export': "FORMAT 'TEXT' (DELIMITER = E'\\t')",
+        'import': "FORMAT 'TEXT' (DELIMITER = E'\\t')"
+    }
+}
+
+# Lines of standard error kept to report why a command failed
+STDERR_TAIL_LINES = 100
+
+# Per table durations of previous runs, used to schedule the longest tables first
+HISTORY_FILE = os.path.expanduser('~') + '/hawq_backup_history.json'
+
+# Executables the backups and restores run
+EXECUTABLES = ['pg_dump', 'pg_dumpall', 'pg_restore', 'psql']
+
+# Longest identifier in bytes, longer identifiers are silently truncated by the database (NAMEDATALEN - 1)
+MAX_IDENTIFIER_LENGTH = 63
+
+# Environment and executable paths of the commands, resolved once per process
+_resolved = {}
+
+# Serializes the start of the commands, see start_process
+_popen_lock = threading.Lock()
+
+
+def find_executable(name):
+    """
+    Look up an executable on the PATH of the commands, without starting a shell. The result is cached.
+    :param name: name of the executable
+    :return: absolute path of the executable, None if it is not found
+    """
+    key = 'executable:' + name
+    if key not in _resolved:
+        path = None
+        for directory in get_env().get('PATH', os.defpath).split(os.pathsep):
+            candidate = os.path.join(directory or os.curdir, name)
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                path = os.path.abspath(candidate)
+                break
+        _resolved[key] = path
+    return _resolved[key]
+
 
 def check_executables():
     """
     Check if the necessary executables are available on PATH
     """
-    run_cmd("which pg_dump")
-    run_cmd("which pg_dumpall")
-    run_cmd("which pg_restore")
-    run_cmd("which psql")
+    missing = [name for name in EXECUTABLES if find_executable(name) is None]
+    if missing:
+        error_logger("The executables {0} were not found on PATH, source the hawq environment path file and try "
+                     "again".format(', '.join(missing)))
 
 
 def error_logger(error):
@@ -26,35 +84,160 @@ def error_logger(error):
     sys.exit(2)
 
 
-def set_connection(dbname, host, port, username, password):
-    """Set a new connection object for this backup
-    :param:
-        dbname      - Database name
-        host        - Hostname
-        port        - Port number
-        username    - Username
-        password    - Password
-    :return:
-        Conn   - Connection to the database
-        Cursor - Cursor to execute the query
+class ConnectionPool:
+    """
+    Database connections shared by the workers of a run. Connections are opened on demand up to the size of the
+    pool and get the session settings once, when opened. A connection idle for a while is checked before being
+    handed out again and replaced if it is broken, so a worker never starts a table on a dead connection.
     """
 
-    logger.debug("Attempting to create a connection to the database")
-    logger.debug("Parameters :- Database name: {0}, hostname: {1}, port: {2}, user: {3}".format(
-            dbname, host, port, username
-    ))
-    try:
+    def __init__(self, dbname, host, port, username, password, size=1, settings=None, check_after=30):
+        """
+        Create a ConnectionPool object..
+        :param dbname: Database name
+        :param host: Hostname
+        :param port: Port number
+        :param username: Username
+        :param password: Password
+        :param size: maximum number of connections opened at the same time
+        :param settings: statements run once on every new connection (i.e set client_min_messages)
+        :param check_after: seconds of idleness after which a connection is checked before being reused
+        """
+        self.dbname = dbname
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.settings = settings or []
+        self.check_after = check_after
+        self.condition = threading.Condition()
+        self.idle = []
+        self.opened = 0
+        self.closed = False
+
+    def __connect(self):
+        logger.debug("Opening a new pooled connection to the database \"{0}\"".format(self.dbname))
         conn = connect(
-                database=dbname,
-                host=host + ':' + str(port),
-                user=username,
-                password=password
+                database=self.dbname,
+                host=self.host + ':' + str(self.port),
+                user=self.username,
+                password=self.password
         )
         cursor = conn.cursor()
-    except DatabaseError, e:
-        error_logger(e)
+        for setting in self.settings:
+            cursor.execute(setting)
+        conn.commit()
+        return conn, cursor
+
+    def __is_alive(self, conn, cursor):
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            conn.rollback()
+            return True
+        except Error:
+            return False
+
+    def __close(self, conn):
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def __free_slot(self):
+        self.condition.acquire()
+        try:
+            self.opened -= 1
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def acquire(self):
+        """
+        Borrow a connection, waiting for one to be released if the pool is full
+        :return: (connection, cursor)
+        """
+        self.condition.acquire()
+        try:
+            while not self.idle and self.opened >= self.size:
+                self.condition.wait()
+            if self.idle:
+                conn, cursor, released_at = self.idle.pop()
+            else:
+                conn, cursor, released_at = None, None, None
+                self.opened += 1
+        finally:
+            self.condition.release()
+
+        if conn is not None:
+            if time.time() - released_at < self.check_after or self.__is_alive(conn, cursor):
+                return conn, cursor
+
+            # The new connection takes the slot of the broken one
+            logger.warn("Lost a connection to the database \"{0}\", reconnecting".format(self.dbname))
+            self.__close(conn)
+
+        try:
+            return self.__connect()
+        except Error:
+            self.__free_slot()
+            raise
+
+    def release(self, connection):
+        """
+        Give a connection back to the pool. Any transaction left open is rolled back, a connection that cannot
+        even rollback is closed.
+        :param connection: (connection, cursor) returned by acquire
+        :return:
+        """
+        conn, cursor = connection
+        try:
+            conn.rollback()
+        except Error:
+            self.__close(conn)
+            self.__free_slot()
+            return
 
-    return conn, cursor
+        self.condition.acquire()
+        try:
+            if not self.closed:
+                self.idle.append((conn, cursor, time.time()))
+                self.condition.notify()
+                return
+        finally:
+            self.condition.release()
+
+        self.__close(conn)
+        self.__free_slot()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with block
+        :return: (connection, cursor)
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        """
+        Close the idle connections, borrowed connections are closed when released
+        :return:
+        """
+        self.condition.acquire()
+        try:
+            idle, self.idle = self.idle, []
+            self.closed = True
+        finally:
+            self.condition.release()
+
+        for conn, cursor, released_at in idle:
+            self.__close(conn)
+            self.__free_slot()
 
 
 def get_directory(base_directory, backup_id, dbname):
@@ -73,22 +256,190 @@ def get_directory(base_directory, backup_id, dbname):
     return metadata_backup_dir, data_backup_dir
 
 
-def ext_table_sql_generator(create_ext, insert_ext, table, ext_schema, pxf_port, data_dir):
+def get_manifest_file(metadata_backup_dir, backup_id):
+    """
+    Location of the manifest listing the tables of a backup
+    :param metadata_backup_dir: metadata directory of the backup, as returned by get_directory
+    :param backup_id: backup ID
+    :return: HDFS path of the manifest
+    """
+    return metadata_backup_dir + '/hdb_dump_' + str(backup_id) + '_manifest.json'
+
+
+def get_journal_file(metadata_backup_dir, backup_id):
+    """
+    Location of the checkpoint journal of a backup, listing the tables already dumped
+    :param metadata_backup_dir: metadata directory of the backup, as returned by get_directory
+    :param backup_id: backup ID
+    :return: HDFS path of the journal
+    """
+    return metadata_backup_dir + '/hdb_dump_' + str(backup_id) + '_journal.json'
+
+
+def get_restore_journal_file(metadata_backup_dir, backup_id, dbname):
+    """
+    Location of the journal of the restore of a backup into a database, listing the tables already loaded
+    :param metadata_backup_dir: metadata directory of the backup, as returned by get_directory
+    :param backup_id: backup ID
+    :param dbname: target database of the restore
+    :return: HDFS path of the journal
+    """
+    return metadata_backup_dir + '/hdb_restore_' + str(backup_id) + '_' + dbname + '_journal.json'
+
+
+def get_object_directory(base_directory, dbname, key=None):
+    """
+    Location of the object store shared by the backups of a database, or of one object in it. An object holds the
+    data files of a table in the usual schema/relation layout, so it is used as the data directory of the table.
+    :param base_directory: base directory of the backups
+    :param dbname: database name
+    :param key: object key, as returned by get_object_key
+    :return: HDFS path of the object store or of the object
+    """
+    objects_dir = base_directory + '/objects/' + dbname
+    if key is None:
+        return objects_dir
+    return objects_dir + '/' + key
+
+
+def get_lock_file(base_directory, dbname, owner):
+    """
+    Location of the marker a run holds on the object store of a database while it relies on objects that no manifest
+    or journal records yet. Backups and prunes write their marker and then look for the marker of the other, so at
+    least one of two concurrent runs sees the other.
+    :param base_directory: base directory of the backups
+    :param dbname: database name
+    :param owner: run holding the marker (i.e prune or backup_<backup ID>)
+    :return: HDFS path of the marker
+    """
+    return get_object_directory(base_directory, dbname) + '/' + owner + '.lock'
+
+
+def get_object_key(dbname, table, fingerprint, compression):
+    """
+    Key of the object holding the data of a table. Equal keys mean the same data files written in the same way, so
+    the backups can share them.
+    :param dbname: database name
+    :param table: table name
+    :param fingerprint: fingerprint of the table data (see HdbBackup.__fetch_fingerprints)
+    :param compression: compression codec of the data files, None if not compressed
+    :return: hexadecimal key
+    """
+    return hashlib.sha1('\n'.join([dbname, table, fingerprint, compression or ''])).hexdigest()
+
+
+def get_table_data_directory(base_directory, dbname, entry):
+    """
+    Data directory holding the data files of a table of a backup, which can be an earlier backup (incremental
+    backups) or the object store (deduplicated backups)
+    :param base_directory: base directory of the backups
+    :param dbname: database name
+    :param entry: manifest entry of the table
+    :return: HDFS path of the data directory
+    """
+    if entry.get('object'):
+        return get_object_directory(base_directory, dbname, entry['object'])
+    return get_directory(base_directory, entry['backup_id'], dbname)[1]
+
+
+def count_slices(size, slice_size, jobs):
+    """
+    Number of slices a table is dumped in: one slice per slice size, up to one slice per job
+    :param size: size of the table in bytes
+    :param slice_size: size of a slice in bytes, None to never split the tables
+    :param jobs: number of jobs of the backup
+    :return: number of slices
+    """
+    if not slice_size or jobs < 2:
+        return 1
+    return max(1, min(int(math.ceil(size / float(slice_size))), jobs))
+
+
+def get_work_items(tables, table_slices):
+    """
+    Items handed out to the workers, the slices of a table come one after the other
+    :param tables: tables in the order they are processed
+    :param table_slices: {table: number of slices}, a table not in it is not split
+    :return: list of (table, slice index), the slice index is None for a table not split
+    """
+    work_items = []
+    for table in tables:
+        slices = table_slices.get(table, 1)
+        if slices == 1:
+            work_items.append((table, None))
+        else:
+            work_items.extend([(table, slice_index) for slice_index in range(slices)])
+    return work_items
+
+
+def get_table_directory(data_dir, table, slice_index=None):
+    """
+    Directory where the external table of a table reads or writes its data files
+    :param data_dir: Data directory location
+    :param table: table name (i.e in the format schema-name.table-name)
+    :param slice_index: slice of the table, for tables split into several slices
+    :return: HDFS path of the table directory
+    """
+    schema = (table.split('.')[0]).replace('"', '')
+    relation = (table.split('.')[1]).replace('"', '')
+    if slice_index is not None:
+        relation += '/slice_' + str(slice_index)
+    return data_dir + '/' + schema + '/' + relation
+
+
+def get_external_table_name(table, slice_index=None):
+    """
+    Name of the external table of a table, or of one of its slices. A name too long for an identifier is cut and
+    completed by a hash of the table name, the database would otherwise cut the slice suffix and give every slice
+    the same external table.
+    :param table: table name (i.e in the format schema-name.table-name)
+    :param slice_index: slice of the table, None for the whole table
+    :return: unquoted name
+    """
+    schema = (table.split('.')[0]).replace('"', '')
+    relation = (table.split('.')[1]).replace('"', '')
+    name = schema + '_' + relation
+    suffix = ''
+    if slice_index is not None:
+        suffix = '_slice_' + str(slice_index)
+
+    encoded, encoded_table = name, table
+    if isinstance(name, unicode):
+        encoded, encoded_table = name.encode('utf-8'), table.encode('utf-8')
+    if len(encoded) + len(suffix) <= MAX_IDENTIFIER_LENGTH:
+        return name + suffix
+
+    digest = '_' + hashlib.sha1(encoded_table).hexdigest()[:8]
+    # Cut on a character boundary, the name stays valid UTF-8
+    prefix = encoded[:MAX_IDENTIFIER_LENGTH - len(digest) - len(suffix)].decode('utf-8', 'ignore')
+    if not isinstance(name, unicode):
+        prefix = prefix.encode('utf-8')
+    return prefix + digest + suffix
+
+
+def ext_table_sql_generator(create_ext, insert_ext, table, ext_schema, pxf_port, data_dir, location_options='',
+                            slice_index=None, profile='HdfsTextSimple', format_clause=''):
     """
     This method is responsible for creating all the external tables used to dump the data from the internal tables
     :param:
-        create_ext  - Skeleton for create external table
-        insert_ext  - Skeleton for Insert
-        table       - table name (i.e in the format schema-name.table-name)
-        ext_schema  - Schema name where the external table will be created.
-        pxf_port    - pxf port number
-        data_dir    - Data directory location
+        create_ext       - Skeleton for create external table
+        insert_ext       - Skeleton for Insert
+        table            - table name (i.e in the format schema-name.table-name)
+        ext_schema       - Schema name where the external table will be created.
+        pxf_port         - pxf port number
+        data_dir         - Data directory location
+        location_options - Extra PXF options appended to the location (i.e &COMPRESSION_CODEC=...)
+        slice_index      - Slice of the table, every slice gets its own external table and sub directory
+        profile          - PXF profile of the external table
+        format_clause    - FORMAT clause of the external table
     :return: Create External Table SQL Query , Insert SQL Query
     """
     # Split the object into schema and relation name
     schema = (table.split('.')[0]).replace('"', '')
     relation = (table.split('.')[1]).replace('"', '')
-    ext_tab_name = '"' + schema + '_' + relation + '"'
+    ext_tab_name = '"' + get_external_table_name(table, slice_index) + '"'
+    if slice_index is not None:
+        relation += '/slice_' + str(slice_index)
 
     # Built the create external table query
     create_external_table_query = create_ext.format(
@@ -98,7 +449,10 @@ def ext_table_sql_generator(create_ext, insert_ext, table, ext_schema, pxf_port,
             pxf_port,
             data_dir,
             schema.replace('"', ''),
-            relation.replace('"', '')
+            relation.replace('"', ''),
+            location_options,
+            profile,
+            format_clause
     )
 
     # Built insert into external table query
@@ -113,9 +467,13 @@ def ext_table_sql_generator(create_ext, insert_ext, table, ext_schema, pxf_port,
 
 def get_env():
     """
-    Get the OS environment parameters
+    Get the OS environment parameters. They are prepared on the first call and shared by all the commands of the
+    run, the returned dictionary must not be modified.
     :return: OS Environment
     """
+    if 'env' in _resolved:
+        return _resolved['env']
+
     logger.debug("Get the OS environment variables")
 
     # Get the OS environment
@@ -128,60 +486,596 @@ def get_env():
     if 'GPHOME' not in env:
         error_logger("The path doesnt have GPHOME, source the hawq environment path file and try again")
 
+    _resolved['env'] = env
     return env
 
 
-def run_cmd(cmd, ignore_error=None, popen_kwargs=None):
+def command_line(cmd):
     """
-    Run the command thrown at it by opening a shell and if encountered any error
-    exit by displaying the command that failed.
-    :param cmd: command to be executed
-    :param ignore_error: Ignore any error if found
-    :param popen_kwargs: And additional shell varaibles
-    :return: Output of the command
+    Shell form of a command, to log it or to use it in a pipeline
+    :param cmd: command line, or list of the program and its arguments
+    :return: command line
+    """
+    if isinstance(cmd, basestring):
+        return cmd
+    return ' '.join([pipes.quote(arg) for arg in cmd])
+
+
+def start_process(cmd, **kwargs):
+    """
+    Start a command, from any thread. Nothing runs in the child before the command: a hook between fork and exec is
+    not safe while other threads hold locks. The pipes of the command are made non inheritable before another
+    command can be started, or that command would keep them open (i.e the reader of a pipe would never see the end
+    of its input while an unrelated command runs).
+    :param cmd: command line run by a shell, or list of the program and its arguments executed directly
+    :param kwargs: arguments of subprocess.Popen
+    :return: subprocess.Popen object
     """
+    _popen_lock.acquire()
+    try:
+        process = subprocess.Popen(cmd, shell=isinstance(cmd, basestring), env=get_env(), **kwargs)
+        for stream in (process.stdin, process.stdout, process.stderr):
+            if stream is not None:
+                flags = fcntl.fcntl(stream.fileno(), fcntl.F_GETFD)
+                fcntl.fcntl(stream.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    finally:
+        _popen_lock.release()
+    return process
 
+
+@timed('subprocess')
+def stream_cmd(cmd, stdout_consumer=None, stdin_producer=None, lines=False, timeout=None, ignore_error=None,
+               chunk_size=64 * 1024, pipe_to=None):
+    """
+    Run the command thrown at it, streaming its output to a consumer so the output is never held in memory. The
+    exit code decides if the command failed, output on standard error is only logged as debug and the last lines of
+    it are reported if the command fails.
+    :param cmd: command to be executed, a command line is run by a shell while a list of the program and its
+                arguments is executed directly
+    :param stdout_consumer: callable receiving the standard output chunk by chunk (or line by line), if not
+                            provided the output is discarded
+    :param stdin_producer: callable receiving the standard input of the command as a file object to write into,
+                           it is closed once the producer returns
+    :param lines: pass the standard output line by line instead of in chunks of chunk_size bytes
+    :param timeout: seconds after which the command is killed and considered failed, only the shell is killed for
+                    a command line
+    :param ignore_error: Ignore any error if found
+    :param chunk_size: size of the chunks read from standard output
+    :param pipe_to: command receiving the standard output of cmd, the consumer then gets the output of this
+                    command. Both commands run without a shell and the pipeline fails if any of them fails.
+    :return: exit code of the command, the first non zero exit code of a pipeline
+    """
+    cmds = [cmd]
+    if pipe_to is not None:
+        cmds.append(pipe_to)
+    cmd_line = ' | '.join([command_line(command) for command in cmds])
     logger.debug("Attempting to run the command: \"{0}\"".format(
-            cmd
+            cmd_line
     ))
-    # Get the environment
-    env = get_env()
 
-    # Execute the commands
-    pipe = subprocess.Popen(cmd, shell=True, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = pipe.communicate()
+    processes = []
+    try:
+        for command in cmds:
+            stdin = subprocess.PIPE
+            if processes:
+                stdin = processes[-1].stdout
+            processes.append(start_process(command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE))
+            if stdin is not subprocess.PIPE:
+                # Only the next command reads the output, so the previous one fails to write if the next one exits
+                stdin.close()
+    except OSError, e:
+        # Without a shell, a missing program fails here instead of exiting with 127
+        for process in processes:
+            process.kill()
+            process.wait()
+        err = "The command \"{0}\" could not be started: {1}\n".format(cmd_line, e)
+        return report_command_failure(cmd_line, err, ignore_error, 127)
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+    state = {'timed_out': False, 'producer_error': None}
+
+    def read_stderr(process):
+        for line in iter(process.stderr.readline, ''):
+            stderr_tail.append(line)
+            logger.debug(line.rstrip())
+
+    def write_stdin():
+        try:
+            try:
+                if stdin_producer:
+                    stdin_producer(processes[0].stdin)
+            except IOError, e:
+                # The command exited before reading its whole input, its exit code tells what happened
+                logger.debug("Stopped writing to the command \"{0}\": {1}".format(cmd_line, e))
+            except Exception, e:
+                state['producer_error'] = e
+        finally:
+            try:
+                processes[0].stdin.close()
+            except IOError:
+                pass
+
+    def kill():
+        state['timed_out'] = True
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    helpers = [threading.Thread(target=read_stderr, args=(process,)) for process in processes]
+    helpers.append(threading.Thread(target=write_stdin))
+    for helper in helpers:
+        helper.daemon = True
+        helper.start()
+
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    output = processes[-1].stdout
+    try:
+        if lines:
+            for line in iter(output.readline, ''):
+                if stdout_consumer:
+                    stdout_consumer(line)
+        else:
+            chunk = output.read(chunk_size)
+            while chunk:
+                if stdout_consumer:
+                    stdout_consumer(chunk)
+                chunk = output.read(chunk_size)
+    except:
+        kill()
+        raise
+    finally:
+        for process in processes:
+            process.wait()
+        if timer:
+            timer.cancel()
+        for helper in helpers:
+            helper.join()
+
+    returncode = ([process.returncode for process in processes if process.returncode != 0] or [0])[0]
 
     # if the command execution fail, throw error
-    if ignore_error and err:
-        logger.warn("Found exception in running the command \"{0}\"".format(cmd))
+    if state['timed_out']:
+        err = "The command \"{0}\" did not finish in {1} seconds\n".format(cmd_line, timeout)
+    elif state['producer_error'] is not None:
+        err = "Could not send the input of the command \"{0}\": {1}\n".format(cmd_line, state['producer_error'])
+    elif returncode != 0:
+        err = "The command \"{0}\" failed with exit code {1}\n".format(cmd_line, returncode)
+    else:
+        return returncode
+
+    return report_command_failure(cmd_line, err + ''.join(stderr_tail), ignore_error, returncode)
+
+
+def report_command_failure(cmd_line, err, ignore_error, returncode):
+    """
+    Report a failed command, exit unless the error is ignored
+    :param cmd_line: command line of the command
+    :param err: error message
+    :param ignore_error: Ignore any error if found
+    :param returncode: exit code of the command
+    :return: exit code of the command
+    """
+    if ignore_error:
+        logger.warn("Found exception in running the command \"{0}\"".format(cmd_line))
         logger.error(err)
-        logger.warn("skipping due to ignore option...".format(cmd))
-    elif pipe.returncode > 0 or err:
+        logger.warn("skipping due to ignore option...")
+    else:
         error_logger(err)
 
-    return out
+    return returncode
+
+
+def run_cmd(cmd, ignore_error=None, popen_kwargs=None, input_data=None, timeout=None):
+    """
+    Run the command thrown at it (see stream_cmd) and if encountered any error
+    exit by displaying the command that failed. The whole output is kept in memory, use stream_cmd for commands
+    with a large output.
+    :param cmd: command to be executed
+    :param ignore_error: Ignore any error if found
+    :param popen_kwargs: And additional shell varaibles
+    :param input_data: Data sent to the standard input of the command
+    :param timeout: seconds after which the command is killed and considered failed
+    :return: Output of the command
+    """
+    output = []
+    stdin_producer = None
+    if input_data is not None:
+        stdin_producer = lambda stdin: stdin.write(input_data)
+
+    stream_cmd(cmd, output.append, stdin_producer, timeout=timeout, ignore_error=ignore_error)
+
+    return ''.join(output)
+
+
+def run_parallel(func, items, jobs, stop_on_error=False):
+    """
+    Run func over all the items using a pool of worker threads. Errors raised by func are collected instead of
+    aborting the whole run, so the caller can report them and cleanup before exiting. That includes error_logger,
+    whose exit would otherwise only end the worker thread.
+    :param func: callable receiving (worker_id, item), worker_id goes from 0 to jobs - 1 and identifies the
+                 resources (i.e. database connection) owned by the worker running the item
+    :param items: list of items to process
+    :param jobs: maximum number of workers running at the same time
+    :param stop_on_error: if True, stop handing out new items after the first failure
+    :return: list of (item, error) for every item that failed
+    """
+    work_queue = Queue.Queue()
+    for item in items:
+        work_queue.put(item)
+
+    lock = threading.Lock()
+    state = {'stop': False}
+    errors = []
+
+    def worker(worker_id):
+        while not state['stop']:
+            try:
+                item = work_queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            error = None
+            try:
+                func(worker_id, item)
+            except Exception, e:
+                error = e
+            except SystemExit:
+                error = RuntimeError("aborted, see the error logged above")
 
+            if error is not None:
+                lock.acquire()
+                try:
+                    errors.append((item, error))
+                    state['stop'] = stop_on_error
+                finally:
+                    lock.release()
 
-def print_progress(iteration, total, prefix='', suffix='', decimals=1, bar_length=100):
+    threads = []
+    for worker_id in range(min(jobs, len(items))):
+        thread = threading.Thread(target=worker, args=(worker_id,), name='hdb-worker-' + str(worker_id))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    return errors
+
+
+def run_with_retries(func, retries, delay, cleanup=None, description='The operation'):
+    """
+    Run func, and run it again after a transient failure (database, HDFS or external command error) with an
+    exponential backoff: delay seconds before the first retry, then twice as long before every next one
+    :param func: callable without arguments
+    :param retries: number of times func is run again after failing
+    :param delay: seconds to wait before the first retry
+    :param cleanup: callable run before every retry to remove what the failed attempt left behind
+    :param description: what func does, for the logs
+    :return: what func returns, the error of the last attempt is raised if all of them failed
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except (Error, EnvironmentError, SystemExit), e:
+            # error_logger exits when an external command (i.e hdfs dfs) fails
+            if attempt >= retries:
+                raise
+            wait = delay * 2 ** attempt
+            attempt += 1
+            logger.warn("{0} failed, retry {1} of {2} in {3} seconds: {4}".format(
+                description, attempt, retries, wait, isinstance(e, SystemExit) and 'see the error above' or e
+            ))
+
+        time.sleep(wait)
+        if cleanup:
+            cleanup()
+
+
+def start_background(func, name):
+    """
+    Run func in a background thread, an error raised by func (or error_logger called by func) is kept for the caller
+    :param func: callable without arguments
+    :param name: name of the thread
+    :return: callable waiting for func to finish, it returns the error of func or None if func succeeded
+    """
+    errors = []
+
+    def run():
+        try:
+            func()
+        except Exception, e:
+            errors.append(e)
+        except SystemExit:
+            errors.append(RuntimeError("aborted, see the error logged above"))
+
+    thread = threading.Thread(target=run, name=name)
+    thread.daemon = True
+    thread.start()
+
+    def wait():
+        thread.join()
+        return errors and errors[0] or None
+
+    return wait
+
+
+def load_history(history_file=HISTORY_FILE):
     """
-    Call in a loop to create terminal progress bar
-    :param iteration: - Required  : current iteration (Int)
-    :param total: - Required  : total iterations (Int)
-    :param prefix: - Optional  : prefix string (Str)
-    :param suffix: - Optional  : suffix string (Str)
-    :param decimals: - Optional  : positive number of decimals in percent complete (Int)
-    :param bar_length: - Optional  : character length of bar (Int)
+    Load the per table timings recorded by previous backups and restores
+    :param history_file: location of the history file
+    :return: {database: {operation: {table: [seconds, bytes]}}}, empty if there is no usable history
+    """
+    if not os.path.exists(history_file):
+        return {}
+
+    try:
+        history_fd = open(history_file)
+        try:
+            return json.load(history_fd)
+        finally:
+            history_fd.close()
+    except (IOError, ValueError), e:
+        logger.warn("Ignoring unreadable history file \"{0}\": {1}".format(history_file, e))
+        return {}
+
+
+def save_history(history, history_file=HISTORY_FILE):
+    """
+    Save the per table timings, the file is replaced atomically so a concurrent run never reads half a file
+    :param history: history as returned by load_history
+    :param history_file: location of the history file
     :return:
     """
-    format_str = "{0:." + str(decimals) + "f}"
-    percents = format_str.format(100 * (iteration / float(total)))
-    filled_length = int(round(bar_length * iteration / float(total)))
-    bar = '#' * filled_length + '-' * (bar_length - filled_length)
-    sys.stdout.write('\r%s (%s/%s) |%s| %s%s %s' % (prefix, iteration, total, bar, percents, '%', suffix)),
-    sys.stdout.flush()
-    if iteration == total:
-        sys.stdout.write('\n')
-        sys.stdout.flush()
+    tmp_file = history_file + '.' + str(os.getpid())
+    try:
+        history_fd = open(tmp_file, 'w')
+        try:
+            json.dump(history, history_fd)
+        finally:
+            history_fd.close()
+        os.rename(tmp_file, history_file)
+    except (IOError, OSError), e:
+        logger.warn("Could not save the history file \"{0}\": {1}".format(history_file, e))
+
+
+def get_throughput(timings):
+    """
+    Throughput observed on previous runs, used to turn the size of tables without history into seconds
+    :param timings: {table: [seconds, bytes]} recorded on previous runs
+    :return: bytes per second, None without usable history
+    """
+    total_seconds = sum([float(timing[0]) for timing in timings.values()])
+    total_bytes = sum([timing[1] for timing in timings.values()])
+    if total_seconds > 0 and total_bytes > 0:
+        return total_bytes / total_seconds
+    return None
+
+
+def estimate_runtimes(tables, sizes, timings):
+    """
+    Expected runtime of every table, the time recorded on a previous run or its size at the observed throughput
+    :param tables: list of table names
+    :param sizes: {table: size in bytes}, tables without a known size count as zero bytes
+    :param timings: {table: [seconds, bytes]} recorded on previous runs
+    :return: {table: seconds}, None for the tables that cannot be estimated without history
+    """
+    throughput = get_throughput(timings)
+    runtimes = {}
+    for table in tables:
+        if table in timings:
+            runtimes[table] = float(timings[table][0])
+        elif throughput:
+            runtimes[table] = sizes.get(table, 0) / throughput
+        else:
+            runtimes[table] = None
+    return runtimes
+
+
+def order_by_expected_runtime(tables, sizes, timings):
+    """
+    Order the tables so the ones expected to take longer run first. When the work is spread across several workers,
+    the run then finishes close to the longest table instead of being extended by a big table picked last.
+    :param tables: list of table names
+    :param sizes: {table: size in bytes}, tables without a known size count as zero bytes
+    :param timings: {table: [seconds, bytes]} recorded on previous runs
+    :return: list of table names, longest expected runtime first
+    """
+    runtimes = estimate_runtimes(tables, sizes, timings)
+
+    def expected_runtime(table):
+        if runtimes[table] is None:
+            return float(sizes.get(table, 0))
+        return runtimes[table]
+
+    return sorted(tables, key=expected_runtime, reverse=True)
+
+
+def simulate_schedule(runtimes, jobs):
+    """
+    Wall clock time of running work items in order on a pool of workers, every item going to the first worker free
+    like run_parallel does
+    :param runtimes: list of seconds of every item, in the order they are handed out
+    :param jobs: number of workers
+    :return: seconds until the last worker is done
+    """
+    workers = [0.0] * max(1, min(jobs, len(runtimes)))
+    for runtime in runtimes:
+        first_free = workers.index(min(workers))
+        workers[first_free] += runtime
+    return max(workers)
+
+
+# Stages of a DDL restore. The tables only depend on the objects tables can use (schemas, types, domains,
+# functions, sequences), they are all created first whatever their position in the dump: pg_dump sorts the sequences
+# with the tables by name, so a sequence used by a default can be listed after the first table. The objects that use
+# tables (views, separate defaults and whatever the dump records as depending on a table) are created serially once
+# the tables exist, then the indexes and constraints, which only depend on tables. Within the parallel stages the
+# objects that depend on each other (i.e an INHERITS child and its parent) are kept in the same list, in the order of
+# the dump.
+DDL_STAGES = [
+    ('pre-data', False),
+    ('tables', True),
+    ('after-tables', False),
+    ('indexes', True),
+    ('post-data', False)
+]
+DDL_PARALLEL_TYPES = {'TABLE': 'tables', 'INDEX': 'indexes', 'CONSTRAINT': 'indexes'}
+DDL_AFTER_TABLES_TYPES = ['VIEW', 'DEFAULT', 'SEQUENCE OWNED BY']
+DDL_POST_DATA_TYPES = ['FK CONSTRAINT', 'TRIGGER', 'RULE', 'ACL', 'DEFAULT ACL', 'COMMENT']
+
+
+def read_toc_entry(line):
+    """
+    Object type of a line of the table of contents of a dump, as printed by "pg_restore --list"
+    (i.e "2345; 1259 16386 TABLE public sales gpadmin")
+    :param line: line of the table of contents
+    :return: object type, None for comments and blank lines
+    """
+    fields = line.split()
+    if not fields or line.startswith(';') or len(fields) < 4:
+        return None
+    if ' '.join(fields[3:6]) == 'SEQUENCE OWNED BY':
+        return 'SEQUENCE OWNED BY'
+    if ' '.join(fields[3:5]) in ('TABLE DATA', 'FK CONSTRAINT', 'DEFAULT ACL', 'SEQUENCE SET'):
+        return ' '.join(fields[3:5])
+    return fields[3]
+
+
+def get_toc_id(line):
+    """
+    Dump ID of a line of the table of contents of a dump
+    :param line: line of the table of contents
+    :return: dump ID
+    """
+    return line.split(';')[0].strip()
+
+
+def read_toc_dependencies(toc_lines):
+    """
+    Dependencies between the entries of a table of contents, printed by the clients that support it after every
+    entry with "pg_restore --list --verbose" (i.e "; depends on: 12 34")
+    :param toc_lines: lines of the table of contents
+    :return: {dump ID: list of the dump IDs it depends on}, empty if the client does not print them
+    """
+    dependencies = {}
+    entry_id = None
+    for line in toc_lines:
+        if read_toc_entry(line) is not None:
+            entry_id = get_toc_id(line)
+        elif entry_id is not None and line.lstrip(';').strip().startswith('depends on:'):
+            dependencies[entry_id] = line.split(':', 1)[1].split()
+    return dependencies
+
+
+def read_inheritance_dependencies(toc_lines, ddl_lines):
+    """
+    Dependencies between the tables of a table of contents from the INHERITS clauses of their DDL, for the clients
+    that do not print the dependencies of the dump
+    :param toc_lines: lines of the table of contents
+    :param ddl_lines: DDL of the tables, as printed by pg_restore
+    :return: {dump ID of a table: list of the dump IDs of its parents}
+    """
+    table_ids = {}
+    for line in toc_lines:
+        if read_toc_entry(line) == 'TABLE':
+            fields = line.split()
+            table_ids[(fields[4], ' '.join(fields[5:-1]))] = get_toc_id(line)
+
+    dependencies = {}
+    table = None
+    for line in ddl_lines:
+        match = re.match(r'-- Name: (.+?); Type: (.+?); Schema: (.+?);', line)
+        if match:
+            table = match.group(2) == 'TABLE' and (match.group(3), match.group(1)) or None
+            continue
+        match = re.match(r'INHERITS \(([^)]+)\)', line.strip())
+        if not match or table not in table_ids:
+            continue
+        for parent in match.group(1).split(','):
+            names = [name.strip().strip('"') for name in parent.split('.')]
+            if len(names) == 1:
+                names.insert(0, table[0])
+            parent_id = table_ids.get(tuple(names))
+            if parent_id is not None:
+                dependencies.setdefault(table_ids[table], []).append(parent_id)
+    return dependencies
+
+
+def plan_ddl_stages(toc_lines, dependencies=None):
+    """
+    Split the table of contents of a dump into the stages of DDL_STAGES
+    :param toc_lines: lines of the table of contents, in the order of the dump
+    :param dependencies: {dump ID: list of the dump IDs it depends on}, see read_toc_dependencies
+    :return: list of (stage name, True if the entries can be restored concurrently, list of lines)
+    """
+    dependencies = dependencies or {}
+    stages = dict([(name, []) for name, parallel in DDL_STAGES])
+
+    # Entries needing the tables, the table of contents lists the dependencies of an entry before it
+    after_tables = set()
+    for line in toc_lines:
+        entry_type = read_toc_entry(line)
+        if entry_type is None:
+            continue
+        entry_id = get_toc_id(line)
+        if entry_type in DDL_PARALLEL_TYPES:
+            stages[DDL_PARALLEL_TYPES[entry_type]].append(line)
+            after_tables.add(entry_id)
+        elif entry_type in DDL_POST_DATA_TYPES:
+            stages['post-data'].append(line)
+        elif entry_type in DDL_AFTER_TABLES_TYPES or after_tables.intersection(dependencies.get(entry_id, [])):
+            stages['after-tables'].append(line)
+            after_tables.add(entry_id)
+        else:
+            stages['pre-data'].append(line)
+
+    return [(name, parallel, stages[name]) for name, parallel in DDL_STAGES if stages[name]]
+
+
+def chunk_ddl_entries(entries, jobs, dependencies=None):
+    """
+    Split the entries of a parallel stage into lists restored concurrently. The entries depending on each other are
+    kept in the same list, every list keeps the order of the dump.
+    :param entries: lines of the table of contents of the stage
+    :param jobs: maximum number of lists
+    :param dependencies: {dump ID: list of the dump IDs it depends on}
+    :return: list of lists of lines
+    """
+    dependencies = dependencies or {}
+    positions = dict([(get_toc_id(line), position) for position, line in enumerate(entries)])
+
+    # Union find of the entries of the stage linked by a dependency
+    groups = dict([(entry_id, entry_id) for entry_id in positions])
+
+    def find(entry_id):
+        while groups[entry_id] != entry_id:
+            groups[entry_id] = groups[groups[entry_id]]
+            entry_id = groups[entry_id]
+        return entry_id
+
+    for entry_id in positions:
+        for dependency in dependencies.get(entry_id, []):
+            if dependency in positions:
+                groups[find(entry_id)] = find(dependency)
+
+    families = {}
+    for entry_id in positions:
+        families.setdefault(find(entry_id), []).append(positions[entry_id])
+
+    # Biggest families first, each to the shortest list
+    chunks = [[] for job in range(max(1, min(jobs, len(families))))]
+    for family in sorted(families.values(), key=lambda family: (-len(family), min(family))):
+        shortest = min(chunks, key=len)
+        shortest.extend(family)
+    return [[entries[position] for position in sorted(chunk)] for chunk in chunks if chunk]
 
 
 def confirm(question, default='no'):
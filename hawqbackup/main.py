@@ -5,6 +5,9 @@ import logging.handlers
 import hawqbackup
 import backup
 import restore
+import prune
+import verify
+from lib import COMPRESSION_CODECS, DATA_FORMATS
 
 from os.path import expanduser
 
@@ -41,6 +44,32 @@ def parseargs(args):
     shared_parser.add_argument('--include-roles', dest='include_roles', default=False, action='store_true',
                                help='Include user roles and resource queues')
     shared_parser.add_argument('-y', '--yes', action='store_true', default=False, help='Assume Yes to every prompt')
+    shared_parser.add_argument('-j', '--jobs', default=1, type=int,
+                               help='Number of tables to backup/restore in parallel. Each job opens its own '
+                                    'connection. Restore also creates the tables and indexes of the DDL in parallel')
+
+    shared_parser.add_argument('--command-timeout', dest='command_timeout', type=int,
+                               help='Seconds after which an external command (pg_dump, pg_restore, hdfs...) is '
+                                    'killed and considered failed. No timeout by default')
+
+    shared_parser.add_argument('--retries', type=int, default=2,
+                               help='Times the dump or load of a table is retried after a transient failure (i.e PXF '
+                                    'timeout, NameNode failover) before the table is given up')
+    shared_parser.add_argument('--retry-delay', dest='retry_delay', type=float, default=5,
+                               help='Seconds before the first retry of a table, doubled on every next retry')
+
+    shared_parser.add_argument('--metrics-dir', dest='metrics_dir',
+                               help='Write the performance metrics of the run into this directory, as a JSON report '
+                                    'and a Prometheus textfile')
+
+    # HDFS parameters
+    shared_parser.add_argument('--hdfs-namenode', dest='hdfs_namenode',
+                               help='NameNode host, defaults to the one in the Hadoop configuration')
+    shared_parser.add_argument('--hdfs-port', dest='hdfs_port', type=int, help='NameNode port')
+    shared_parser.add_argument('--hdfs-chunk-size', dest='hdfs_chunk_size', type=int, default=4 * 1024 * 1024,
+                               help='Size in bytes of the chunks streamed from/to HDFS')
+    shared_parser.add_argument('--hdfs-replication', dest='hdfs_replication', type=int, default=0,
+                               help='Replication factor of the metadata files, 0 uses the cluster default')
 
     schema_or_data_group = shared_parser.add_mutually_exclusive_group()
     schema_or_data_group.add_argument('--schema-only', dest='schema_only', action='store_true',
@@ -64,15 +93,42 @@ def parseargs(args):
     backup_options_group.add_argument('--exclude-schema', dest='exclude_schema',
                                       help='Do not include schema "schema" in the backup. Accepts '
                                            'comma-separated list for multiple schemas')
+    backup_parser.add_argument('--incremental', metavar='201609220000', type=long,
+                               help='Only dump the append-only tables that changed since this backup ID, the '
+                                    'unchanged tables are restored from the backup holding their data')
+    backup_parser.add_argument('--compress', choices=sorted(COMPRESSION_CODECS.keys()),
+                               help='Compress the data files with this codec. Restore detects the codec of every '
+                                    'table and decompresses it transparently')
+    backup_parser.add_argument('--format', dest='data_format', choices=sorted(DATA_FORMATS.keys()), default='text',
+                               help='Format of the data files, through the matching PXF profile. Only the '
+                                    'formats PXF can write are offered. Restore reads every table in the format '
+                                    'it was written in')
+    backup_parser.add_argument('--dedup', action='store_true', default=False,
+                               help='Store the data of append-only tables in an object store shared by the backups '
+                                    'of the database, a table whose data did not change is not written again')
+    backup_parser.add_argument('--slice-size', dest='slice_size', type=long,
+                               help='Split the tables bigger than this many bytes into slices dumped concurrently '
+                                    'by different jobs, one slice per slice size up to one slice per job. Restore '
+                                    'loads the slices concurrently as well')
+    backup_parser.add_argument('--plan', action='store_true', default=False,
+                               help='Print the tables to dump with their estimated size and duration, the estimated '
+                                    'duration of the backup with the chosen jobs and the HDFS space left, without '
+                                    'backing up anything')
+    backup_parser.add_argument('--resume', metavar='201609220000', type=long,
+                               help='Resume this interrupted backup, the tables it already dumped are skipped. Use '
+                                    'the same options as the interrupted backup')
 
     # Restore specific options
     restore_parser = subparsers.add_parser('restore', add_help=False, parents=[shared_parser],
                                            help='Restore a database from HDFS')
-    restore_parser.add_argument('-k', '--backup-id', dest='backup_id', metavar='201609220000', nargs=1, type=long,
+    restore_parser.add_argument('-k', '--backup-id', dest='backup_id', metavar='201609220000', type=long,
                                 required=True)
     restore_parser.add_argument('--target-database', dest='target_database',
                                 help='Restore <database> into <target_database>. Useful if the name of original '
                                      'database does not match the new one')
+    restore_parser.add_argument('--resume', action='store_true', default=False,
+                                help='Resume an interrupted restore of this backup into the same database, the '
+                                     'tables it already loaded are skipped and the other ones are reloaded')
     restore_parser.add_argument('--ignore-error', action='store_true', default=False, help='Ignore errors when '
                                                                                            'restoring metadata')
 
@@ -85,12 +141,48 @@ def parseargs(args):
                                          help='Input file for selective restore. This file has to be generated by '
                                               '--output-to-file option.')
 
+    # Verify specific options
+    verify_parser = subparsers.add_parser('verify', add_help=False, parents=[shared_parser],
+                                          help='Compare the row count and a hash of the rows of every table with '
+                                               'its backup')
+    verify_parser.add_argument('-k', '--backup-id', dest='backup_id', metavar='201609220000', type=long,
+                               required=True)
+
+    # Prune specific options
+    prune_parser = subparsers.add_parser('prune', add_help=False, parents=[shared_parser],
+                                         help='Delete the old backups of a database and the data they do not share '
+                                              'with the kept backups')
+    prune_parser.add_argument('--keep', type=int, required=True,
+                              help='Number of most recent complete backups of the database to keep, with the '
+                                   'unfinished or failed backups taken since. Older backups still referenced by a '
+                                   'kept incremental backup are kept as well')
+
     options_object = parser.parse_args(args)
 
     if options_object.database is None:
         logger.error("You have to specify a database to connect to")
         parser.exit(2)
 
+    if options_object.jobs < 1:
+        logger.error("The number of jobs has to be greater than zero")
+        parser.exit(2)
+
+    if options_object.retries < 0 or options_object.retry_delay < 0:
+        logger.error("The number of retries and the retry delay cannot be negative")
+        parser.exit(2)
+
+    if options_object.command == 'backup' and options_object.slice_size is not None and options_object.slice_size < 1:
+        logger.error("The slice size has to be greater than zero")
+        parser.exit(2)
+
+    if options_object.command == 'backup' and options_object.plan and options_object.schema_only:
+        logger.error("--plan estimates the data of the backup, it does not apply to a schema only backup")
+        parser.exit(2)
+
+    if options_object.command == 'prune' and options_object.keep < 1:
+        logger.error("At least one backup has to be kept")
+        parser.exit(2)
+
     return options_object
 
 
@@ -167,7 +259,7 @@ def main(args):
     if cmdline_args.quiet:
         logger.removeHandler(stderr_handler)
 
-    if cmdline_args.schema and not is_schema_name_valid(cmdline_args.schema):
+    if getattr(cmdline_args, 'schema', None) and not is_schema_name_valid(cmdline_args.schema):
         logger.error("The schema name '%s' is not valid. Make sure you use double quotes if your name contains dots"
                      % cmdline_args.schema)
         return 1
@@ -183,7 +275,7 @@ def main(args):
 
         hdb_backup.run_backup()
 
-    else:
+    elif cmdline_args.command == 'restore':
         logger.debug("Initializing restore stage")
         hdb_restore = restore.HDBRestore()
 
@@ -192,5 +284,23 @@ def main(args):
 
         hdb_restore.run_restore()
 
+    elif cmdline_args.command == 'verify':
+        logger.debug("Initializing verify stage")
+        hdb_verify = verify.HdbVerify()
+
+        logger.debug("Setting options for verify")
+        hdb_verify.set_vars(cmdline_args)
+
+        hdb_verify.run_verify()
+
+    else:
+        logger.debug("Initializing prune stage")
+        hdb_prune = prune.HdbPrune()
+
+        logger.debug("Setting options for prune")
+        hdb_prune.set_vars(cmdline_args)
+
+        hdb_prune.run_prune()
+
     return 0
 
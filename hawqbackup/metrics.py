@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("hdb_logger")
+
+
+class RunMetrics:
+    """
+    Performance metrics of a backup or restore run: duration of every phase, per table latencies, rows, bytes and
+    the time spent in external commands and HDFS calls. At the end of the run they are exported as a JSON report
+    and as a Prometheus textfile (node_exporter textfile collector format).
+    """
+
+    def __init__(self):
+        """
+        Create a RunMetrics object..
+        """
+        self.lock = threading.Lock()
+        self.timing = threading.local()
+        self.start = time.time()
+        self.labels = {}
+        self.phases = {}
+        self.timers = {}
+        self.tables = {}
+
+    def set_labels(self, **labels):
+        """
+        Labels identifying the run (i.e command, database, backup ID)
+        :return:
+        """
+        self.labels.update(labels)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase of the run, used as "with run_metrics.phase('metadata'):"
+        :param name: name of the phase
+        :return:
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.lock.acquire()
+            try:
+                self.phases[name] = self.phases.get(name, 0) + time.time() - start
+            finally:
+                self.lock.release()
+
+    @contextmanager
+    def timer(self, timer):
+        """
+        Time a call under a kind of call, used as "with run_metrics.timer('hdfs'):". A call made by another call
+        timed on the same thread is part of it (i.e the hdfs command run by an HDFS call), every second is counted
+        under one kind only.
+        :param timer: kind of call
+        :return:
+        """
+        if getattr(self.timing, 'active', False):
+            yield
+            return
+
+        self.timing.active = True
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing.active = False
+            self.add_time(timer, time.time() - start)
+
+    def add_time(self, timer, seconds):
+        """
+        Accumulate the time spent in one call of a kind (i.e subprocess, hdfs)
+        :param timer: kind of call
+        :param seconds: duration of the call
+        :return:
+        """
+        self.lock.acquire()
+        try:
+            total = self.timers.setdefault(timer, {'seconds': 0.0, 'calls': 0})
+            total['seconds'] += seconds
+            total['calls'] += 1
+        finally:
+            self.lock.release()
+
+    def record_table(self, table, **values):
+        """
+        Record values of a table (i.e create, insert and commit latencies, rows, bytes)
+        :param table: table name
+        :return:
+        """
+        self.lock.acquire()
+        try:
+            self.tables.setdefault(table, {}).update(values)
+        finally:
+            self.lock.release()
+
+    def report(self, status):
+        """
+        Build the report of the run
+        :param status: outcome of the run (success or failed)
+        :return: dictionary with all the metrics
+        """
+        totals = {'tables': len(self.tables), 'failed': 0, 'rows': 0, 'bytes': 0}
+        steps = {}
+        for values in self.tables.values():
+            # Tables given up after their retries keep the error they failed with
+            if 'error' in values:
+                totals['tables'] -= 1
+                totals['failed'] += 1
+            totals['rows'] += values.get('rows') or 0
+            totals['bytes'] += values.get('bytes') or 0
+            for step in ['create', 'insert', 'commit']:
+                if step in values:
+                    step_total = steps.setdefault(step, {'seconds': 0.0, 'count': 0, 'max': 0.0})
+                    step_total['seconds'] += values[step]
+                    step_total['count'] += 1
+                    step_total['max'] = max(step_total['max'], values[step])
+
+        return {
+            'labels': self.labels,
+            'status': status,
+            'start': self.start,
+            'duration': time.time() - self.start,
+            'phases': self.phases,
+            'timers': self.timers,
+            'steps': steps,
+            'totals': totals,
+            'tables': self.tables
+        }
+
+    def write(self, directory, status):
+        """
+        Write the JSON report and the Prometheus textfile of the run into a directory. The textfile has a stable
+        name per command and database so the collector always exports the last run.
+        :param directory: destination directory
+        :param status: outcome of the run (success or failed)
+        :return:
+        """
+        report = self.report(status)
+        name = 'hawqbackup_{0}_{1}'.format(self.labels.get('command'), self.labels.get('database'))
+
+        try:
+            self.__write_file(os.path.join(directory, name + '_' + str(self.labels.get('backup_id')) + '.json'),
+                              json.dumps(report, indent=2, sort_keys=True))
+            self.__write_file(os.path.join(directory, name + '.prom'), self.__prometheus(report))
+        except (IOError, OSError), e:
+            logger.warn("Could not write the metrics into \"{0}\": {1}".format(directory, e))
+            return
+
+        logger.info("Metrics of this run written into \"{0}\"".format(directory))
+
+    def __prometheus(self, report):
+        """
+        Format the report in the Prometheus text exposition format. Per table values are aggregated per step to keep
+        the number of series bounded, the JSON report keeps them per table. The backup ID changes on every run, it
+        is exported as a value instead of a label for the same reason.
+        :param report: report built by report()
+        :return: text of the metrics
+        """
+        labels = ','.join([format_label(key, report['labels'][key]) for key in sorted(report['labels'])
+                           if key != 'backup_id'])
+        lines = []
+
+        def add(metric, help_text, samples):
+            lines.append('# HELP hawqbackup_{0} {1}'.format(metric, help_text))
+            lines.append('# TYPE hawqbackup_{0} gauge'.format(metric))
+            for extra_labels, value in samples:
+                all_labels = ','.join([label for label in [labels, extra_labels] if label])
+                lines.append('hawqbackup_{0}{{{1}}} {2}'.format(metric, all_labels, value))
+
+        add('run_duration_seconds', 'Duration of the run', [('', report['duration'])])
+        add('run_success', '1 if the run succeeded', [('', int(report['status'] == 'success'))])
+        add('run_start_timestamp_seconds', 'Start time of the run', [('', report['start'])])
+        if str(report['labels'].get('backup_id')).isdigit():
+            add('backup_id', 'Backup ID of the run', [('', report['labels']['backup_id'])])
+        add('phase_duration_seconds', 'Duration of every phase of the run',
+            [(format_label('phase', phase), seconds) for phase, seconds in sorted(report['phases'].items())])
+        add('call_duration_seconds', 'Time spent in external commands and HDFS calls',
+            [(format_label('call', timer), total['seconds']) for timer, total in sorted(report['timers'].items())])
+        add('calls', 'Number of external commands and HDFS calls',
+            [(format_label('call', timer), total['calls']) for timer, total in sorted(report['timers'].items())])
+        add('table_step_duration_seconds', 'Time spent by all tables on every step',
+            [(format_label('step', step), total['seconds']) for step, total in sorted(report['steps'].items())])
+        add('table_step_max_duration_seconds', 'Slowest table on every step',
+            [(format_label('step', step), total['max']) for step, total in sorted(report['steps'].items())])
+        add('tables', 'Tables processed', [('', report['totals']['tables'])])
+        add('tables_failed', 'Tables given up after all their retries', [('', report['totals']['failed'])])
+        add('rows', 'Rows processed', [('', report['totals']['rows'])])
+        add('bytes', 'Bytes processed', [('', report['totals']['bytes'])])
+
+        return '\n'.join(lines) + '\n'
+
+    def __write_file(self, path, content):
+        """
+        Write a file atomically, so a collector never reads half a file
+        :param path: destination file
+        :param content: content of the file
+        :return:
+        """
+        tmp_path = path + '.' + str(os.getpid())
+        tmp_file = open(tmp_path, 'w')
+        try:
+            tmp_file.write(content)
+        finally:
+            tmp_file.close()
+        os.rename(tmp_path, path)
+
+
+def format_label(name, value):
+    """
+    Format a label of a Prometheus sample, escaping the backslashes, double quotes and line feeds of its value as
+    the text exposition format requires (i.e for a database name holding a double quote)
+    :param name: label name
+    :param value: label value
+    :return: text of the label
+    """
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{0}="{1}"'.format(name, value)
+
+
+def timed(timer):
+    """
+    Decorator accumulating the time spent in a function under a timer of the run metrics
+    :param timer: kind of call (i.e hdfs)
+    :return: decorator
+    """
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with run_metrics.timer(timer):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
+# Metrics of the current run, shared by all the modules like the hdb_logger logger
+run_metrics = RunMetrics()
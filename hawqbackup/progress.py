@@ -0,0 +1,137 @@
+import sys
+import threading
+import time
+
+
+def format_bytes(size):
+    """
+    Human readable size
+    :param size: size in bytes
+    :return: size with its unit (i.e 1.5GB)
+    """
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(size) < 1024.0 or unit == 'TB':
+            break
+        size /= 1024.0
+    return "{0:.1f}{1}".format(size, unit)
+
+
+def format_duration(seconds):
+    """
+    Human readable duration
+    :param seconds: duration in seconds
+    :return: duration as HH:MM:SS
+    """
+    seconds = int(seconds)
+    return "{0:02d}:{1:02d}:{2:02d}".format(seconds / 3600, (seconds % 3600) / 60, seconds % 60)
+
+
+class ProgressTracker:
+    """
+    Terminal progress of a backup or restore. Progress and ETA are weighted by the size of the tables, so a table
+    holding most of the data moves the bar accordingly. Workers report the tables they finish concurrently.
+    """
+
+    def __init__(self, prefix, sizes, bar_length=50, stream=sys.stdout):
+        """
+        Create a ProgressTracker object..
+        :param prefix: text printed before the bar
+        :param sizes: {table: expected size in bytes} of every table to process
+        :param bar_length: character length of bar
+        :param stream: where the progress is printed
+        """
+        self.prefix = prefix
+        self.sizes = sizes
+        self.bar_length = bar_length
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+        self.total_tables = len(sizes)
+        self.total_bytes = sum(sizes.values())
+        self.completed_tables = 0
+        self.completed_bytes = 0
+        self.rows = 0
+        self.bytes = 0
+        self.table_stats = {}
+
+    def table_done(self, table, rows=None, size=None):
+        """
+        Record a finished table and refresh the progress
+        :param table: table name
+        :param rows: rows processed, if known
+        :param size: bytes processed, the expected size of the table if not known
+        :return:
+        """
+        if size is None:
+            size = self.sizes.get(table, 0)
+
+        self.lock.acquire()
+        try:
+            self.table_stats[table] = (rows, size)
+            self.completed_tables += 1
+            self.completed_bytes += self.sizes.get(table, 0)
+            self.rows += rows or 0
+            self.bytes += size
+            self.__render()
+        finally:
+            self.lock.release()
+
+    def fraction(self):
+        """
+        Fraction of the work done, weighted by size. The table count is used when the sizes are unknown
+        :return: number between 0 and 1
+        """
+        if self.total_bytes > 0:
+            return self.completed_bytes / float(self.total_bytes)
+        if self.total_tables > 0:
+            return self.completed_tables / float(self.total_tables)
+        return 1.0
+
+    def eta(self):
+        """
+        Estimated seconds left, assuming the remaining data is processed at the throughput observed so far
+        :return: seconds left, None until something finished
+        """
+        fraction = self.fraction()
+        if fraction <= 0:
+            return None
+        elapsed = time.time() - self.start
+        return elapsed * (1 - fraction) / fraction
+
+    def summary(self):
+        """
+        Throughput summary of the work done so far
+        :return: text with rows/s, bytes/s and ETA
+        """
+        elapsed = max(time.time() - self.start, 0.001)
+        eta = self.eta()
+        return "{0:.0f} rows/s {1}/s ETA {2}".format(
+            self.rows / elapsed,
+            format_bytes(self.bytes / elapsed),
+            eta is None and '--:--:--' or format_duration(eta)
+        )
+
+    def finish(self):
+        """
+        Terminate the progress line, even if some tables failed and the bar is not complete
+        :return:
+        """
+        self.lock.acquire()
+        try:
+            if self.completed_tables < self.total_tables:
+                self.stream.write('\n')
+                self.stream.flush()
+        finally:
+            self.lock.release()
+
+    def __render(self):
+        fraction = self.fraction()
+        filled_length = int(round(self.bar_length * fraction))
+        bar = '#' * filled_length + '-' * (self.bar_length - filled_length)
+        self.stream.write('\r%s (%s/%s) |%s| %.1f%% %s' % (
+            self.prefix, self.completed_tables, self.total_tables, bar, 100 * fraction, self.summary()
+        ))
+        if self.completed_tables == self.total_tables:
+            self.stream.write('\n')
+        self.stream.flush()
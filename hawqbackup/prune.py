@@ -0,0 +1,224 @@
+import datetime
+import json
+import logging
+import sys
+
+from lib import get_directory, get_manifest_file, get_journal_file, get_object_directory, get_lock_file, confirm
+from storage import HdfsStorage
+
+
+class HdbPrune:
+    """
+    Removal of the old backups of a database, followed by the garbage collection of the objects of the object store
+    that no remaining backup references
+    """
+
+    logger = logging.getLogger("hdb_logger")
+
+    def __init__(self):
+        """
+        Create a HdbPrune object..
+        """
+        self.dbname = None
+        self.backup_base = "/hawq_backup"
+        self.keep = None
+        self.no_prompt = False
+        self.storage = None
+        self.hdfs_namenode = None
+        self.hdfs_port = None
+        self.hdfs_chunk_size = 4 * 1024 * 1024
+        self.hdfs_replication = 0
+
+    def __list_backups(self):
+        """
+        Backup IDs holding a backup of the database
+        :return: list of backup IDs, oldest first
+        """
+        backup_ids = []
+        for directory in self.storage.list_directories(self.backup_base):
+            backup_id = directory.rstrip('/').split('/')[-1]
+            if backup_id.isdigit() and self.storage.exists(self.__backup_directory(backup_id)):
+                backup_ids.append(backup_id)
+        return sorted(backup_ids)
+
+    def __is_complete(self, backup_id):
+        """
+        Whether a backup holds the data of all its tables: it has a manifest, which schema only and unfinished backups
+        do not have, and gave up no table
+        :param backup_id: backup ID
+        :return: True if the backup is complete
+        """
+        metadata_dir = get_directory(self.backup_base, backup_id, self.dbname)[0]
+        content = self.storage.read_if_exists(get_manifest_file(metadata_dir, backup_id))
+        return content is not None and not json.loads(content).get('failed')
+
+    def __backup_directory(self, backup_id):
+        """
+        Directory holding the metadata and the data of a backup of the database
+        :param backup_id: backup ID
+        :return: HDFS path
+        """
+        return get_directory(self.backup_base, backup_id, self.dbname)[0].rsplit('/', 1)[0]
+
+    def __references(self, backup_ids):
+        """
+        Backups and objects holding the data of the tables of some backups. The manifest of an incremental backup
+        points directly to the backup holding the data of every table, so no chain has to be followed. An unfinished
+        backup has no manifest yet but can be resumed, what its journal references is kept.
+        :param backup_ids: list of backup IDs
+        :return: (set of backup IDs, set of object keys)
+        """
+        backups = set()
+        objects = set()
+        for backup_id in backup_ids:
+            metadata_dir = get_directory(self.backup_base, backup_id, self.dbname)[0]
+            content = self.storage.read_if_exists(get_manifest_file(metadata_dir, backup_id))
+            if content is None:
+                content = self.storage.read_if_exists(get_journal_file(metadata_dir, backup_id))
+            if content is None:
+                continue
+
+            for entry in json.loads(content)['tables'].values():
+                backups.add(str(entry.get('backup_id')))
+                if entry.get('object'):
+                    objects.add(entry['object'])
+
+        return backups, objects
+
+    def __running_backups(self, pruned):
+        """
+        Backups holding their marker on the object store, they may rely on objects no manifest or journal records
+        yet. The marker of a backup that has its manifest or that was just deleted is left over by an interrupted
+        run, it is removed.
+        :param pruned: deleted backup IDs
+        :return: list of backup IDs
+        """
+        objects_dir = get_object_directory(self.backup_base, self.dbname)
+        running = []
+        for path, size in self.storage.list_files(objects_dir):
+            name = path.rstrip('/').split('/')[-1]
+            if not name.startswith('backup_') or not name.endswith('.lock'):
+                continue
+            backup_id = name[len('backup_'):-len('.lock')]
+            metadata_dir = get_directory(self.backup_base, backup_id, self.dbname)[0]
+            if backup_id in pruned or self.storage.exists(get_manifest_file(metadata_dir, backup_id)):
+                self.storage.delete(get_lock_file(self.backup_base, self.dbname, 'backup_' + backup_id))
+            else:
+                running.append(backup_id)
+        return running
+
+    def __collect_objects(self, backup_ids, pruned):
+        """
+        Delete the objects no remaining backup references, and the temporary objects of backups that are gone.
+        Nothing is collected while a backup holds its marker on the object store.
+        :param backup_ids: remaining backup IDs
+        :param pruned: deleted backup IDs
+        :return:
+        """
+        objects_dir = get_object_directory(self.backup_base, self.dbname)
+        if not self.storage.exists(objects_dir):
+            return
+
+        lock_file = get_lock_file(self.backup_base, self.dbname, 'prune')
+        self.storage.write(lock_file, '')
+        try:
+            running = self.__running_backups(pruned)
+            if running:
+                self.logger.warn("Not collecting the unreferenced objects of \"{0}\", the backup(s) {1} may be "
+                                 "using them. Resume or prune an interrupted backup to release the object "
+                                 "store".format(objects_dir, ', '.join(running)))
+                return
+            self.__delete_unreferenced_objects(backup_ids)
+        finally:
+            self.storage.delete(lock_file)
+
+    def __delete_unreferenced_objects(self, backup_ids):
+        """
+        Delete the objects no remaining backup references, and the temporary objects of backups that are gone
+        :param backup_ids: remaining backup IDs
+        :return:
+        """
+        objects_dir = get_object_directory(self.backup_base, self.dbname)
+        referenced_objects = self.__references(backup_ids)[1]
+
+        deleted = set()
+        for directory in self.storage.list_directories(objects_dir):
+            name = directory.rstrip('/').split('/')[-1]
+            if name.endswith('.tmp'):
+                if name.split('.')[1] in backup_ids:
+                    continue
+            elif name in referenced_objects:
+                continue
+            self.storage.delete(objects_dir + '/' + name)
+            deleted.add(name)
+
+        index = self.storage.read_if_exists(objects_dir + '/index.json')
+        if index is not None and deleted:
+            objects = json.loads(index)
+            self.storage.write(objects_dir + '/index.json', json.dumps(
+                dict([(key, stats) for key, stats in objects.items() if key not in deleted])
+            ))
+
+        self.logger.info("Deleted {0} unreferenced object(s) from \"{1}\"".format(len(deleted), objects_dir))
+
+    def run_prune(self):
+        """
+        Keep the most recent backups of the database and delete the older ones, unless a kept backup still
+        references their data
+        :return:
+        """
+        self.logger.info("Starting Prune at: {0}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+        self.logger.info("Checking the HDFS connectivity")
+        self.storage = HdfsStorage(self.hdfs_namenode, self.hdfs_port, self.hdfs_chunk_size, self.hdfs_replication)
+
+        # Only complete backups count, the incomplete ones more recent than the oldest kept backup are kept on top
+        # of them: they may still be resumed
+        backup_ids = self.__list_backups()
+        complete = [backup_id for backup_id in backup_ids if self.__is_complete(backup_id)]
+        kept = list(backup_ids)
+        if len(complete) > self.keep:
+            kept = [backup_id for backup_id in backup_ids if backup_id >= complete[-self.keep]]
+        referenced_backups = self.__references(kept)[0]
+        pruned = []
+        for backup_id in backup_ids:
+            if backup_id in kept:
+                continue
+            if backup_id in referenced_backups:
+                self.logger.info("Keeping the backup {0}, a more recent backup references its data".format(backup_id))
+                kept.append(backup_id)
+            else:
+                pruned.append(backup_id)
+
+        self.logger.info("Found {0} backup(s) of the database \"{1}\", {2} to prune: {3}".format(
+            len(backup_ids), self.dbname, len(pruned), ', '.join(pruned) or 'none'
+        ))
+
+        if pruned and not self.no_prompt:
+            choice = confirm("Do you wish to delete these backups")
+            if choice.startswith('n') or choice.startswith('N'):
+                self.logger.info("Aborting due to user request....")
+                sys.exit(0)
+
+        for backup_id in pruned:
+            self.logger.info("Deleting the backup {0}".format(backup_id))
+            backup_dir = self.__backup_directory(backup_id)
+            self.storage.delete(backup_dir)
+
+            # The backup ID directory is shared by the backups of the databases taken at the same time
+            id_dir = backup_dir.rsplit('/', 1)[0]
+            if not self.storage.list_directories(id_dir) and not self.storage.list_files(id_dir):
+                self.storage.delete(id_dir)
+
+        self.__collect_objects(sorted(kept), pruned)
+
+        self.logger.info("Prune finished at: {0}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+    def set_vars(self, options_namespace):
+        self.dbname = options_namespace.database
+        self.keep = options_namespace.keep
+        self.no_prompt = options_namespace.yes
+        self.hdfs_namenode = options_namespace.hdfs_namenode
+        self.hdfs_port = options_namespace.hdfs_port
+        self.hdfs_chunk_size = options_namespace.hdfs_chunk_size
+        self.hdfs_replication = options_namespace.hdfs_replication
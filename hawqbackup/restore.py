@@ -1,11 +1,24 @@
 import datetime
+import json
 import logging
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 
-from pgdb import DatabaseError
+from pgdb import DatabaseError, Error
 
-from lib import check_executables, error_logger, set_connection, run_cmd, print_progress, get_directory, \
-    ext_table_sql_generator, confirm
+from lib import check_executables, error_logger, ConnectionPool, run_cmd, stream_cmd, get_directory, \
+    ext_table_sql_generator, confirm, run_parallel, start_background, run_with_retries, load_history, save_history, \
+    order_by_expected_runtime, get_work_items, get_manifest_file, get_restore_journal_file, get_table_data_directory, \
+    plan_ddl_stages, chunk_ddl_entries, read_toc_entry, read_toc_dependencies, read_inheritance_dependencies, \
+    DATA_FORMATS
+from storage import HdfsStorage
+from progress import ProgressTracker
+from metrics import run_metrics
+from journal import CheckpointJournal
 
 
 class HDBRestore:
@@ -45,32 +58,56 @@ class HDBRestore:
         self.no_prompt = False
         self.restore_base = "/hawq_backup"
         self.ext_schema_name = 'hawqrestore_schema'
-        self.generate_list_location = '/tmp/backup_list_' + self.backup_id
+        self.generate_list_location = None
+        self.jobs = 1
+        self.table_timings = {}
+        self.data_locations = {}
+        self.data_sizes = {}
+        self.data_compression = {}
+        self.data_formats = {}
+        self.data_parents = {}
+        self.data_rows = {}
+        self.data_slices = {}
+        self.missing_tables = {}
+        self.slices_done = {}
+        self.started_tables = set()
+        self.in_flight_tables = set()
+        self.retries = 2
+        self.retry_delay = 5
+        self.lock = threading.Lock()
+        self.progress = None
+        self.storage = None
+        self.pool = None
+        self.resume = False
+        self.journal = None
+        self.hdfs_namenode = None
+        self.hdfs_port = None
+        self.hdfs_chunk_size = 4 * 1024 * 1024
+        self.hdfs_replication = 0
+        self.command_timeout = None
+        self.metrics_dir = None
 
         # Query Skeleton for backup
         self.drop_schema_skeleton = """ DROP SCHEMA IF EXISTS {0} CASCADE """
         self.create_schema_skeleton = """ CREATE SCHEMA {0} """
         self.create_external_table_skeleton = """ CREATE EXTERNAL TABLE {0}.{1} ( like {2} )
-                                              LOCATION ('pxf://localhost:{3}{4}/{5}/{6}?profile=HdfsTextSimple')
-                                              FORMAT 'TEXT' (DELIMITER = E'\\t') """
+                                              LOCATION ('pxf://localhost:{3}{4}/{5}/{6}?profile={8}{7}')
+                                              {9} """
         self.insert_external_table_skeleton = """ INSERT INTO {2} SELECT * FROM {0}.{1} """
+        self.truncate_table_skeleton = """ TRUNCATE TABLE {0} """
 
     def __restore_metadata(self):
         """
         Restore the metadata and global objects is its a full restore
         :return:
         """
-        # Source the hawq executable path
-        self.logger.info("Source the hawq executable path")
-        run_cmd("source $GPHOME/greenplum_path.sh")
-
         # Backup file name
         ddl_file = self.metadata_backup_dir + '/hdb_dump_' + self.backup_id + '_ddl.dmp'
         global_file = self.metadata_backup_dir + '/hdb_dump_' + self.backup_id + '_global.dmp'
 
         # If request to create database then create it with default encoding if not provided.
         if self.create_target_db:
-            create_db_cmd = 'createdb ' + self.to_dbname + ' -E ' + self.target_db_encoding
+            create_db_cmd = ['createdb', self.to_dbname, '-E', self.target_db_encoding]
             run_cmd(create_db_cmd)
 
         # Metadata restore command creator
@@ -78,34 +115,157 @@ class HDBRestore:
             "pg_restore",
             "--schema-only"
         )
-        pg_restore_cmd = ' '.join(pg_restore_cmd)
-        metadata_file = 'hdfs dfs -cat ' + ddl_file + ' | '
 
         # If generate list is requested.
         if self.generate_list:
-            pg_restore_cmd += ' > ' + self.generate_list_location
-            pg_restore_cmd = metadata_file + pg_restore_cmd + ' ; exit $PIPESTATUS;'
-            run_cmd(pg_restore_cmd, self.ignore)
+            list_file = open(self.generate_list_location, 'w')
+            try:
+                self.storage.download_to_cmd(ddl_file, pg_restore_cmd, self.ignore, list_file.write,
+                                             self.command_timeout)
+            finally:
+                list_file.close()
             self.logger.info("Backup List for the backup ID \"{0}\" is generated at location: \"{1}\"".format(
                 self.backup_id, self.generate_list_location
             ))
             sys.exit(0)
 
-        # Else then this a full restore or user list restore
+        # Else then this a full restore or user list restore. With several jobs the independent objects are created
+        # concurrently, --clean drops the objects of the whole dump first and is left to a single pg_restore.
+        elif self.jobs > 1 and not self.clean:
+            self.__restore_ddl_in_stages(ddl_file)
         else:
-            pg_restore_cmd = metadata_file + pg_restore_cmd + ' ; exit $PIPESTATUS;'
-            run_cmd(pg_restore_cmd, self.ignore)
+            self.storage.download_to_cmd(ddl_file, pg_restore_cmd, self.ignore, timeout=self.command_timeout)
 
         # If full restore or if requested to restore the global dump then
         if self.global_restore or not (self.generate_list or self.user_list):
-            psql_cmd = 'psql -d ' + self.to_dbname + ' -f ' + global_file + ' -U ' + self.username
-            run_cmd(psql_cmd)
+            psql_cmd = ['psql', '-d', self.to_dbname, '-U', self.username]
+            self.storage.download_to_cmd(global_file, psql_cmd, timeout=self.command_timeout)
+
+    def __restore_ddl_in_stages(self, ddl_file):
+        """
+        Restore the DDL in the stages of lib.DDL_STAGES, the objects of the parallel stages (tables, indexes) are
+        split into one list per job restored concurrently over their own connections. pg_restore needs a seekable
+        file to restore a list, so the dump is copied locally first. Every list is restored in a single transaction:
+        the failed lists of a parallel stage are retried serially in the order of the dump once the stage is done,
+        and if a serial stage fails it is restored with all the following stages by a single pg_restore.
+        :param ddl_file: HDFS path of the dump
+        :return:
+        """
+        work_dir = tempfile.mkdtemp(prefix='hawqrestore_')
+        try:
+            local_dump = os.path.join(work_dir, os.path.basename(ddl_file))
+            self.storage.download(ddl_file, local_dump)
+
+            # The user list is already a table of contents, restricted to what the user wants to restore
+            toc = []
+            if self.user_list:
+                toc = [line.rstrip('\n') for line in open(self.user_list)]
+            else:
+                stream_cmd(['pg_restore', '--list', '--verbose', local_dump],
+                           lambda line: toc.append(line.rstrip('\n')), lines=True, timeout=self.command_timeout)
+
+            dependencies = read_toc_dependencies(toc)
+            if not dependencies:
+                dependencies = self.__read_inheritance(local_dump, work_dir, toc)
+
+            stages = plan_ddl_stages(toc, dependencies)
+            for index, (name, parallel, entries) in enumerate(stages):
+                if not parallel:
+                    self.logger.info("Restoring the {0} DDL object(s) of the stage \"{1}\"".format(len(entries), name))
+                    if self.__restore_ddl_list(local_dump, self.__write_ddl_list(work_dir, name, entries), True):
+                        continue
+
+                    # Restore what is left the way a single pg_restore does, in the order of the dump
+                    remaining = [line for stage in stages[index:] for line in stage[2]]
+                    self.logger.warn("Restore of the stage \"{0}\" failed, restoring the {1} remaining DDL object(s) "
+                                     "serially".format(name, len(remaining)))
+                    self.__restore_ddl_list(local_dump, self.__write_ddl_list(work_dir, name + '_serial', remaining))
+                    break
+
+                chunks = chunk_ddl_entries(entries, self.jobs, dependencies)
+                self.logger.info("Restoring the {0} DDL object(s) of the stage \"{1}\" with {2} job(s)".format(
+                    len(entries), name, len(chunks)
+                ))
+                list_files = [self.__write_ddl_list(work_dir, '{0}_{1}'.format(name, job), chunk)
+                              for job, chunk in enumerate(chunks)]
+                restored = {}
+
+                def restore_chunk(worker_id, list_file):
+                    restored[list_file] = self.__restore_ddl_list(local_dump, list_file, True)
+
+                failed_chunks = run_parallel(restore_chunk, list_files, len(list_files))
+                if failed_chunks:
+                    error_logger("Restore of the DDL of the stage \"{0}\" failed on the database \"{1}\"".format(
+                        name, self.to_dbname
+                    ))
+
+                # Objects depending on objects of another list (dependencies the dump did not tell about)
+                failed = set([line for job, chunk in enumerate(chunks) if not restored[list_files[job]]
+                              for line in chunk])
+                retry = [line for line in entries if line in failed]
+                if retry:
+                    self.logger.warn("Restoring serially the {0} DDL object(s) of the stage \"{1}\" that failed "
+                                     "concurrently".format(len(retry), name))
+                    self.__restore_ddl_list(local_dump, self.__write_ddl_list(work_dir, name + '_retry', retry))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def __read_inheritance(self, local_dump, work_dir, toc):
+        """
+        Dependencies between the tables of the dump from their INHERITS clauses, for the clients that do not print
+        the dependencies of the dump
+        :param local_dump: local copy of the dump
+        :param work_dir: directory of the list of the tables
+        :param toc: lines of the table of contents
+        :return: {dump ID of a table: list of the dump IDs of its parents}
+        """
+        tables = [line for line in toc if read_toc_entry(line) == 'TABLE']
+        if len(tables) < 2:
+            return {}
+
+        ddl = []
+        list_file = self.__write_ddl_list(work_dir, 'inheritance', tables)
+        stream_cmd(['pg_restore', '--schema-only', '--use-list=' + list_file, local_dump],
+                   lambda line: ddl.append(line.rstrip('\n')), lines=True, timeout=self.command_timeout)
+        return read_inheritance_dependencies(toc, ddl)
+
+    def __write_ddl_list(self, work_dir, name, entries):
+        """
+        Write a list of objects to restore
+        :param work_dir: directory of the list
+        :param name: name of the list
+        :param entries: lines of the table of contents
+        :return: path of the list
+        """
+        list_file = os.path.join(work_dir, name + '.list')
+        output = open(list_file, 'w')
+        try:
+            output.write('\n'.join(entries) + '\n')
+        finally:
+            output.close()
+        return list_file
+
+    def __restore_ddl_list(self, local_dump, list_file, atomic=False):
+        """
+        Restore the objects of a list of the table of contents of the dump
+        :param local_dump: local copy of the dump
+        :param list_file: list of the objects to restore, as printed by "pg_restore --list"
+        :param atomic: restore the list in a single transaction and report a failure instead of exiting, the caller
+                       retries it
+        :return: True if the objects were restored
+        """
+        args = ["--schema-only", "--use-list=" + list_file]
+        if atomic:
+            args.append("--single-transaction")
+        pg_restore_cmd = self.__get_args("pg_restore", *args)
+        return stream_cmd(pg_restore_cmd + [local_dump], ignore_error=atomic or self.ignore,
+                          timeout=self.command_timeout) == 0
 
     def __get_args(self, executable, *args):
         """
         compile all the executable and the arguments, combining with common arguments
         to create a full batch of command args
-        :return:
+        :return: Argument List of the command, executed without a shell
         """
         args = list(args)
         args.insert(0, executable)
@@ -128,8 +288,8 @@ class HDBRestore:
                 "--list"
             )
 
-        # If User list is provided
-        if self.user_list:
+        # If User list is provided, unless the caller restores a list of its own
+        if self.user_list and not [arg for arg in args if arg.startswith('--use-list')]:
             args.append(
                 "--use-list={0}".format(self.user_list)
             )
@@ -146,14 +306,34 @@ class HDBRestore:
 
     def __get_data_location(self):
         """
-        Get all the schema and table names that this directory holds the backup for
+        Get all the schema and table names that this directory holds the backup for. When the backup has a manifest,
+        it also tells which backup ID or object holds the data of every relation (incremental and deduplicated
+        backups reference the data of unchanged tables from earlier backups)
         :return: list of all relation that it has the backup
         """
-
-        cmd = "hdfs dfs -ls " + self.data_backup_dir + '/*'
-        output = run_cmd(cmd)
+        manifest_file = get_manifest_file(self.metadata_backup_dir, self.backup_id)
+        manifest = self.storage.read_if_exists(manifest_file)
+        if manifest is not None:
+            self.logger.debug("Reading the relations from the manifest \"{0}\"".format(manifest_file))
+            manifest = json.loads(manifest)
+            for table, entry in manifest['tables'].items():
+                self.data_locations[table] = get_table_data_directory(self.restore_base, self.from_dbname, entry)
+                self.data_sizes[table] = entry.get('bytes', entry['size'])
+                self.data_rows[table] = entry.get('rows')
+                self.data_compression[table] = entry.get('compression')
+                self.data_formats[table] = entry.get('format', 'text')
+                self.data_parents[table] = entry.get('parent')
+                self.data_slices[table] = entry.get('slices', 1)
+            self.missing_tables = manifest.get('failed', {})
+            return manifest['tables'].keys()
+
+        # Backups taken before manifests existed, find the relations from the directory tree
+        self.data_sizes = self.__get_data_sizes()
+        cmd = ['hdfs', 'dfs', '-ls', self.data_backup_dir + '/*']
         backup_object_list = []
-        for directory in output.split('\n'):
+
+        def read_directory(directory):
+            directory = directory.rstrip('\n')
 
             # Ignore blanks space and other unwanted output
             if (directory.startswith('Found') and directory.endswith('items')) or not directory.strip():
@@ -166,8 +346,57 @@ class HDBRestore:
                     schema + '.' + table
                 )
 
+        stream_cmd(cmd, read_directory, lines=True, timeout=self.command_timeout)
+
         return backup_object_list
 
+    def __check_missing_tables(self, selected_tables=None):
+        """
+        Report the tables the backup gave up on, recorded in its manifest. The restore fails unless errors are
+        ignored, then the other tables are restored.
+        :param selected_tables: tables the user wants to restore, None for all the tables
+        :return:
+        """
+        missing_tables = sorted([table for table in self.missing_tables
+                                 if selected_tables is None or table in selected_tables])
+        if not missing_tables:
+            return
+
+        for table in missing_tables:
+            self.logger.error("The backup {0} has no data for the table {1}, its backup failed: {2}".format(
+                self.backup_id, table, self.missing_tables[table]
+            ))
+            run_metrics.record_table(table, error=self.missing_tables[table])
+        if not self.ignore:
+            error_logger("The backup {0} is missing the data of {1} table(s): {2}. Use --ignore-error to restore "
+                         "the other tables".format(self.backup_id, len(missing_tables), ', '.join(missing_tables)))
+        self.logger.warn("skipping the {0} table(s) missing from the backup due to ignore option...".format(
+            len(missing_tables)
+        ))
+
+    def __get_data_sizes(self):
+        """
+        Get the size of the backup files of every relation in one HDFS call
+        :return: {relation: size in bytes}
+        """
+        sizes = {}
+
+        def read_size(line):
+            fields = line.split()
+
+            # Ignore blanks space and other unwanted output
+            if len(fields) < 2 or not fields[0].isdigit():
+                return
+
+            schema = '"' + fields[-1].split('/')[-2] + '"'
+            table = '"' + fields[-1].split('/')[-1] + '"'
+            sizes[schema + '.' + table] = long(fields[0])
+
+        stream_cmd(['hdfs', 'dfs', '-du', self.data_backup_dir + '/*'], read_size, lines=True,
+                   timeout=self.command_timeout)
+
+        return sizes
+
     def __read_user_list(self):
         """
         Read the file of user provided list to restore and obtain only the line that has
@@ -195,8 +424,9 @@ class HDBRestore:
         drop_schema = self.drop_schema_skeleton.format(self.ext_schema_name)
         create_schema = self.create_schema_skeleton.format(self.ext_schema_name)
 
-        # In case the previous hawqrestore schema was not cleaned up and user supplied force then drop it
-        if self.force:
+        # In case the previous hawqrestore schema was not cleaned up and user supplied force then drop it, an
+        # interrupted restore being resumed left it behind
+        if self.force or self.resume:
             self.logger.debug("Attempting to drop the schema \"{0}\"".format(
                 self.ext_schema_name
             ))
@@ -207,13 +437,32 @@ class HDBRestore:
         relation_list = self.__get_data_location()
 
         # Get the user provided restore list
+        user_restore_tables = None
         if self.user_list:
             user_restore_tables = self.__read_user_list()
+
+            # Partitions are not listed on their own, they are restored with their partitioned table
+            selected_tables = []
             for table in relation_list:
-                if table not in user_restore_tables:
+                if table in user_restore_tables or self.data_parents.get(table) in user_restore_tables:
+                    selected_tables.append(table)
+                else:
                     self.logger.debug("Removing the relation {0} from the data restore list, "
                                       "since its not part of user provided restore list".format(table))
-                    relation_list.remove(table)
+            relation_list = selected_tables
+
+        # The tables the backup gave up on have no data to restore
+        self.__check_missing_tables(user_restore_tables)
+
+        # Schedule the relations expected to take longer first, using the size of their backup files and the
+        # timings of previous restores of this database
+        history = load_history()
+        sizes = self.data_sizes
+        timings = history.get(self.to_dbname, {}).get('restore', {})
+        relation_list = order_by_expected_runtime(relation_list, sizes, timings)
+
+        if self.resume:
+            relation_list = self.__resume_tables(relation_list)
 
         # Total tables to restore
         total_tables = len(relation_list)
@@ -221,9 +470,6 @@ class HDBRestore:
             total_tables
         ))
 
-        # Ignore the client message ( like Notice ) on the psql prompt
-        self.cursor.execute("set client_min_messages = 'ERROR' ")
-
         # Create the schema
         try:
             self.logger.debug("Attempting to create the schema: \"{0}\"".format(
@@ -236,44 +482,197 @@ class HDBRestore:
                          "Try dropping/renaming the schema or use --force option".format(
                 self.ext_schema_name, self.to_dbname))
 
-        # Loop through the list to restore
-        for table in relation_list:
+        # Workers borrow their connections from the pool, the main connection goes back to it meanwhile
+        self.pool.release((self.conn, self.cursor))
 
-            # print table, relation_list
-            position_dump = relation_list.index(table) + 1
-            print_progress(
-                position_dump,
-                total_tables,
-                prefix='Restoring Table Data (current/total):',
-                suffix='Done',
-                bar_length=50
-            )
-            create, insert = ext_table_sql_generator(
-                self.create_external_table_skeleton,
-                self.insert_external_table_skeleton,
-                table,
-                self.ext_schema_name,
-                self.pxf_port,
-                self.data_backup_dir
-            )
-            try:
-                self.cursor.execute(create)
-                self.cursor.execute(insert)
-                self.conn.commit()
-            except DatabaseError, e:
-                error_logger(e)
+        # The slices of the tables dumped in slices are loaded concurrently, like they were dumped
+        work_items = get_work_items(relation_list, self.data_slices)
+
+        # Load the tables, a failed table does not stop the rest of the restore
+        self.progress = ProgressTracker('Restoring Table Data (current/total):',
+                                        dict([(table, sizes.get(table, 0)) for table in relation_list]))
+        failed_slices = run_parallel(
+            lambda worker_id, item: self.__load_table(item[0], item[1], sizes.get(item[0], 0)),
+            work_items,
+            self.jobs
+        )
+        self.progress.finish()
+        self.journal.flush()
+
+        self.logger.info("Restored {0} table(s), {1} rows, {2}".format(
+            self.progress.completed_tables, self.progress.rows, self.progress.summary()
+        ))
 
         # Drop the schema once done
         try:
+            self.conn, self.cursor = self.pool.acquire()
             self.logger.debug("Backup is done, drop the schema \"{0}\"".format(
                 self.ext_schema_name
             ))
             self.cursor.execute(drop_schema)
             self.conn.commit()
-            self.conn.close()
-        except DatabaseError, e:
+            self.pool.release((self.conn, self.cursor))
+            self.pool.close()
+        except Error, e:
             error_logger(e)
 
+        # Remember how long every relation took, future restores use it to schedule the relations
+        timings.update(self.table_timings)
+        history.setdefault(self.to_dbname, {})['restore'] = timings
+        save_history(history)
+
+        # The other slices of a table with a failed slice stay committed, the table is recorded as started and not
+        # finished so resuming the restore truncates it and loads it again
+        if failed_slices:
+            for (table, slice_index), error in failed_slices:
+                self.logger.error("Failed to restore the table {0}: {1}".format(table, error))
+                run_metrics.record_table(table, error=str(error))
+            partial_tables = sorted(set([table for (table, slice_index), error in failed_slices
+                                         if slice_index is not None and table in self.started_tables]))
+            for table in partial_tables:
+                self.logger.warn("The table {0} is partially loaded, some of its slices failed".format(table))
+            error_logger("Restore of {0} out of {1} table(s) failed on the database \"{2}\", resume the restore of "
+                         "the backup {3} to load them again".format(
+                            len(set([table for (table, slice_index), error in failed_slices])), total_tables,
+                            self.to_dbname, self.backup_id
+            ))
+
+    def __load_table(self, table, slice_index, size):
+        """
+        Load the data of one table, or of one slice of a table, through its readable external table, on a connection
+        borrowed from the pool. The table is recorded once all its slices are loaded.
+        :param table: table name (i.e in the format schema-name.table-name)
+        :param slice_index: slice to load, None to load the whole table
+        :param size: size of the backup files of the table in bytes
+        :return:
+        """
+        slices = self.data_slices.get(table, 1)
+
+        # Tables are read back in the format they were written in, backups taken before formats existed are text
+        data_format = self.data_formats.get(table, 'text')
+
+        # Compressed files are detected by PXF from their codec extension and decompressed while reading
+        if self.data_compression.get(table):
+            self.logger.debug("The data files of {0} are compressed with {1}".format(
+                table, self.data_compression[table]
+            ))
+
+        create, insert = ext_table_sql_generator(
+            self.create_external_table_skeleton,
+            self.insert_external_table_skeleton,
+            table,
+            self.ext_schema_name,
+            self.pxf_port,
+            self.data_locations.get(table, self.data_backup_dir),
+            slice_index=slice_index,
+            profile=DATA_FORMATS[data_format]['profile'],
+            format_clause=DATA_FORMATS[data_format]['import']
+        )
+        def load():
+            # A failed statement is rolled back when the connection goes back to the pool, together with the
+            # truncate and the external table, so a retry has nothing to clean up
+            start = time.time()
+            with self.pool.connection() as (conn, cursor):
+                if slice_index is None and table in self.in_flight_tables:
+                    cursor.execute(self.truncate_table_skeleton.format(table))
+                cursor.execute(create)
+                create_done = time.time()
+                cursor.execute(insert)
+                loaded_rows = cursor.rowcount
+                insert_done = time.time()
+                self.__table_started(table)
+                conn.commit()
+            return loaded_rows, create_done - start, insert_done - create_done, time.time() - insert_done
+
+        slice_done = run_with_retries(load, self.retries, self.retry_delay,
+                                      description='Restore of the table {0}'.format(table))
+
+        # Wait for the last slice of the table
+        self.lock.acquire()
+        try:
+            done = self.slices_done.setdefault(table, [])
+            done.append(slice_done)
+            if len(done) < slices:
+                return
+        finally:
+            self.lock.release()
+
+        # The time spent on all the slices, which is the time of the table when it is not split
+        duration = sum([create + insert + commit for slice_rows, create, insert, commit in done])
+        self.table_timings[table] = [duration, size]
+        loaded_rows = None
+        if min([slice_done[0] for slice_done in done]) >= 0:
+            loaded_rows = sum([slice_done[0] for slice_done in done])
+        self.journal.table_done(table, {'rows': loaded_rows, 'duration': duration})
+        self.progress.table_done(table, loaded_rows, size)
+        run_metrics.record_table(table, create=sum([slice_done[1] for slice_done in done]),
+                                 insert=sum([slice_done[2] for slice_done in done]),
+                                 commit=sum([slice_done[3] for slice_done in done]), rows=loaded_rows, bytes=size)
+
+        if None not in (self.data_rows.get(table), loaded_rows) and loaded_rows != self.data_rows[table]:
+            self.logger.warn("Restored {0} rows into {1} but the backup recorded {2} rows".format(
+                loaded_rows, table, self.data_rows[table]
+            ))
+
+    def __resume_tables(self, relation_list):
+        """
+        Skip the tables loaded by the interrupted restore. The tables it started are truncated before being loaded:
+        a table committed after the last write of the journal would otherwise get its rows twice.
+        :param relation_list: tables to restore
+        :return: tables left to restore
+        """
+        done_tables = self.journal.tables()
+        relation_list = [table for table in relation_list if table not in done_tables]
+
+        # Only the tables the interrupted restore may have committed rows into are truncated, the tables it did not
+        # get to keep their rows (i.e a data only restore into existing tables)
+        self.in_flight_tables = set(self.journal.started_tables(relation_list))
+        self.started_tables = set(self.in_flight_tables)
+
+        # The slices of a table are loaded by several transactions, the table is truncated once beforehand
+        for table in relation_list:
+            if table in self.in_flight_tables and self.data_slices.get(table, 1) > 1:
+                self.logger.info("Truncating the table {0}, the interrupted restore loaded part of it".format(table))
+                self.cursor.execute(self.truncate_table_skeleton.format(table))
+        self.conn.commit()
+        return relation_list
+
+    def __table_started(self, table):
+        """
+        Record in the journal that rows of a table are about to be committed, before the first of them is
+        :param table: table name
+        :return:
+        """
+        self.lock.acquire()
+        try:
+            if table not in self.started_tables:
+                self.journal.table_started(table)
+                self.started_tables.add(table)
+        finally:
+            self.lock.release()
+
+    def __prepare_journal(self):
+        """
+        Start the journal of this restore, or read back the journal of the interrupted restore to resume
+        :return:
+        """
+        self.journal = CheckpointJournal(
+            self.storage, get_restore_journal_file(self.metadata_backup_dir, self.backup_id, self.to_dbname)
+        )
+        if not self.resume:
+            # Replace the journal of any previous restore of this backup into this database
+            self.journal.clear_started()
+            self.journal.set_options({'database': self.from_dbname})
+            self.journal.flush()
+            return
+
+        if not self.journal.load():
+            error_logger("Cannot find the journal of a restore of the backup {0} into the database \"{1}\", "
+                         "it cannot be resumed".format(self.backup_id, self.to_dbname))
+        self.logger.info("Resuming the restore of the backup {0}, {1} table(s) were already loaded".format(
+            self.backup_id, len(self.journal.tables())
+        ))
+
     def print_display_info(self):
         """
         This prints all the restore parameters on the screen or on the logs
@@ -314,6 +713,9 @@ class HDBRestore:
         self.logger.info("Force: {0}".format(self.force))
         self.logger.info("External Table Schema Name: {0}".format(self.ext_schema_name))
         self.logger.info("PXF Port: {0}".format(self.pxf_port))
+        self.logger.info("Parallel Jobs: {0}".format(self.jobs))
+        self.logger.info("Resume Restore: {0}".format(self.resume))
+        self.logger.info("Retries Per Table: {0}".format(self.retries))
         self.logger.info("*******************************************************************************************")
 
         # Ask for confirmation
@@ -330,14 +732,26 @@ class HDBRestore:
         self.port = options_namespace.port
         self.password = options_namespace.password
         self.force = options_namespace.force
+        self.no_prompt = options_namespace.yes
         self.global_restore = options_namespace.include_roles
         self.schema_only = options_namespace.schema_only
         self.data_only = options_namespace.data_only
-        self.backup_id = options_namespace.backup_id
+        self.backup_id = str(options_namespace.backup_id)
         self.to_dbname = options_namespace.target_database
         self.ignore = options_namespace.ignore_error
         self.generate_list = options_namespace.output_to_file
         self.user_list = options_namespace.input_file
+        self.generate_list_location = '/tmp/backup_list_' + self.backup_id
+        self.jobs = options_namespace.jobs
+        self.hdfs_namenode = options_namespace.hdfs_namenode
+        self.hdfs_port = options_namespace.hdfs_port
+        self.hdfs_chunk_size = options_namespace.hdfs_chunk_size
+        self.hdfs_replication = options_namespace.hdfs_replication
+        self.command_timeout = options_namespace.command_timeout
+        self.metrics_dir = options_namespace.metrics_dir
+        self.resume = options_namespace.resume
+        self.retries = options_namespace.retries
+        self.retry_delay = options_namespace.retry_delay
 
         """
         Attributes to options map (excluded when attribute name = option name
@@ -350,6 +764,28 @@ class HDBRestore:
         """
 
     def run_restore(self):
+        """
+        Run the restore, and export the metrics of the run if requested, even if the restore failed
+        :return:
+        """
+        status = 'failed'
+        try:
+            self.__run_restore()
+            status = 'success'
+        finally:
+            if self.metrics_dir:
+                run_metrics.set_labels(command='restore', database=self.to_dbname or self.from_dbname,
+                                       backup_id=self.backup_id)
+                run_metrics.write(self.metrics_dir, status)
+
+    def __connect_storage(self):
+        """
+        Prepare the access to HDFS
+        :return:
+        """
+        self.storage = HdfsStorage(self.hdfs_namenode, self.hdfs_port, self.hdfs_chunk_size, self.hdfs_replication)
+
+    def __run_restore(self):
         """
         Run the restore steps.
         :return:
@@ -358,9 +794,10 @@ class HDBRestore:
         # Start time
         self.logger.info("Starting Restore at: {0}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
 
-        # Check for all executable and environment before running backup commands
+        # Check for all executable and environment before running backup commands, concurrently with the checks of
+        # the database and HDFS below
         self.logger.info("Checking for all the executables that is needed by the program")
-        check_executables()
+        wait_executables = start_background(check_executables, 'hdb-executables')
 
         # Check if backup key is provided
         if not self.backup_id:
@@ -373,9 +810,25 @@ class HDBRestore:
             ))
             self.to_dbname = self.from_dbname
 
-        # Prepare and check connection to the database.
-        self.logger.info("Checking the database connectivity")
-        self.conn, self.cursor = set_connection(self.to_dbname, self.host, self.port, self.username, self.password)
+        with run_metrics.phase('preflight'):
+            # Prepare the access to HDFS
+            self.logger.info("Checking the HDFS connectivity")
+            wait_storage = start_background(self.__connect_storage, 'hdb-storage')
+
+            # Prepare and check connection to the database.
+            self.logger.info("Checking the database connectivity")
+            # The main connection is the first one of the pool shared with the workers
+            self.pool = ConnectionPool(self.to_dbname, self.host, self.port, self.username, self.password, self.jobs,
+                                       ["set client_min_messages = 'ERROR'"])
+            try:
+                self.conn, self.cursor = self.pool.acquire()
+            except Error, e:
+                error_logger(e)
+
+            for wait in (wait_executables, wait_storage):
+                error = wait()
+                if error is not None:
+                    error_logger(error)
 
         # Prepare the folder and get location where the backup is stored.
         self.logger.info("Preparing to get all the directories where the backup is stored")
@@ -385,15 +838,22 @@ class HDBRestore:
         # Display the restore information
         self.print_display_info()
 
+        # The generated list is all a list restore does, there is nothing to resume
+        if not self.generate_list:
+            self.__prepare_journal()
+
         # Unless explicitly requested not to restore metadata, restore the metadata of objects
-        if not self.data_only:
+        if not self.data_only and not (self.journal and self.journal.is_step_done('metadata')):
             self.logger.info("Restoring the DDL")
-            self.__restore_metadata()
+            with run_metrics.phase('metadata'):
+                self.__restore_metadata()
+            self.journal.step_done('metadata')
 
         # Unless explicitly requested not to restore data, restore the data of the objects.
         if not self.schema_only:
             self.logger.info("Restoring the data")
-            self.__restore_data()
+            with run_metrics.phase('data'):
+                self.__restore_data()
 
         # End completion message & time
         self.logger.info("Restore of the database \"{0}\" and of the restore type \"{1}\" has completed".format(
@@ -0,0 +1,273 @@
+import logging
+
+from lib import error_logger, run_cmd, stream_cmd, start_process
+from metrics import timed
+
+# The native client is optional, without it we fall back to the hdfs command line
+try:
+    from hdfs3 import HDFileSystem
+except ImportError:
+    HDFileSystem = None
+
+
+class HdfsStorage:
+    """
+    Access to the backup files stored in HDFS. The native hdfs3 client talks to the NameNode directly, which saves the
+    JVM startup of every "hdfs dfs" call and lets us stream the output of pg_dump straight into an HDFS file.
+    """
+
+    logger = logging.getLogger("hdb_logger")
+
+    def __init__(self, namenode=None, port=None, chunk_size=4 * 1024 * 1024, replication=0):
+        """
+        Create a HdfsStorage object..
+        :param namenode: NameNode host, the Hadoop configuration is used if not provided
+        :param port: NameNode port
+        :param chunk_size: size of the buffer used to stream files from/to HDFS
+        :param replication: replication of the files written, 0 uses the cluster default
+        """
+        self.namenode = namenode
+        self.port = port
+        self.chunk_size = chunk_size
+        self.replication = replication
+        self.hdfs = None
+
+        if HDFileSystem is None:
+            self.logger.debug("hdfs3 module not found, using the hdfs command line to access HDFS")
+            return
+
+        kwargs = {}
+        if namenode:
+            kwargs['host'] = namenode
+        if port:
+            kwargs['port'] = port
+
+        self.logger.debug("Connecting to HDFS using the native client")
+        try:
+            self.hdfs = HDFileSystem(**kwargs)
+        except Exception, e:
+            error_logger(e)
+
+    def __dfs_cmd(self, *args):
+        """
+        Build a "hdfs dfs" command, used when the native client is not available
+        :param args: dfs sub command and its arguments
+        :return: list of the program and its arguments
+        """
+        if self.replication:
+            return ['hdfs', 'dfs', '-D', 'dfs.replication={0}'.format(self.replication)] + list(args)
+        return ['hdfs', 'dfs'] + list(args)
+
+    @timed('hdfs')
+    def exists(self, path):
+        """
+        Check if a file or directory exists
+        :param path: HDFS path
+        :return: True if the path exists
+        """
+        self.logger.debug("Checking if \"{0}\" exists on HDFS".format(path))
+        if self.hdfs:
+            return self.hdfs.exists(path)
+        return start_process(self.__dfs_cmd('-test', '-e', path)).wait() == 0
+
+    @timed('hdfs')
+    def read(self, path):
+        """
+        Read a whole (small) file
+        :param path: HDFS path
+        :return: Content of the file
+        """
+        if self.hdfs:
+            return self.hdfs.cat(path)
+        return run_cmd(self.__dfs_cmd('-cat', path))
+
+    def read_if_exists(self, path):
+        """
+        Read a whole (small) file if it exists, with a single call when the native client is available
+        :param path: HDFS path
+        :return: Content of the file, None if the file does not exist
+        """
+        if self.hdfs:
+            try:
+                return self.read(path)
+            except IOError:
+                return None
+
+        if not self.exists(path):
+            return None
+        return self.read(path)
+
+    @timed('hdfs')
+    def list_files(self, path):
+        """
+        List the files of a directory
+        :param path: HDFS path of the directory
+        :return: list of (file path, size in bytes)
+        """
+        if self.hdfs:
+            return [(entry['name'], entry['size']) for entry in self.hdfs.ls(path, detail=True)
+                    if entry['kind'] == 'file']
+
+        files = []
+
+        def read_entry(line):
+            fields = line.split()
+
+            # Only files, skip the "Found n items" header and the directories
+            if len(fields) < 8 or not line.startswith('-'):
+                return
+            files.append((fields[-1], long(fields[4])))
+
+        stream_cmd(self.__dfs_cmd('-ls', path), read_entry, lines=True)
+        return files
+
+    @timed('hdfs')
+    def list_directories(self, path):
+        """
+        List the sub directories of a directory
+        :param path: HDFS path of the directory
+        :return: list of directory paths, empty if the directory does not exist
+        """
+        if not self.exists(path):
+            return []
+        if self.hdfs:
+            return [entry['name'] for entry in self.hdfs.ls(path, detail=True) if entry['kind'] == 'directory']
+
+        directories = []
+
+        def read_entry(line):
+            fields = line.split()
+            if len(fields) >= 8 and line.startswith('d'):
+                directories.append(fields[-1])
+
+        stream_cmd(self.__dfs_cmd('-ls', path), read_entry, lines=True)
+        return directories
+
+    @timed('hdfs')
+    def rename(self, path, new_path):
+        """
+        Rename a file or a directory, the new path must not exist
+        :param path: HDFS path
+        :param new_path: new HDFS path
+        :return:
+        """
+        self.logger.debug("Renaming \"{0}\" to \"{1}\" on HDFS".format(path, new_path))
+        if self.hdfs:
+            self.hdfs.mv(path, new_path)
+            return
+        run_cmd(self.__dfs_cmd('-mv', path, new_path))
+
+    @timed('hdfs')
+    def delete(self, path):
+        """
+        Delete a file or a directory with all its content, if it exists
+        :param path: HDFS path
+        :return:
+        """
+        self.logger.debug("Deleting \"{0}\" from HDFS".format(path))
+        if self.hdfs:
+            if self.hdfs.exists(path):
+                self.hdfs.rm(path, recursive=True)
+            return
+        run_cmd(self.__dfs_cmd('-rm', '-r', '-f', '-skipTrash', path))
+
+    @timed('hdfs')
+    def download(self, path, local_path):
+        """
+        Copy a file to the local filesystem
+        :param path: HDFS path
+        :param local_path: local path, must not exist
+        :return:
+        """
+        self.logger.debug("Downloading \"{0}\" from HDFS to \"{1}\"".format(path, local_path))
+        if self.hdfs:
+            self.hdfs.get(path, local_path)
+            return
+        run_cmd(self.__dfs_cmd('-get', path, local_path))
+
+    @timed('hdfs')
+    def free_space(self):
+        """
+        Space left on HDFS, before replication
+        :return: (remaining bytes, capacity in bytes)
+        """
+        if self.hdfs:
+            # hdfs3 only reports the capacity and the space used
+            usage = self.hdfs.df()
+            return usage['capacity'] - usage['used'], usage['capacity']
+
+        usage = []
+
+        def read_entry(line):
+            fields = line.split()
+
+            # Skip the "Filesystem Size Used Available Use%" header
+            if len(fields) >= 4 and fields[1].isdigit():
+                usage.append((long(fields[3]), long(fields[1])))
+
+        stream_cmd(self.__dfs_cmd('-df', '/'), read_entry, lines=True)
+        return usage[0]
+
+    @timed('hdfs')
+    def write(self, path, content):
+        """
+        Write a (small) file, replacing it if it already exists
+        :param path: HDFS path
+        :param content: Content of the file
+        :return:
+        """
+        if self.hdfs:
+            hdfs_file = self.hdfs.open(path, 'wb', replication=self.replication)
+            try:
+                hdfs_file.write(content)
+            finally:
+                hdfs_file.close()
+        else:
+            run_cmd(self.__dfs_cmd('-put', '-f', '-', path), input_data=content)
+
+    @timed('hdfs')
+    def upload_from_cmd(self, path, cmd, timeout=None):
+        """
+        Stream the standard output of a command into an HDFS file, chunk by chunk
+        :param path: HDFS path
+        :param cmd: command to be executed, command line or list of the program and its arguments
+        :param timeout: seconds after which the command is killed and considered failed
+        :return:
+        """
+        if not self.hdfs:
+            stream_cmd(cmd, timeout=timeout, pipe_to=self.__dfs_cmd('-put', '-f', '-', path))
+            return
+
+        hdfs_file = self.hdfs.open(path, 'wb', replication=self.replication)
+        try:
+            stream_cmd(cmd, hdfs_file.write, timeout=timeout, chunk_size=self.chunk_size)
+        finally:
+            hdfs_file.close()
+
+    @timed('hdfs')
+    def download_to_cmd(self, path, cmd, ignore_error=None, stdout_consumer=None, timeout=None):
+        """
+        Stream an HDFS file into the standard input of a command, chunk by chunk
+        :param path: HDFS path
+        :param cmd: command to be executed, command line or list of the program and its arguments
+        :param ignore_error: Ignore any error if found
+        :param stdout_consumer: callable receiving the standard output of the command line by line
+        :param timeout: seconds after which the command is killed and considered failed
+        :return:
+        """
+        if not self.hdfs:
+            stream_cmd(self.__dfs_cmd('-cat', path), stdout_consumer, lines=True, timeout=timeout,
+                       ignore_error=ignore_error, pipe_to=cmd)
+            return
+
+        def produce(stdin):
+            hdfs_file = self.hdfs.open(path, 'rb')
+            try:
+                chunk = hdfs_file.read(self.chunk_size)
+                while chunk:
+                    stdin.write(chunk)
+                    chunk = hdfs_file.read(self.chunk_size)
+            finally:
+                hdfs_file.close()
+
+        stream_cmd(cmd, stdout_consumer, produce, lines=True, timeout=timeout, ignore_error=ignore_error)
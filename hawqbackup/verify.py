@@ -0,0 +1,244 @@
+import datetime
+import json
+import logging
+
+from pgdb import DatabaseError, Error
+
+from lib import error_logger, ConnectionPool, get_directory, get_manifest_file, get_table_data_directory, \
+    ext_table_sql_generator, run_parallel, order_by_expected_runtime, DATA_FORMATS
+from storage import HdfsStorage
+from progress import ProgressTracker
+from metrics import run_metrics
+
+
+class HdbVerify:
+    """
+    Verification of a backup against the tables of the database. Every table and its backup files, read through
+    readable external tables, are compared by row count and by an order independent hash of their rows.
+    """
+
+    logger = logging.getLogger("hdb_logger")
+
+    def __init__(self):
+        """
+        Create a HdbVerify object..
+        """
+        # Connection parameters
+        self.conn = None
+        self.cursor = None
+        self.username = 'gpadmin'
+        self.host = 'localhost'
+        self.port = 5432
+        self.password = None
+        self.dbname = 'postgres'
+        self.pxf_port = 51200
+
+        # Verify Parameters
+        self.backup_id = None
+        self.force = False
+        self.backup_base = "/hawq_backup"
+        self.ext_schema_name = 'hawqverify_schema'
+        self.jobs = 1
+        self.results = {}
+        self.missing_tables = {}
+        self.progress = None
+        self.storage = None
+        self.pool = None
+        self.hdfs_namenode = None
+        self.hdfs_port = None
+        self.hdfs_chunk_size = 4 * 1024 * 1024
+        self.hdfs_replication = 0
+        self.metrics_dir = None
+
+        # Query Skeleton for verify
+        self.drop_schema_skeleton = """ DROP SCHEMA IF EXISTS {0} CASCADE """
+        self.create_schema_skeleton = """ CREATE SCHEMA {0} """
+        self.create_external_table_skeleton = """ CREATE EXTERNAL TABLE {0}.{1} ( like {2} )
+                                              LOCATION ('pxf://localhost:{3}{4}/{5}/{6}?profile={8}{7}')
+                                              {9} """
+
+        # The sum of the hashes of the text representation of every row does not depend on the order of the rows
+        self.table_checksum_skeleton = """ SELECT COUNT(*),
+                                                  COALESCE(SUM(hashtext(textin(record_out(t)))::bigint), 0)
+                                           FROM {2} t """
+        self.backup_checksum_skeleton = """ SELECT COUNT(*),
+                                                   COALESCE(SUM(hashtext(textin(record_out(t)))::bigint), 0)
+                                            FROM {0}.{1} t """
+
+    def __read_manifest(self):
+        """
+        Read the tables recorded by the backup, the tables the backup gave up are kept to be reported as failed
+        :return: {table: manifest entry of the table}
+        """
+        metadata_dir = get_directory(self.backup_base, self.backup_id, self.dbname)[0]
+        manifest_file = get_manifest_file(metadata_dir, self.backup_id)
+        manifest = self.storage.read_if_exists(manifest_file)
+        if manifest is None:
+            error_logger("Cannot find the manifest \"{0}\" of the backup {1}, only backups that include data and "
+                         "have a manifest can be verified".format(manifest_file, self.backup_id))
+
+        manifest = json.loads(manifest)
+        self.missing_tables = manifest.get('failed', {})
+        return manifest['tables']
+
+    def __verify_table(self, table, entry):
+        """
+        Compare a table with its backup, on a connection borrowed from the pool. The external tables are not
+        committed, they go away when the connection goes back to the pool.
+        :param table: table name (i.e in the format schema-name.table-name)
+        :param entry: manifest entry of the table
+        :return:
+        """
+        data_dir = get_table_data_directory(self.backup_base, self.dbname, entry)
+        data_format = DATA_FORMATS[entry.get('format', 'text')]
+        slices = entry.get('slices', 1)
+        slice_indexes = [None]
+        if slices > 1:
+            slice_indexes = range(slices)
+
+        with self.pool.connection() as (conn, cursor):
+            table_query = ext_table_sql_generator(self.create_external_table_skeleton, self.table_checksum_skeleton,
+                                                  table, self.ext_schema_name, self.pxf_port, data_dir)[1]
+            cursor.execute(table_query)
+            table_rows, table_hash = cursor.fetchone()
+
+            # The hashes of the slices add up to the hash of the table
+            backup_rows, backup_hash = 0, 0
+            for slice_index in slice_indexes:
+                create, backup_query = ext_table_sql_generator(
+                    self.create_external_table_skeleton,
+                    self.backup_checksum_skeleton,
+                    table,
+                    self.ext_schema_name,
+                    self.pxf_port,
+                    data_dir,
+                    slice_index=slice_index,
+                    profile=data_format['profile'],
+                    format_clause=data_format['import']
+                )
+                cursor.execute(create)
+                cursor.execute(backup_query)
+                rows, row_hash = cursor.fetchone()
+                backup_rows += rows
+                backup_hash += row_hash
+
+        self.results[table] = {
+            'table_rows': table_rows,
+            'backup_rows': backup_rows,
+            'passed': table_rows == backup_rows and table_hash == backup_hash
+        }
+        self.progress.table_done(table, table_rows)
+
+    def __report(self, failed_tables):
+        """
+        Print the result of every table and exit with an error if any table failed
+        :param failed_tables: list of (table, error) of the tables that could not be verified
+        :return:
+        """
+        failed_tables = [(table, "missing from the backup, it failed with: {0}".format(error))
+                         for table, error in sorted(self.missing_tables.items())] + list(failed_tables)
+        for table in sorted(self.results):
+            result = self.results[table]
+            self.logger.info("{0} {1}: {2} rows in the table, {3} rows in the backup".format(
+                result['passed'] and 'PASS' or 'FAIL', table, result['table_rows'], result['backup_rows']
+            ))
+        for table, error in failed_tables:
+            self.logger.error("ERROR {0}: {1}".format(table, error))
+
+        mismatches = len([result for result in self.results.values() if not result['passed']])
+        self.logger.info("Verified {0} table(s): {1} passed, {2} failed, {3} could not be verified".format(
+            len(self.results) + len(failed_tables), len(self.results) - mismatches, mismatches, len(failed_tables)
+        ))
+        if mismatches or failed_tables:
+            error_logger("The backup {0} of the database \"{1}\" does not match the database".format(
+                self.backup_id, self.dbname
+            ))
+
+    def run_verify(self):
+        """
+        Run the verification, and export the metrics of the run if requested, even if the verification failed
+        :return:
+        """
+        run_metrics.set_labels(command='verify', database=self.dbname)
+        status = 'failed'
+        try:
+            self.__run_verify()
+            status = 'success'
+        finally:
+            if self.metrics_dir:
+                run_metrics.set_labels(backup_id=self.backup_id)
+                run_metrics.write(self.metrics_dir, status)
+
+    def __run_verify(self):
+        """
+        Run the verification steps
+        :return:
+        """
+        self.logger.info("Starting Verify at: {0}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        drop_schema = self.drop_schema_skeleton.format(self.ext_schema_name)
+
+        with run_metrics.phase('preflight'):
+            self.logger.info("Checking the database connectivity")
+            self.pool = ConnectionPool(self.dbname, self.host, self.port, self.username, self.password, self.jobs,
+                                       ["set client_min_messages = 'ERROR'"])
+            try:
+                self.conn, self.cursor = self.pool.acquire()
+            except Error, e:
+                error_logger(e)
+
+            self.logger.info("Checking the HDFS connectivity")
+            self.storage = HdfsStorage(self.hdfs_namenode, self.hdfs_port, self.hdfs_chunk_size,
+                                       self.hdfs_replication)
+
+        tables = self.__read_manifest()
+        sizes = dict([(table, entry.get('bytes', entry.get('size')) or 0) for table, entry in tables.items()])
+        ordered_tables = order_by_expected_runtime(tables.keys(), sizes, {})
+
+        if self.force:
+            self.cursor.execute(drop_schema)
+            self.conn.commit()
+        try:
+            self.cursor.execute(self.create_schema_skeleton.format(self.ext_schema_name))
+            self.conn.commit()
+        except DatabaseError:
+            error_logger("Found schema \"{0}\" already exits on the database \"{1}\", "
+                         "Try dropping/renaming the schema or use --force option".format(
+                            self.ext_schema_name, self.dbname
+            ))
+        self.pool.release((self.conn, self.cursor))
+
+        with run_metrics.phase('verify'):
+            self.progress = ProgressTracker('Verifying Table Data (current/total):', sizes)
+            failed_tables = run_parallel(
+                lambda worker_id, table: self.__verify_table(table, tables[table]),
+                ordered_tables,
+                self.jobs
+            )
+            self.progress.finish()
+
+        try:
+            self.conn, self.cursor = self.pool.acquire()
+            self.cursor.execute(drop_schema)
+            self.conn.commit()
+            self.pool.release((self.conn, self.cursor))
+            self.pool.close()
+        except Error, e:
+            error_logger(e)
+
+        self.__report(failed_tables)
+        self.logger.info("Verify finished at: {0}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+    def set_vars(self, options_namespace):
+        self.dbname = options_namespace.database
+        self.username = options_namespace.username
+        self.host = options_namespace.host
+        self.port = options_namespace.port
+        self.password = options_namespace.password
+        self.force = options_namespace.force
+        self.backup_id = str(options_namespace.backup_id)
+        self.jobs = options_namespace.jobs
+        self.hdfs_namenode = options_namespace.hdfs_namenode
+        self.hdfs_port = options_namespace.hdfs_port
+        self.hdfs_chunk_size = options_namespace.hdfs_chunk_size
+        self.hdfs_replication = options_namespace.hdfs_replication
+        self.metrics_dir = options_namespace.metrics_dir
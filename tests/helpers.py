@@ -0,0 +1,131 @@
+import logging
+import unittest
+from contextlib import contextmanager
+
+
+def squeeze(query):
+    return ' '.join(query.split())
+
+
+class MemoryStorage:
+    """
+    HDFS stand-in keeping the content of the files by path, the directories are the prefixes of the paths
+    """
+
+    def __init__(self, files=None, space=(0, 0)):
+        if files is None:
+            files = {}
+        self.files = files
+        self.space = space
+        self.writes = 0
+        self.deleted = []
+
+    def __children(self, path):
+        """
+        :return: {path of a child: True if the child is a directory}
+        """
+        children = {}
+        for name in self.files:
+            if name.startswith(path + '/'):
+                child = name[len(path) + 1:].split('/')
+                children[path + '/' + child[0]] = len(child) > 1 or children.get(path + '/' + child[0], False)
+        return children
+
+    def exists(self, path):
+        return path in self.files or bool(self.__children(path))
+
+    def read(self, path):
+        return self.files[path]
+
+    def read_if_exists(self, path):
+        return self.files.get(path)
+
+    def write(self, path, content):
+        self.files[path] = content
+        self.writes += 1
+
+    def list_files(self, path):
+        return sorted([(child, len(self.files[child])) for child, is_dir in self.__children(path).items()
+                       if not is_dir])
+
+    def list_directories(self, path):
+        return sorted([child for child, is_dir in self.__children(path).items() if is_dir])
+
+    def delete(self, path):
+        self.deleted.append(path)
+        for name in list(self.files):
+            if name == path or name.startswith(path + '/'):
+                del self.files[name]
+
+    def free_space(self):
+        return self.space
+
+
+class FakeCursor:
+    """
+    Cursor recording the queries it runs, squeezed on one line, and answering them with the same rows
+    """
+
+    def __init__(self, rows=None):
+        self.rows = rows or []
+        self.queries = []
+        self.rowcount = 10
+
+    def execute(self, query):
+        self.queries.append(squeeze(query))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0]
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakePool:
+
+    def __init__(self, cursor, conn=None):
+        self.cursor = cursor
+        self.conn = conn or FakeConnection()
+
+    @contextmanager
+    def connection(self):
+        yield self.conn, self.cursor
+
+
+class LogRecorder(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelname, record.getMessage()))
+
+
+class LoggingTestCase(unittest.TestCase):
+    """
+    Test case recording the messages of the hdb_logger logger
+    """
+
+    def setUp(self):
+        self.logger = logging.getLogger("hdb_logger")
+        self.level = self.logger.level
+        self.recorder = LogRecorder()
+        self.logger.addHandler(self.recorder)
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.recorder)
+        self.logger.setLevel(self.level)
+
+    def messages(self, level=None):
+        return [message for record_level, message in self.recorder.messages if level in (None, record_level)]
@@ -0,0 +1,369 @@
+import json
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+import hawqbackup.backup
+import hawqbackup.catalog
+import hawqbackup.lib
+import hawqbackup.main
+import hawqbackup.metrics
+import hawqbackup.restore
+import hawqbackup.storage
+from tests.helpers import FakeCursor, LoggingTestCase, MemoryStorage, squeeze
+
+
+class BackupTestCase(LoggingTestCase):
+
+    def setUp(self):
+        LoggingTestCase.setUp(self)
+        self.backup = hawqbackup.backup.HdbBackup()
+        self.backup.dbname = 'sales'
+
+
+class TestPlan(BackupTestCase):
+
+    def setUp(self):
+        BackupTestCase.setUp(self)
+        self.backup.jobs = 2
+        self.backup.hdfs_replication = 2
+        self.backup.table_slices = {'"public"."big"': 2, '"public"."small"': 1}
+        self.tables = ['"public"."big"', '"public"."small"']
+        self.work_items = [('"public"."big"', 0), ('"public"."big"', 1), ('"public"."small"', None)]
+        self.sizes = {'"public"."big"': 4000, '"public"."small"': 1000}
+
+    def test_duration_from_the_throughput_of_previous_backups(self):
+        self.backup.storage = MemoryStorage(space=(100000, 200000))
+        timings = {'"public"."big"': [40, 4000], '"public"."small"': [10, 1000]}
+        self.backup._HdbBackup__print_plan(self.tables, self.work_items, self.sizes, timings)
+
+        # Two slices of 20s and the small table of 10s on two jobs
+        self.assertTrue('Estimated Duration With 2 Job(s): 00:00:30' in self.messages(), self.messages())
+        self.assertTrue('"public"."big": 3.9KB, 00:00:40, 2 slice(s)' in self.messages(), self.messages())
+        self.assertEqual(self.messages('WARNING'), [])
+
+    def test_backup_not_fitting_on_hdfs(self):
+        self.backup.storage = MemoryStorage(space=(9000, 200000))
+        self.backup._HdbBackup__print_plan(self.tables, self.work_items, self.sizes, {})
+        self.assertTrue([message for message in self.messages() if message.startswith('Estimated Duration: unknown')])
+        self.assertEqual(self.messages('WARNING'), ['The backup does not fit in the space left on HDFS'])
+
+    def test_free_space_of_the_native_client(self):
+        class FakeHdfs:
+            def df(self):
+                return {'capacity': 1000, 'used': 300, 'percent-free': 70}
+
+        native_client = hawqbackup.storage.HDFileSystem
+        hawqbackup.storage.HDFileSystem = None
+        try:
+            storage = hawqbackup.storage.HdfsStorage()
+        finally:
+            hawqbackup.storage.HDFileSystem = native_client
+        storage.hdfs = FakeHdfs()
+        self.assertEqual(storage.free_space(), (700, 1000))
+
+
+class TestHdfsCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        # A stand-in of the hdfs command line failing to write when asked to
+        self.bin_dir = tempfile.mkdtemp()
+        hdfs = open(self.bin_dir + '/hdfs', 'w')
+        hdfs.write('#!/bin/sh\ncat > "$HDFS_OUTPUT"\nexit "$HDFS_STATUS"\n')
+        hdfs.close()
+        os.chmod(self.bin_dir + '/hdfs', 0700)
+        hawqbackup.lib._resolved.clear()
+        hawqbackup.lib._resolved['env'] = dict(os.environ, PATH=self.bin_dir + os.pathsep + os.environ['PATH'],
+                                               HDFS_OUTPUT=self.bin_dir + '/written', HDFS_STATUS='0')
+
+        native_client = hawqbackup.storage.HDFileSystem
+        hawqbackup.storage.HDFileSystem = None
+        try:
+            self.storage = hawqbackup.storage.HdfsStorage()
+        finally:
+            hawqbackup.storage.HDFileSystem = native_client
+
+    def tearDown(self):
+        hawqbackup.lib._resolved.clear()
+        shutil.rmtree(self.bin_dir)
+
+    def test_upload_through_the_command_line(self):
+        self.storage.upload_from_cmd('/backup/file', ['echo', 'some data'])
+        self.assertEqual(open(self.bin_dir + '/written').read(), 'some data\n')
+
+    def test_failed_upload_fails_the_dump(self):
+        hawqbackup.lib._resolved['env']['HDFS_STATUS'] = '1'
+        self.assertRaises(SystemExit, self.storage.upload_from_cmd, '/backup/file', ['echo', 'some data'])
+
+    def test_command_line_counted_as_an_hdfs_call_only(self):
+        timers = hawqbackup.metrics.run_metrics.timers
+        calls = dict([(timer, timers.get(timer, {}).get('calls', 0)) for timer in ['hdfs', 'subprocess']])
+        self.storage.upload_from_cmd('/backup/file', ['echo', 'some data'])
+        self.assertEqual(timers['hdfs']['calls'], calls['hdfs'] + 1)
+        self.assertEqual(timers.get('subprocess', {}).get('calls', 0), calls['subprocess'])
+
+
+class TestExternalTables(unittest.TestCase):
+
+    def setUp(self):
+        self.backup = hawqbackup.backup.HdbBackup()
+        self.restore = hawqbackup.restore.HDBRestore()
+        self.text = hawqbackup.lib.DATA_FORMATS['text']
+
+    def test_writable_table_with_compression(self):
+        create, insert = hawqbackup.lib.ext_table_sql_generator(
+            self.backup.create_external_table_skeleton, self.backup.insert_external_table_skeleton,
+            '"public"."sales"', 'hawqbackup_schema', 51200, '/hawq_backup/20161003/db/data',
+            '&COMPRESSION_CODEC=' + hawqbackup.lib.COMPRESSION_CODECS['gzip'], None,
+            self.text['profile'], self.text['export']
+        )
+        self.assertEqual(squeeze(create),
+                         'CREATE WRITABLE EXTERNAL TABLE hawqbackup_schema."public_sales" ( like "public"."sales" ) '
+                         "LOCATION ('pxf://localhost:51200/hawq_backup/20161003/db/data/public/sales"
+                         "?profile=HdfsTextSimple&COMPRESSION_CODEC=org.apache.hadoop.io.compress.GzipCodec') "
+                         "FORMAT 'TEXT' (DELIMITER = E'\\t')")
+        self.assertEqual(squeeze(insert),
+                         'INSERT INTO hawqbackup_schema."public_sales" SELECT * FROM "public"."sales"')
+
+    def test_readable_table_of_a_slice(self):
+        create, insert = hawqbackup.lib.ext_table_sql_generator(
+            self.restore.create_external_table_skeleton, self.restore.insert_external_table_skeleton,
+            '"public"."sales"', 'hawqbackup_schema', 51200, '/hawq_backup/20161003/db/data', slice_index=2,
+            profile=self.text['profile'], format_clause=self.text['import']
+        )
+        self.assertEqual(squeeze(create),
+                         'CREATE EXTERNAL TABLE hawqbackup_schema."public_sales_slice_2" '
+                         '( like "public"."sales" ) '
+                         "LOCATION ('pxf://localhost:51200/hawq_backup/20161003/db/data/public/sales/slice_2"
+                         "?profile=HdfsTextSimple') FORMAT 'TEXT' (DELIMITER = E'\\t')")
+        self.assertEqual(squeeze(insert),
+                         'INSERT INTO "public"."sales" SELECT * FROM hawqbackup_schema."public_sales_slice_2"')
+        self.assertEqual(hawqbackup.lib.get_table_directory('/data', '"public"."sales"', 2),
+                         '/data/public/sales/slice_2')
+
+    def test_long_names_keep_one_external_table_per_slice(self):
+        table = '"' + 's' * 40 + '"."' + 'r' * 40 + '"'
+        names = [hawqbackup.lib.get_external_table_name(table, slice_index) for slice_index in [None, 0, 1, 12]]
+        self.assertEqual(len(set(names)), 4)
+        for name in names:
+            self.assertTrue(len(name) <= 63, name)
+        self.assertTrue(names[2].startswith('s' * 40 + '_' + 'r' * 4))
+        self.assertTrue(names[2].endswith('_slice_1'))
+        self.assertNotEqual(hawqbackup.lib.get_external_table_name('"' + 's' * 40 + '"."' + 'r' * 41 + '"', 1),
+                            names[2])
+        self.assertEqual(hawqbackup.lib.get_external_table_name('"public"."sales"', 2), 'public_sales_slice_2')
+
+    def test_long_names_cut_on_a_character_boundary(self):
+        name = hawqbackup.lib.get_external_table_name(u'"public"."' + u'\xe9' * 40 + u'"', 3)
+        self.assertTrue(isinstance(name, unicode))
+        self.assertTrue(len(name.encode('utf-8')) <= 63)
+        self.assertTrue(name.endswith('_slice_3'))
+
+    def test_only_writable_formats(self):
+        # The Parquet and Avro profiles of PXF are read only
+        self.assertEqual(hawqbackup.main.parseargs(['backup', '-d', 'db', '--format', 'text']).data_format, 'text')
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.assertRaises(SystemExit, hawqbackup.main.parseargs, ['backup', '-d', 'db', '--format', 'parquet'])
+        finally:
+            sys.stderr = stderr
+
+
+class TestSlices(BackupTestCase):
+
+    def test_work_items(self):
+        self.assertEqual(hawqbackup.lib.count_slices(1000, 300, 8), 4)
+        self.assertEqual(hawqbackup.lib.count_slices(1000, 300, 2), 2)
+        self.assertEqual(hawqbackup.lib.count_slices(1000, None, 4), 1)
+        self.assertEqual(hawqbackup.lib.count_slices(1000, 300, 1), 1)
+        self.assertEqual(hawqbackup.lib.get_work_items(['big', 'small'], {'big': 3, 'small': 1}),
+                         [('big', 0), ('big', 1), ('big', 2), ('small', None)])
+        self.assertEqual(hawqbackup.lib.get_work_items(['old'], {}), [('old', None)])
+
+    def test_slice_condition_does_not_depend_on_the_segments(self):
+        condition = squeeze(self.backup.slice_condition_skeleton.format('"id"', 4, 1))
+        self.assertEqual(condition, "WHERE abs(hashtext(COALESCE(\"id\"::text, ''))::bigint) % 4 = 1")
+        self.assertFalse('gp_segment_id' in condition)
+
+    def test_slice_column_is_the_first_distribution_column(self):
+        tables = [hawqbackup.catalog.Relation(2, 'public', 'sales', 'a', 100, 'pg_aoseg_2', 12, None, False),
+                  hawqbackup.catalog.Relation(5, 'public', 'events', 'h', 100, None, 15, None, False)]
+        self.backup.cursor = FakeCursor([(2, 'region'), (2, 'id'), (5, 'Odd"Name')])
+        columns = self.backup._HdbBackup__fetch_slice_columns(tables)
+        self.assertEqual(columns, {'"public"."sales"': '"region"', '"public"."events"': '"Odd""Name"'})
+        self.assertTrue('a.attrelid IN ( 2, 5 )' in self.backup.cursor.queries[0])
+        self.assertEqual(self.backup._HdbBackup__fetch_slice_columns([]), {})
+
+
+class TestResume(BackupTestCase):
+
+    def setUp(self):
+        BackupTestCase.setUp(self)
+        self.backup.backup_id = '20161003100000'
+        self.backup.metadata_backup_dir = '/hawq_backup/20161003100000/sales/metadata'
+        self.backup.data_backup_dir = '/hawq_backup/20161003100000/sales/data'
+        self.journal_file = self.backup.metadata_backup_dir + '/hdb_dump_20161003100000_journal.json'
+        self.files = {}
+        self.backup.storage = MemoryStorage(self.files)
+
+    def interrupt(self, tables):
+        self.backup._HdbBackup__prepare_journal()
+        for table, entry in tables.items():
+            self.backup.journal.table_done(table, entry)
+        self.backup.journal.flush()
+        self.backup.journal = None
+        self.backup.resume = self.backup.backup_id
+
+    def test_completed_tables_skipped(self):
+        self.interrupt({'"public"."orders"': {'backup_id': '20161003100000', 'rows': 10}})
+        self.files[self.backup.data_backup_dir + '/public/orders/0_1'] = 'done'
+        self.files[self.backup.data_backup_dir + '/public/customers/0_1'] = 'partial'
+        self.files[self.backup.data_backup_dir + '/public/customers/slice_1/0_1'] = 'partial'
+
+        self.backup._HdbBackup__prepare_journal()
+        self.backup.manifest_tables = {'"public"."orders"': {'backup_id': '20161003100000'},
+                                       '"public"."customers"': {'backup_id': '20161003100000'},
+                                       '"public"."items"': {'backup_id': '20161003100000'}}
+        tables = self.backup._HdbBackup__resume_tables(['"public"."orders"', '"public"."customers"',
+                                                        '"public"."items"'])
+
+        self.assertEqual(tables, ['"public"."customers"', '"public"."items"'])
+        self.assertEqual(self.backup.manifest_tables['"public"."orders"'],
+                         {'backup_id': '20161003100000', 'rows': 10})
+        self.assertEqual(self.backup.storage.deleted, [self.backup.data_backup_dir + '/public/customers'])
+        self.assertEqual(sorted(name for name in self.files if '/data/' in name),
+                         [self.backup.data_backup_dir + '/public/orders/0_1'])
+
+    def test_partial_objects_removed(self):
+        self.interrupt({})
+        self.backup._HdbBackup__prepare_journal()
+        self.backup.manifest_tables = {'"public"."orders"': {'backup_id': '20161003100000', 'object': 'a1'}}
+        self.backup._HdbBackup__resume_tables(['"public"."orders"'])
+        self.assertEqual(self.backup.storage.deleted, ['/hawq_backup/objects/sales/a1.20161003100000.tmp'])
+
+    def test_plan_leaves_the_partial_output(self):
+        self.interrupt({})
+        self.files[self.backup.data_backup_dir + '/public/customers/0_1'] = 'partial'
+        self.backup.plan = True
+        self.backup._HdbBackup__prepare_journal()
+        self.backup.manifest_tables = {'"public"."customers"': {'backup_id': '20161003100000'}}
+        self.assertEqual(self.backup._HdbBackup__resume_tables(['"public"."customers"']), ['"public"."customers"'])
+        self.assertEqual(self.backup.storage.deleted, [])
+
+    def test_resume_with_other_options_fails(self):
+        self.interrupt({})
+        self.backup.compress = 'gzip'
+        self.assertRaises(SystemExit, self.backup._HdbBackup__prepare_journal)
+
+    def test_complete_backup_not_resumed(self):
+        self.interrupt({})
+        self.files[self.backup.metadata_backup_dir + '/hdb_dump_20161003100000_manifest.json'] = '{"tables": {}}'
+        self.assertRaises(SystemExit, self.backup._HdbBackup__prepare_journal)
+
+    def test_missing_journal(self):
+        self.backup.resume = self.backup.backup_id
+        self.assertRaises(SystemExit, self.backup._HdbBackup__prepare_journal)
+
+
+class TestObjectStoreLock(BackupTestCase):
+
+    def setUp(self):
+        BackupTestCase.setUp(self)
+        self.backup.backup_id = '20161003100000'
+        self.backup.metadata_backup_dir = '/hawq_backup/20161003100000/sales/metadata'
+        self.files = {}
+        self.backup.storage = MemoryStorage(self.files)
+        self.backup._HdbBackup__prepare_journal()
+
+    def test_backup_holds_the_object_store(self):
+        self.backup._HdbBackup__lock_objects()
+        self.assertEqual(self.files['/hawq_backup/objects/sales/backup_20161003100000.lock'], '20161003100000')
+        self.assertTrue(self.backup.metadata_backup_dir + '/hdb_dump_20161003100000_journal.json' in self.files)
+
+    def test_backup_fails_while_a_prune_collects_objects(self):
+        self.files['/hawq_backup/objects/sales/prune.lock'] = ''
+        self.assertRaises(SystemExit, self.backup._HdbBackup__lock_objects)
+        self.assertFalse('/hawq_backup/objects/sales/backup_20161003100000.lock' in self.files)
+
+
+class FingerprintCursor(FakeCursor):
+    """
+    Cursor answering the fingerprints of the tables named by the last query
+    """
+
+    def fetchall(self):
+        return [(table, fingerprint) for table, fingerprint in self.rows if "'" + table + "'" in self.queries[-1]]
+
+
+class TestIncremental(BackupTestCase):
+
+    def setUp(self):
+        BackupTestCase.setUp(self)
+        self.backup.backup_id = '20161003100000'
+
+    def relation(self, oid, relname, segrel):
+        return hawqbackup.catalog.Relation(oid, 'public', relname, segrel and 'a' or 'h', 100, segrel, oid + 10,
+                                           None, False)
+
+    def test_fingerprints_of_the_append_only_tables(self):
+        tables = [self.relation(1, 'a', 'pg_aoseg_1'), self.relation(2, 'b', None), self.relation(3, 'c', 'pg_aoseg_3'),
+                  self.relation(4, 'd', 'pg_aoseg_4')]
+        self.backup.fingerprint_batch_size = 2
+        self.backup.cursor = FingerprintCursor([('"public"."a"', '11:100:5'), ('"public"."c"', '13:0:0'),
+                                                ('"public"."d"', '14:80:2')])
+        fingerprints = self.backup._HdbBackup__fetch_fingerprints(tables)
+
+        self.assertEqual(fingerprints, {'"public"."a"': '11:100:5', '"public"."c"': '13:0:0',
+                                        '"public"."d"': '14:80:2'})
+        self.assertEqual(self.backup.cursor.queries, [
+            "SELECT '\"public\".\"a\"', '11:' || COALESCE(SUM(eof), 0) || ':' || COALESCE(SUM(tupcount), 0) "
+            "FROM pg_aoseg.pg_aoseg_1 UNION ALL "
+            "SELECT '\"public\".\"c\"', '13:' || COALESCE(SUM(eof), 0) || ':' || COALESCE(SUM(tupcount), 0) "
+            "FROM pg_aoseg.pg_aoseg_3",
+            "SELECT '\"public\".\"d\"', '14:' || COALESCE(SUM(eof), 0) || ':' || COALESCE(SUM(tupcount), 0) "
+            "FROM pg_aoseg.pg_aoseg_4"
+        ])
+
+    def test_no_query_without_append_only_tables(self):
+        self.backup.cursor = FingerprintCursor([])
+        self.assertEqual(self.backup._HdbBackup__fetch_fingerprints([self.relation(2, 'b', None)]), {})
+        self.assertEqual(self.backup.cursor.queries, [])
+
+    def test_unchanged_tables_point_to_the_backup_holding_their_data(self):
+        # The reference backup 20161002100000 is itself incremental, "a" was dumped by 20161001100000
+        self.backup.incremental = '20161002100000'
+        self.backup.storage = MemoryStorage({
+            '/hawq_backup/20161002100000/sales/metadata/hdb_dump_20161002100000_manifest.json': json.dumps({
+                'tables': {
+                    '"public"."a"': {'backup_id': '20161001100000', 'fingerprint': '11:100:5', 'rows': 5},
+                    '"public"."b"': {'backup_id': '20161002100000', 'fingerprint': None},
+                    '"public"."c"': {'backup_id': '20161002100000', 'fingerprint': '13:0:0'}
+                }
+            })
+        })
+        reference_tables = self.backup._HdbBackup__read_reference_manifest()
+        tables = ['"public"."a"', '"public"."b"', '"public"."c"', '"public"."d"']
+        fingerprints = {'"public"."a"': '11:100:5', '"public"."c"': '13:40:1', '"public"."d"': '14:0:0'}
+        changed_tables = self.backup._HdbBackup__find_changed_tables(
+            tables, fingerprints, reference_tables, dict([(table, 100) for table in tables]),
+            dict([(table, None) for table in tables])
+        )
+
+        self.assertEqual(changed_tables, ['"public"."b"', '"public"."c"', '"public"."d"'])
+        self.assertEqual(self.backup.manifest_tables['"public"."a"'], {
+            'backup_id': '20161001100000', 'fingerprint': '11:100:5', 'rows': 5, 'size': 100, 'parent': None
+        })
+        for table in changed_tables:
+            self.assertEqual(self.backup.manifest_tables[table]['backup_id'], '20161003100000')
+
+    def test_reference_backup_without_manifest(self):
+        self.backup.incremental = '20161002100000'
+        self.backup.storage = MemoryStorage({})
+        self.assertRaises(SystemExit, self.backup._HdbBackup__read_reference_manifest)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import time
+import unittest
+from benchmarks import bench_orchestration
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_small_run(self):
+        # Plan, backup and restore a small synthetic database against the stand-ins
+        result = bench_orchestration.measure(25, 2, 0)
+        self.assertFalse('error' in result, result.get('error'))
+        self.assertTrue(result['bytes_written'] > 0)
+        self.assertEqual(result['bytes_written'], result['bytes_read'])
+
+    def test_dead_child_reported(self):
+        run_child = bench_orchestration.run_child
+        bench_orchestration.run_child = lambda *args: os._exit(3)
+        try:
+            result = bench_orchestration.measure(25, 2, 0)
+        finally:
+            bench_orchestration.run_child = run_child
+        self.assertEqual(result, {'tables': 25, 'error': 'the run died with exit code 3'})
+
+    def test_stuck_child_killed(self):
+        run_child = bench_orchestration.run_child
+        bench_orchestration.run_child = lambda *args: time.sleep(60)
+        try:
+            result = bench_orchestration.measure(25, 2, 0, timeout=1)
+        finally:
+            bench_orchestration.run_child = run_child
+        self.assertEqual(result, {'tables': 25, 'error': 'the run timed out after 1 seconds'})
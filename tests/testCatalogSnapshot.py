@@ -0,0 +1,82 @@
+import unittest
+import hawqbackup.catalog
+from tests.helpers import FakeConnection, FakeCursor
+
+
+class SizeCursor(FakeCursor):
+    """
+    Cursor answering the size queries with the size of every relation named by the last query
+    """
+
+    def __init__(self, sizes):
+        FakeCursor.__init__(self)
+        self.sizes = sizes
+
+    def fetchall(self):
+        oids = [oid for oid in self.sizes if 'SELECT {0},'.format(oid) in self.queries[-1]]
+        if 'pg_relation_size' in self.queries[-1]:
+            oids = [int(oid) for oid in self.queries[-1].split('( ')[1].split(' )')[0].split(', ')]
+        return [(oid, self.sizes[oid]) for oid in oids]
+
+
+class TestCatalogSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        # oid, schema, relation, storage, size, AO segment relation, relfilenode, partitioned table oid, is parent
+        self.catalog = hawqbackup.catalog.CatalogSnapshot()
+        self.catalog.namespaces = set(['public', 'sales', 'Mixed'])
+        self.catalog.index_rows([
+            (1, 'public', 'heap', 'h', 100, None, 11, None, False),
+            (2, 'sales', 'orders_1_prt_2', 'a', 300, 'pg_aoseg_2', 12, 3, False),
+        ])
+        self.catalog.index_rows([
+            (3, 'sales', 'orders', 'a', 0, 'pg_aoseg_3', 13, None, True),
+            (4, 'Mixed', 'Ta.ble', 'h', 50, None, 14, None, False),
+        ])
+
+    def test_split_name(self):
+        self.assertEqual(hawqbackup.catalog.split_name('Sales.Orders'), ('sales', 'orders'))
+        self.assertEqual(hawqbackup.catalog.split_name('"Mixed"."Ta.ble"'), ('Mixed', 'Ta.ble'))
+        self.assertEqual(hawqbackup.catalog.split_name('heap'), (None, 'heap'))
+
+    def test_partitions_replace_their_table(self):
+        selected = self.catalog.select(tables=['sales.orders'])
+        self.assertEqual([table.name for table in selected], ['"sales"."orders_1_prt_2"'])
+        self.assertEqual(selected[0].parent, '"sales"."orders"')
+
+    def test_leaf_partition_selected_on_its_own(self):
+        self.catalog.index_rows([(5, 'sales', 'orders_1_prt_3', 'a', 0, 'pg_aoseg_5', 15, 3, False)])
+        selected = self.catalog.select(tables=['sales.orders_1_prt_3', 'heap'])
+        self.assertEqual(sorted([table.name for table in selected]), ['"public"."heap"', '"sales"."orders_1_prt_3"'])
+        self.assertEqual(self.catalog.missing_tables(['sales.orders_1_prt_3']), [])
+
+    def test_leaf_partition_excluded_on_its_own(self):
+        self.catalog.index_rows([(5, 'sales', 'orders_1_prt_3', 'a', 0, 'pg_aoseg_5', 15, 3, False)])
+        selected = self.catalog.select(tables=['sales.orders'], exclude_tables=['sales.orders_1_prt_3'])
+        self.assertEqual([table.name for table in selected], ['"sales"."orders_1_prt_2"'])
+
+    def test_filters(self):
+        selected = self.catalog.select(exclude_tables=['"Mixed"."Ta.ble"'], exclude_schemas=['sales'])
+        self.assertEqual([table.name for table in selected], ['"public"."heap"'])
+        self.assertEqual(self.catalog.missing_tables(['heap', 'sales.missing']), ['sales.missing'])
+        self.assertEqual(self.catalog.missing_schemas(['sales', 'mixed']), ['mixed'])
+
+    def test_sizes_read_for_the_selected_tables(self):
+        self.catalog.index_rows([(5, 'sales', 'orders_1_prt_3', 'a', 0, 'pg_aoseg_5', 15, 3, False)])
+        self.catalog.size_batch_size = 1
+        cursor = SizeCursor({1: 8192, 2: 4000.0, 5: None})
+        selected = self.catalog.select(schemas=['sales', 'public'])
+        self.catalog.load_sizes(FakeConnection(), cursor, selected)
+
+        self.assertEqual(sorted([(table.name, table.size) for table in selected]), [
+            ('"public"."heap"', 8192), ('"sales"."orders_1_prt_2"', 4000), ('"sales"."orders_1_prt_3"', 0)
+        ])
+        self.assertEqual(sorted(cursor.queries), [
+            'SELECT 2, COALESCE(SUM(eof), 0) FROM pg_aoseg.pg_aoseg_2',
+            'SELECT 5, COALESCE(SUM(eof), 0) FROM pg_aoseg.pg_aoseg_5',
+            'SELECT oid, pg_relation_size(oid) FROM pg_class WHERE oid IN ( 1 )'
+        ])
+        self.assertFalse('pg_relation_size' in self.catalog.relation_query)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import json
+import unittest
+from hawqbackup.journal import CheckpointJournal
+from tests.helpers import MemoryStorage
+
+
+class TestCheckpointJournal(unittest.TestCase):
+
+    path = '/hawq_backup/20161003100000/sales/metadata/hdb_dump_20161003100000_journal.json'
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+
+    def test_flush_and_load_round_trip(self):
+        journal = CheckpointJournal(self.storage, self.path, interval=0)
+        journal.set_options({'compress': 'gzip'})
+        journal.step_done('metadata')
+        journal.table_done('"public"."orders"', {'backup_id': '20161003100000', 'rows': 10})
+
+        resumed = CheckpointJournal(self.storage, self.path)
+        self.assertTrue(resumed.load())
+        self.assertEqual(resumed.options(), {'compress': 'gzip'})
+        self.assertTrue(resumed.is_step_done('metadata'))
+        self.assertFalse(resumed.is_step_done('data'))
+        self.assertEqual(resumed.tables(), {'"public"."orders"': {'backup_id': '20161003100000', 'rows': 10}})
+
+    def test_missing_journal(self):
+        journal = CheckpointJournal(self.storage, self.path)
+        self.assertFalse(journal.load())
+        self.assertEqual(journal.tables(), {})
+
+    def test_tables_written_at_most_every_interval(self):
+        journal = CheckpointJournal(self.storage, self.path, interval=3600)
+        journal.step_done('metadata')
+        journal.table_done('"public"."orders"', {})
+        journal.table_done('"public"."customers"', {})
+        self.assertEqual(self.storage.writes, 1)
+        self.assertEqual(json.loads(self.storage.files[self.path])['tables'], {})
+
+        journal.flush()
+        self.assertEqual(self.storage.writes, 2)
+        self.assertEqual(len(json.loads(self.storage.files[self.path])['tables']), 2)
+
+        # Nothing changed since the last write
+        journal.flush()
+        self.assertEqual(self.storage.writes, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
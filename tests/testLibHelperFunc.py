@@ -0,0 +1,280 @@
+import os
+import time
+import unittest
+from pgdb import DatabaseError
+import hawqbackup.lib
+
+
+class TestScheduling(unittest.TestCase):
+
+    def setUp(self):
+        self.sizes = {'s.small': 10, 's.medium': 500, 's.big': 2000, 's.new': 1000}
+
+    def test_order_by_size_without_history(self):
+        ordered = hawqbackup.lib.order_by_expected_runtime(self.sizes.keys(), self.sizes, {})
+        self.assertEqual(ordered, ['s.big', 's.new', 's.medium', 's.small'])
+
+    def test_order_by_recorded_timings(self):
+        # s.medium was slow last time, s.new has no history so its size is converted using the observed throughput
+        timings = {'s.small': [1, 10], 's.medium': [30, 500], 's.big': [19, 2000]}
+        ordered = hawqbackup.lib.order_by_expected_runtime(self.sizes.keys(), self.sizes, timings)
+        self.assertEqual(ordered, ['s.medium', 's.new', 's.big', 's.small'])
+
+    def test_simulated_schedule(self):
+        # Longest first on two workers: 5 | 4, then 3 goes to the second worker and 2 to the first
+        self.assertEqual(hawqbackup.lib.simulate_schedule([5, 4, 3, 2], 2), 7)
+        self.assertEqual(hawqbackup.lib.simulate_schedule([5, 4, 3, 2], 1), 14)
+        self.assertEqual(hawqbackup.lib.simulate_schedule([], 4), 0)
+
+
+class TestDdlStages(unittest.TestCase):
+
+    toc = [
+        '; Archive created at Mon Oct  3 10:00:00 2016',
+        '2; 2615 2200 SCHEMA - public gpadmin',
+        '5; 1255 16384 FUNCTION public f() gpadmin',
+        '7; 1259 16386 TABLE public sales gpadmin',
+        '8; 1259 16390 TABLE public customers gpadmin',
+        '9; 1255 16392 FUNCTION public sales_total() gpadmin',
+        '10; 1259 16395 VIEW public big_sales gpadmin',
+        '11; 2604 16397 DEFAULT public customers id gpadmin',
+        '12; 1259 16400 INDEX public sales_idx gpadmin',
+        '13; 2606 16402 CONSTRAINT public customers_pkey gpadmin',
+        '14; 2606 16404 FK CONSTRAINT public sales_fk gpadmin',
+        '15; 0 0 ACL - public gpadmin',
+        '16; 0 0 COMMENT - TABLE sales gpadmin',
+        ''
+    ]
+
+    def test_entry_types(self):
+        self.assertEqual(hawqbackup.lib.read_toc_entry(self.toc[0]), None)
+        self.assertEqual(hawqbackup.lib.read_toc_entry(self.toc[3]), 'TABLE')
+        self.assertEqual(hawqbackup.lib.read_toc_entry(self.toc[10]), 'FK CONSTRAINT')
+        self.assertEqual(hawqbackup.lib.read_toc_entry('20; 0 16386 TABLE DATA public sales gpadmin'), 'TABLE DATA')
+
+    def test_stages_keep_the_dependency_order(self):
+        stages = hawqbackup.lib.plan_ddl_stages(self.toc)
+        self.assertEqual([(name, parallel, [line.split(';')[0] for line in lines])
+                          for name, parallel, lines in stages], [
+            ('pre-data', False, ['2', '5', '9']),
+            ('tables', True, ['7', '8']),
+            ('after-tables', False, ['10', '11']),
+            ('indexes', True, ['12', '13']),
+            ('post-data', False, ['14', '15', '16'])
+        ])
+
+    def test_sequence_of_a_default_is_created_before_the_tables(self):
+        # pg_dump sorts the sequences with the tables by name, the default of orders uses orders_id_seq
+        toc = [
+            '2; 2615 2200 SCHEMA - public gpadmin',
+            '3; 1259 16386 TABLE public customers gpadmin',
+            '4; 1259 16388 SEQUENCE public orders_id_seq gpadmin',
+            '5; 1259 16390 TABLE public orders gpadmin',
+            '6; 0 0 SEQUENCE OWNED BY public orders_id_seq gpadmin'
+        ]
+        stages = dict([(name, [line.split(';')[0] for line in lines])
+                       for name, parallel, lines in hawqbackup.lib.plan_ddl_stages(toc)])
+        self.assertEqual(stages, {'pre-data': ['2', '4'], 'tables': ['3', '5'], 'after-tables': ['6']})
+
+    def test_dependencies_printed_by_the_client(self):
+        toc = [
+            '2; 2615 2200 SCHEMA - public gpadmin',
+            '3; 1259 16386 TABLE public sales gpadmin',
+            ';\tdepends on: 2',
+            '4; 1259 16390 TABLE public sales_2016 gpadmin',
+            ';\tdepends on: 2 3',
+            '5; 1255 16392 FUNCTION public last_sales() gpadmin',
+            ';\tdepends on: 3',
+            '6; 1259 16394 TABLE public customers gpadmin'
+        ]
+        dependencies = hawqbackup.lib.read_toc_dependencies(toc)
+        self.assertEqual(dependencies, {'3': ['2'], '4': ['2', '3'], '5': ['3']})
+        stages = hawqbackup.lib.plan_ddl_stages(toc, dependencies)
+        self.assertEqual([(name, [line.split(';')[0] for line in lines]) for name, parallel, lines in stages],
+                         [('pre-data', ['2']), ('tables', ['3', '4', '6']), ('after-tables', ['5'])])
+
+    def test_inherited_tables_restored_in_the_same_list(self):
+        toc = [
+            '3; 1259 16386 TABLE public sales gpadmin',
+            '4; 1259 16388 TABLE public customers gpadmin',
+            '5; 1259 16390 TABLE public sales_2016 gpadmin',
+            '6; 1259 16392 TABLE archive sales_2015 gpadmin',
+            '7; 1259 16394 TABLE public stores gpadmin'
+        ]
+        ddl = [
+            '-- Name: sales_2016; Type: TABLE; Schema: public; Owner: gpadmin; Tablespace: ',
+            'CREATE TABLE sales_2016 (',
+            '    region text',
+            ')',
+            'INHERITS (sales) WITH (appendonly=true) DISTRIBUTED BY (id);',
+            '-- Name: sales_2015; Type: TABLE; Schema: archive; Owner: gpadmin; Tablespace: ',
+            'CREATE TABLE sales_2015 (',
+            ')',
+            'INHERITS (public.sales) DISTRIBUTED BY (id);'
+        ]
+        dependencies = hawqbackup.lib.read_inheritance_dependencies(toc, ddl)
+        self.assertEqual(dependencies, {'5': ['3'], '6': ['3']})
+        chunks = hawqbackup.lib.chunk_ddl_entries(toc, 3, dependencies)
+        self.assertEqual([[line.split(';')[0] for line in chunk] for chunk in chunks], [['3', '5', '6'], ['4'], ['7']])
+
+        # Without the dependencies the tables are only balanced
+        chunks = hawqbackup.lib.chunk_ddl_entries(toc, 2)
+        self.assertEqual(sorted([len(chunk) for chunk in chunks]), [2, 3])
+
+
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.attempts = []
+        self.cleanups = []
+
+    def flaky(self, failures):
+        def func():
+            self.attempts.append(1)
+            if len(self.attempts) <= failures:
+                raise DatabaseError("PXF server error: connection timed out")
+            return 'done'
+        return func
+
+    def test_retried_until_success(self):
+        result = hawqbackup.lib.run_with_retries(self.flaky(2), 2, 0, lambda: self.cleanups.append(1))
+        self.assertEqual(result, 'done')
+        self.assertEqual(len(self.attempts), 3)
+        self.assertEqual(len(self.cleanups), 2)
+
+    def test_last_error_raised(self):
+        self.assertRaises(DatabaseError, hawqbackup.lib.run_with_retries, self.flaky(5), 1, 0)
+        self.assertEqual(len(self.attempts), 2)
+
+    def test_other_errors_not_retried(self):
+        def broken():
+            self.attempts.append(1)
+            raise KeyError('table')
+        self.assertRaises(KeyError, hawqbackup.lib.run_with_retries, broken, 3, 0)
+        self.assertEqual(len(self.attempts), 1)
+
+
+class TestCommands(unittest.TestCase):
+
+    def setUp(self):
+        # The commands run with the hawq environment, which the tests do not need to have sourced
+        self.gphome = os.environ.get('GPHOME')
+        os.environ.setdefault('GPHOME', '/usr/local/hawq')
+        hawqbackup.lib._resolved.clear()
+
+    def tearDown(self):
+        hawqbackup.lib._resolved.clear()
+        if self.gphome is None:
+            del os.environ['GPHOME']
+
+    def test_executables_and_environment_resolved_once(self):
+        self.assertTrue(hawqbackup.lib.get_env() is hawqbackup.lib.get_env())
+        path = hawqbackup.lib.find_executable('sh')
+        self.assertTrue(path.endswith('/sh'))
+        hawqbackup.lib._resolved['env'] = {'PATH': '/nonexistent'}
+        self.assertEqual(hawqbackup.lib.find_executable('sh'), path)
+        self.assertEqual(hawqbackup.lib.find_executable('hawqbackup-missing-tool'), None)
+
+    def test_argument_lists_run_without_shell(self):
+        output = []
+        hawqbackup.lib.stream_cmd(['echo', 'a;b', '$HOME'], output.append)
+        self.assertEqual(''.join(output), 'a;b $HOME\n')
+        self.assertEqual(hawqbackup.lib.command_line(['echo', 'a;b']), "echo 'a;b'")
+
+    def test_missing_program_is_a_failed_command(self):
+        self.assertEqual(hawqbackup.lib.stream_cmd(['hawqbackup-missing-tool'], ignore_error=True), 127)
+
+    def test_concurrent_commands(self):
+        # Every command only ends once its input is closed, which needs the other commands not to hold the pipe
+        outputs = {}
+
+        def run(worker_id, item):
+            output = []
+            hawqbackup.lib.stream_cmd(['cat'], output.append, lambda stdin: stdin.write('item %d\n' % item),
+                                      timeout=10)
+            outputs[item] = ''.join(output)
+
+        self.assertEqual(hawqbackup.lib.run_parallel(run, range(16), 8), [])
+        self.assertEqual(outputs, dict([(item, 'item %d\n' % item) for item in range(16)]))
+
+    def test_timed_out_command_is_killed(self):
+        start = time.time()
+        self.assertNotEqual(hawqbackup.lib.stream_cmd(['sleep', '30'], timeout=0.2, ignore_error=True), 0)
+        self.assertTrue(time.time() - start < 10)
+
+    def test_pipeline_without_shell(self):
+        output = []
+        self.assertEqual(hawqbackup.lib.stream_cmd(['printf', 'a\\nb\\n'], output.append, pipe_to=['sort', '-r']), 0)
+        self.assertEqual(''.join(output), 'b\na\n')
+
+    def test_pipeline_fails_when_any_command_fails(self):
+        reader_fails = ['sh', '-c', 'cat > /dev/null; exit 3']
+        self.assertEqual(hawqbackup.lib.stream_cmd(['echo', 'data'], pipe_to=reader_fails, ignore_error=True), 3)
+        self.assertEqual(hawqbackup.lib.stream_cmd(['sh', '-c', 'exit 4'], pipe_to=['cat'], ignore_error=True), 4)
+        self.assertRaises(SystemExit, hawqbackup.lib.stream_cmd, ['echo', 'data'], pipe_to=reader_fails)
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.settings = []
+        self.broken = False
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        if self.broken:
+            raise hawqbackup.lib.Error("server closed the connection unexpectedly")
+        self.settings.append(query)
+
+    def fetchall(self):
+        return [(1,)]
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.execute('ROLLBACK')
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.opened = []
+        self.connect = hawqbackup.lib.connect
+
+        def connect(**kwargs):
+            self.opened.append(FakeConnection())
+            return self.opened[-1]
+        hawqbackup.lib.connect = connect
+        self.pool = hawqbackup.lib.ConnectionPool('db', 'localhost', 5432, 'gpadmin', None, size=2,
+                                                  settings=['set client_min_messages = ERROR'], check_after=0)
+
+    def tearDown(self):
+        hawqbackup.lib.connect = self.connect
+
+    def test_connections_are_reused_with_their_settings(self):
+        with self.pool.connection() as (conn, cursor):
+            pass
+        with self.pool.connection() as (conn, cursor):
+            pass
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(self.opened[0].settings.count('set client_min_messages = ERROR'), 1)
+
+    def test_broken_connection_is_replaced(self):
+        with self.pool.connection() as (conn, cursor):
+            pass
+        self.opened[0].broken = True
+        with self.pool.connection() as (conn, cursor):
+            self.assertTrue(conn is self.opened[1])
+        self.assertTrue(self.opened[0].closed)
+        self.assertEqual(self.pool.opened, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
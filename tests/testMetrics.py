@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from hawqbackup.metrics import RunMetrics, format_label
+
+
+class TestPrometheus(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_label_values_escaped(self):
+        self.assertEqual(format_label('database', 'sales'), 'database="sales"')
+        self.assertEqual(format_label('database', 'a"b\\c\nd'), 'database="a\\"b\\\\c\\nd"')
+
+    def test_textfile_with_an_unusual_database_name(self):
+        metrics = RunMetrics()
+        metrics.set_labels(command='backup', database='q"uote', backup_id='20161003100000')
+        with metrics.phase('metadata'):
+            pass
+        metrics.write(self.directory, 'success')
+
+        content = open(os.path.join(self.directory, 'hawqbackup_backup_q"uote.prom')).read()
+        self.assertTrue('hawqbackup_run_success{command="backup",database="q\\"uote"} 1\n' in content)
+        self.assertTrue('hawqbackup_phase_duration_seconds{command="backup",database="q\\"uote",phase="metadata"} '
+                        in content)
+        self.assertTrue('hawqbackup_backup_id{command="backup",database="q\\"uote"} 20161003100000\n' in content)
+
+
+
+class TestTimers(unittest.TestCase):
+
+    def test_nested_calls_counted_under_one_timer(self):
+        metrics = RunMetrics()
+        with metrics.timer('hdfs'):
+            with metrics.timer('subprocess'):
+                pass
+        with metrics.timer('subprocess'):
+            pass
+        self.assertEqual(sorted(metrics.timers.keys()), ['hdfs', 'subprocess'])
+        self.assertEqual(metrics.timers['hdfs']['calls'], 1)
+        self.assertEqual(metrics.timers['subprocess']['calls'], 1)
+
+    def test_calls_of_other_threads_counted_on_their_own(self):
+        metrics = RunMetrics()
+
+        def call():
+            with metrics.timer('subprocess'):
+                pass
+
+        with metrics.timer('hdfs'):
+            thread = threading.Thread(target=call)
+            thread.start()
+            thread.join()
+        self.assertEqual(metrics.timers['subprocess']['calls'], 1)
+        self.assertEqual(metrics.timers['hdfs']['calls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
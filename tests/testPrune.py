@@ -0,0 +1,128 @@
+import json
+import unittest
+import hawqbackup.prune
+from tests.helpers import MemoryStorage
+
+
+class TestPrune(unittest.TestCase):
+
+    def setUp(self):
+        self.prune = hawqbackup.prune.HdbPrune()
+        self.prune.dbname = 'sales'
+        self.prune.no_prompt = True
+        self.files = {}
+        self.storage = MemoryStorage(self.files)
+        self.original_storage = hawqbackup.prune.HdfsStorage
+        hawqbackup.prune.HdfsStorage = lambda *args: self.storage
+
+    def tearDown(self):
+        hawqbackup.prune.HdfsStorage = self.original_storage
+
+    def add_backup(self, backup_id, tables, dbname='sales', failed=None):
+        metadata_dir = '/hawq_backup/' + backup_id + '/' + dbname + '/metadata'
+        self.files[metadata_dir + '/hdb_dump_' + backup_id + '_manifest.json'] = json.dumps(
+            {'tables': tables, 'failed': failed or {}}
+        )
+        self.files['/hawq_backup/' + backup_id + '/' + dbname + '/data/part-0'] = 'data'
+
+    def add_unfinished_backup(self, backup_id):
+        metadata_dir = '/hawq_backup/' + backup_id + '/sales/metadata'
+        self.files[metadata_dir + '/hdb_dump_' + backup_id + '_journal.json'] = json.dumps({'tables': {}})
+
+    def add_schema_only_backup(self, backup_id):
+        self.files['/hawq_backup/' + backup_id + '/sales/metadata/hdb_dump_' + backup_id + '.gz'] = 'ddl'
+
+    def add_object(self, key):
+        self.files['/hawq_backup/objects/sales/' + key + '/public/customers/part-0'] = 'data'
+
+    def backups(self):
+        return sorted(directory.split('/')[-1] for directory in self.storage.list_directories('/hawq_backup')
+                      if directory.split('/')[-1].isdigit())
+
+    def test_keep_the_most_recent_backups(self):
+        for backup_id in ['20161001100000', '20161002100000', '20161003100000']:
+            self.add_backup(backup_id, {'"public"."customers"': {'backup_id': backup_id}})
+        self.prune.keep = 2
+        self.prune.run_prune()
+        self.assertEqual(self.backups(), ['20161002100000', '20161003100000'])
+
+    def test_only_complete_backups_count(self):
+        self.add_backup('20161001100000', {'"public"."customers"': {'backup_id': '20161001100000'}})
+        self.add_backup('20161002100000', {'"public"."customers"': {'backup_id': '20161002100000'}})
+        self.add_unfinished_backup('20161003100000')
+        self.add_backup('20161004100000', {}, failed={'"public"."customers"': 'PXF server error'})
+        self.add_schema_only_backup('20161005100000')
+        self.prune.keep = 1
+        self.prune.run_prune()
+        self.assertEqual(self.backups(), ['20161002100000', '20161003100000', '20161004100000', '20161005100000'])
+
+    def test_nothing_pruned_without_enough_complete_backups(self):
+        self.add_unfinished_backup('20161001100000')
+        self.add_backup('20161002100000', {'"public"."customers"': {'backup_id': '20161002100000'}})
+        self.add_schema_only_backup('20161003100000')
+        self.prune.keep = 1
+        self.prune.run_prune()
+        self.assertEqual(self.backups(), ['20161001100000', '20161002100000', '20161003100000'])
+
+    def test_kept_incremental_backup_keeps_its_base_backup(self):
+        self.add_backup('20161001100000', {'"public"."customers"': {'backup_id': '20161001100000'}})
+        self.add_backup('20161002100000', {'"public"."customers"': {'backup_id': '20161002100000'}})
+        self.add_backup('20161003100000', {'"public"."customers"': {'backup_id': '20161002100000'},
+                                           '"public"."orders"': {'backup_id': '20161003100000'}})
+        self.prune.keep = 1
+        self.prune.run_prune()
+        self.assertEqual(self.backups(), ['20161002100000', '20161003100000'])
+
+    def test_backup_id_directory_shared_with_another_database_is_kept(self):
+        self.add_backup('20161001100000', {'"public"."customers"': {'backup_id': '20161001100000'}})
+        self.add_backup('20161001100000', {'"public"."items"': {'backup_id': '20161001100000'}}, dbname='stock')
+        self.add_backup('20161002100000', {'"public"."customers"': {'backup_id': '20161002100000'}})
+        self.prune.keep = 1
+        self.prune.run_prune()
+        self.assertFalse(self.storage.exists('/hawq_backup/20161001100000/sales'))
+        self.assertTrue(self.storage.exists('/hawq_backup/20161001100000/stock'))
+
+    def test_unreferenced_objects_collected(self):
+        self.add_backup('20161001100000', {'"public"."customers"': {'backup_id': '20161001100000', 'object': 'a1'}})
+        self.add_backup('20161002100000', {'"public"."customers"': {'backup_id': '20161002100000', 'object': 'b2'}})
+        for key in ['a1', 'b2', 'c3', 'd4.20161002100000.tmp', 'e5.20161001100000.tmp']:
+            self.add_object(key)
+        self.files['/hawq_backup/objects/sales/index.json'] = json.dumps({'a1': {}, 'b2': {}, 'c3': {}})
+        self.prune.keep = 1
+        self.prune.run_prune()
+
+        objects = sorted(directory.split('/')[-1]
+                         for directory in self.storage.list_directories('/hawq_backup/objects/sales'))
+        self.assertEqual(objects, ['b2', 'd4.20161002100000.tmp'])
+        self.assertEqual(json.loads(self.files['/hawq_backup/objects/sales/index.json']), {'b2': {}})
+        self.assertFalse(self.storage.exists('/hawq_backup/20161001100000'))
+
+    def test_objects_kept_while_a_backup_holds_the_object_store(self):
+        self.add_backup('20161001100000', {'"public"."customers"': {'backup_id': '20161001100000', 'object': 'a1'}})
+        self.add_unfinished_backup('20161002100000')
+        self.add_object('a1')
+        self.add_object('b2')
+        self.files['/hawq_backup/objects/sales/backup_20161002100000.lock'] = '20161002100000'
+        self.prune.keep = 1
+        self.prune.run_prune()
+        self.assertTrue(self.storage.exists('/hawq_backup/objects/sales/b2'))
+        self.assertTrue('/hawq_backup/objects/sales/backup_20161002100000.lock' in self.files)
+        self.assertFalse('/hawq_backup/objects/sales/prune.lock' in self.files)
+
+    def test_markers_left_over_by_interrupted_backups_removed(self):
+        self.add_unfinished_backup('20161001100000')
+        self.add_backup('20161002100000', {'"public"."customers"': {'backup_id': '20161002100000', 'object': 'b2'}})
+        self.add_backup('20161003100000', {'"public"."customers"': {'backup_id': '20161003100000', 'object': 'b2'}})
+        self.add_object('a1')
+        self.add_object('b2')
+        self.files['/hawq_backup/objects/sales/backup_20161001100000.lock'] = '20161001100000'
+        self.files['/hawq_backup/objects/sales/backup_20161003100000.lock'] = '20161003100000'
+        self.prune.keep = 1
+        self.prune.run_prune()
+        self.assertFalse(self.storage.exists('/hawq_backup/objects/sales/a1'))
+        self.assertTrue(self.storage.exists('/hawq_backup/objects/sales/b2'))
+        self.assertEqual(sorted(name for name in self.files if name.endswith('.lock')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import json
+import StringIO
+import unittest
+from pgdb import DatabaseError
+import hawqbackup.restore
+from hawqbackup.journal import CheckpointJournal
+from hawqbackup.progress import ProgressTracker
+from tests.helpers import FakeConnection, FakeCursor, FakePool, MemoryStorage
+
+
+class TestMissingTables(unittest.TestCase):
+
+    def setUp(self):
+        self.restore = hawqbackup.restore.HDBRestore()
+        self.restore.backup_id = '20161003100000'
+        self.restore.from_dbname = 'sales'
+        self.restore.metadata_backup_dir = '/hawq_backup/20161003100000/sales/metadata'
+        manifest = {
+            'tables': {'"public"."customers"': {'backup_id': '20161003100000', 'size': 100, 'bytes': 80}},
+            'failed': {'"public"."orders"': 'PXF server error: connection timed out'}
+        }
+        self.restore.storage = MemoryStorage({
+            self.restore.metadata_backup_dir + '/hdb_dump_20161003100000_manifest.json': json.dumps(manifest)
+        })
+
+    def test_restore_fails_on_tables_missing_from_the_backup(self):
+        tables = self.restore._HDBRestore__get_data_location()
+        self.assertEqual(tables, ['"public"."customers"'])
+        self.assertRaises(SystemExit, self.restore._HDBRestore__check_missing_tables)
+
+    def test_missing_tables_skipped_with_ignore_error(self):
+        self.restore._HDBRestore__get_data_location()
+        self.restore.ignore = True
+        self.restore._HDBRestore__check_missing_tables()
+
+    def test_only_the_tables_selected_count(self):
+        self.restore._HDBRestore__get_data_location()
+        self.restore._HDBRestore__check_missing_tables(['"public"."customers"'])
+        self.assertRaises(SystemExit, self.restore._HDBRestore__check_missing_tables, ['"public"."orders"'])
+
+
+class FailingCursor(FakeCursor):
+
+    def execute(self, query):
+        FakeCursor.execute(self, query)
+        if query.strip().startswith('INSERT'):
+            raise DatabaseError('PXF server error: connection timed out')
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.restore = hawqbackup.restore.HDBRestore()
+        self.restore.backup_id = '20161003100000'
+        self.restore.from_dbname = 'sales'
+        self.restore.to_dbname = 'sales_copy'
+        self.restore.metadata_backup_dir = '/hawq_backup/20161003100000/sales/metadata'
+        self.restore.data_backup_dir = '/hawq_backup/20161003100000/sales/data'
+        self.journal_file = self.restore.metadata_backup_dir + '/hdb_restore_20161003100000_sales_copy_journal.json'
+        self.restore.storage = MemoryStorage({})
+        self.restore.conn = FakeConnection()
+        self.restore.cursor = FakeCursor()
+
+    def interrupt(self, done_tables, started_tables=()):
+        self.restore._HDBRestore__prepare_journal()
+        for table in done_tables:
+            self.restore.journal.table_started(table)
+            self.restore.journal.table_done(table, {'rows': 10, 'duration': 1.0})
+        for table in started_tables:
+            self.restore.journal.table_started(table)
+        self.restore.journal.flush()
+        self.restore.resume = True
+        self.restore._HDBRestore__prepare_journal()
+
+    def load_table(self, table):
+        cursor = FakeCursor()
+        self.restore.pool = FakePool(cursor)
+        self.restore.progress = ProgressTracker('Restoring', {table: 100}, stream=StringIO.StringIO())
+        self.restore._HDBRestore__load_table(table, None, 100)
+        return cursor.queries
+
+    def test_journal_of_a_previous_restore_replaced(self):
+        self.restore.storage.files[self.journal_file] = json.dumps(
+            {'options': {}, 'steps': ['metadata'], 'tables': {'"public"."orders"': {}}}
+        )
+        self.restore._HDBRestore__prepare_journal()
+        self.restore.journal.table_started('"public"."orders"')
+        self.restore._HDBRestore__prepare_journal()
+        journal = CheckpointJournal(self.restore.storage, self.journal_file)
+        self.assertTrue(journal.load())
+        self.assertEqual(journal.tables(), {})
+        self.assertFalse(journal.is_step_done('metadata'))
+        self.assertEqual(journal.started_tables(['"public"."orders"']), [])
+
+    def test_missing_journal(self):
+        self.restore.resume = True
+        self.assertRaises(SystemExit, self.restore._HDBRestore__prepare_journal)
+
+    def test_loaded_tables_skipped_and_started_sliced_tables_truncated(self):
+        self.interrupt(['"public"."orders"'], ['"public"."events"'])
+        self.restore.data_slices = {'"public"."events"': 3, '"public"."visits"': 3}
+        tables = self.restore._HDBRestore__resume_tables(['"public"."orders"', '"public"."events"',
+                                                          '"public"."visits"', '"public"."customers"'])
+        self.assertEqual(tables, ['"public"."events"', '"public"."visits"', '"public"."customers"'])
+        self.assertEqual(self.restore.cursor.queries, ['TRUNCATE TABLE "public"."events"'])
+        self.assertEqual(self.restore.conn.commits, 1)
+
+    def test_started_table_truncated_with_its_load(self):
+        self.interrupt([], ['"public"."customers"'])
+        self.restore._HDBRestore__resume_tables(['"public"."customers"'])
+        queries = self.load_table('"public"."customers"')
+
+        self.assertEqual(queries[0], 'TRUNCATE TABLE "public"."customers"')
+        self.assertTrue(queries[2].startswith('INSERT INTO "public"."customers"'))
+        self.assertEqual(self.restore.journal.tables()['"public"."customers"']['rows'], 10)
+
+    def test_table_not_started_keeps_its_rows(self):
+        self.interrupt([])
+        self.restore._HDBRestore__resume_tables(['"public"."customers"'])
+        queries = self.load_table('"public"."customers"')
+
+        self.assertFalse([query for query in queries if query.startswith('TRUNCATE')])
+        self.assertEqual(self.restore.journal.started_tables(['"public"."customers"', '"public"."orders"']),
+                         ['"public"."customers"'])
+
+    def test_table_with_a_failed_slice_left_for_the_resume(self):
+        self.interrupt([])
+        self.restore.resume = False
+        self.restore.retries = 0
+        self.restore.data_slices = {'"public"."events"': 2}
+        self.load_table_slice('"public"."events"', 0, FakeCursor())
+        self.assertRaises(DatabaseError, self.load_table_slice, '"public"."events"', 1, FailingCursor())
+
+        self.assertEqual(self.restore.journal.started_tables(['"public"."events"']), ['"public"."events"'])
+        self.assertFalse('"public"."events"' in self.restore.journal.tables())
+
+    def load_table_slice(self, table, slice_index, cursor):
+        self.restore.pool = FakePool(cursor)
+        self.restore.progress = ProgressTracker('Restoring', {table: 100}, stream=StringIO.StringIO())
+        self.restore._HDBRestore__load_table(table, slice_index, 100)
+        self.assertFalse([query for query in cursor.queries if query.startswith('TRUNCATE')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import StringIO
+import unittest
+import hawqbackup.verify
+from hawqbackup.progress import ProgressTracker
+from tests.helpers import FakeCursor, FakePool, LoggingTestCase, MemoryStorage
+
+
+class ChecksumCursor(FakeCursor):
+    """
+    Cursor answering the checksum queries of the table and of its backup, one answer per slice of the backup
+    """
+
+    def __init__(self, table_answer, backup_answers):
+        FakeCursor.__init__(self)
+        self.table_answer = table_answer
+        self.backup_answers = list(backup_answers)
+        self.answer = None
+
+    def execute(self, query):
+        FakeCursor.execute(self, query)
+        if not self.queries[-1].startswith('SELECT'):
+            self.answer = None
+        elif 'hawqverify_schema' in self.queries[-1]:
+            self.answer = self.backup_answers.pop(0)
+        else:
+            self.answer = self.table_answer
+
+    def fetchone(self):
+        return self.answer
+
+
+class TestVerify(LoggingTestCase):
+
+    def setUp(self):
+        LoggingTestCase.setUp(self)
+        self.verify = hawqbackup.verify.HdbVerify()
+        self.verify.dbname = 'sales'
+        self.verify.backup_id = '20161003100000'
+        self.verify.progress = ProgressTracker('Verifying', {'"public"."orders"': 100}, stream=StringIO.StringIO())
+
+    def verify_table(self, table_answer, backup_answers, entry):
+        cursor = ChecksumCursor(table_answer, backup_answers)
+        self.verify.pool = FakePool(cursor)
+        self.verify._HdbVerify__verify_table('"public"."orders"', entry)
+        return cursor.queries
+
+    def test_checksum_of_the_rows_independent_of_their_order(self):
+        queries = self.verify_table((10, 1234), [(10, 1234)], {'backup_id': '20161003100000'})
+        self.assertEqual(queries[0], 'SELECT COUNT(*), COALESCE(SUM(hashtext(textin(record_out(t)))::bigint), 0) '
+                                     'FROM "public"."orders" t')
+        self.assertEqual(queries[2], 'SELECT COUNT(*), COALESCE(SUM(hashtext(textin(record_out(t)))::bigint), 0) '
+                                     'FROM hawqverify_schema."public_orders" t')
+        self.assertTrue("/hawq_backup/20161003100000/sales/data/public/orders?profile=HdfsTextSimple'" in queries[1])
+        self.assertEqual(self.verify.results['"public"."orders"'],
+                         {'table_rows': 10, 'backup_rows': 10, 'passed': True})
+
+    def test_hashes_of_the_slices_add_up(self):
+        queries = self.verify_table((10, 1234), [(4, 1000), (6, 234), (0, 0)],
+                                    {'backup_id': '20161003100000', 'slices': 3})
+        self.assertEqual(len(queries), 7)
+        for slice_index in range(3):
+            self.assertTrue('/public/orders/slice_{0}?'.format(slice_index) in queries[1 + 2 * slice_index])
+            self.assertTrue(queries[2 + 2 * slice_index].endswith(
+                'FROM hawqverify_schema."public_orders_slice_{0}" t'.format(slice_index)
+            ))
+        self.assertTrue(self.verify.results['"public"."orders"']['passed'])
+
+    def test_same_row_count_but_different_rows(self):
+        self.verify_table((10, 1234), [(10, 4321)], {'backup_id': '20161003100000'})
+        self.assertFalse(self.verify.results['"public"."orders"']['passed'])
+
+    def test_mismatches_reported(self):
+        self.verify.results = {
+            '"public"."orders"': {'table_rows': 10, 'backup_rows': 9, 'passed': False},
+            '"public"."customers"': {'table_rows': 5, 'backup_rows': 5, 'passed': True}
+        }
+        self.assertRaises(SystemExit, self.verify._HdbVerify__report, [('"public"."items"', 'relation not found')])
+        messages = [message for level, message in self.recorder.messages]
+        self.assertTrue('PASS "public"."customers": 5 rows in the table, 5 rows in the backup' in messages)
+        self.assertTrue('FAIL "public"."orders": 10 rows in the table, 9 rows in the backup' in messages)
+        self.assertTrue(('ERROR', 'ERROR "public"."items": relation not found') in self.recorder.messages)
+        self.assertTrue('Verified 3 table(s): 1 passed, 1 failed, 1 could not be verified' in messages)
+
+    def test_matching_backup_reported(self):
+        self.verify.results = {'"public"."orders"': {'table_rows': 10, 'backup_rows': 10, 'passed': True}}
+        self.verify._HdbVerify__report([])
+
+    def test_tables_given_up_by_the_backup_fail(self):
+        self.verify.storage = MemoryStorage({
+            '/hawq_backup/20161003100000/sales/metadata/hdb_dump_20161003100000_manifest.json': json.dumps({
+                'tables': {'"public"."orders"': {'backup_id': '20161003100000'}},
+                'failed': {'"public"."items"': 'PXF server error'}
+            })
+        })
+        self.assertEqual(self.verify._HdbVerify__read_manifest().keys(), ['"public"."orders"'])
+        self.verify.results = {'"public"."orders"': {'table_rows': 10, 'backup_rows': 10, 'passed': True}}
+        self.assertRaises(SystemExit, self.verify._HdbVerify__report, [])
+        self.assertTrue(('ERROR', 'ERROR "public"."items": missing from the backup, it failed with: PXF server error')
+                        in self.recorder.messages)
+        self.assertTrue(('INFO', 'Verified 2 table(s): 1 passed, 0 failed, 1 could not be verified')
+                        in self.recorder.messages)
+
+
+if __name__ == '__main__':
+    unittest.main()